@@ -0,0 +1,404 @@
+"""
+Benchmarks of the spectrum synthesis and fitting.
+
+Every scenario is timed several times (the best and the median run are
+reported together with the throughput) and run once more under tracemalloc
+to measure the peak memory allocated by python and numpy. The results are
+saved as json, so that runs on different commits can be compared:
+
+    python benchmarks/bench.py -o before.json
+    git checkout other-branch
+    python benchmarks/bench.py -o after.json --compare before.json
+
+usage:
+------
+    python benchmarks/bench.py [-o results.json] [--compare baseline.json]
+                               [-k substring] [--quick] [--workers N]
+                               [--threads]
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import pathlib
+import platform
+import statistics
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Generic, TypeVar
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+import numpy  # noqa: E402
+
+from oes import spectrum  # noqa: E402
+from oes.measured_spectra import MeasuredSpectra, Parameters  # noqa: E402
+from oes.specdata import SpecDB, generate_spectrum  # noqa: E402
+
+MEASURED_CSV = ROOT / "test" / "OH_310nm_surfatron_80Hz_mod.csv"
+
+# temperatures cycled through by the synthesis scenarios, so that the caches
+# of populations in SpecDB do not turn the benchmark into a dictionary lookup
+TEMPERATURES = [(Trot, Tvib) for Trot in (500, 1500, 3000) for Tvib in (2000, 5000)]
+
+State = TypeVar("State")
+
+
+class Scenario(Generic[State]):
+    """
+    A benchmarked piece of code.
+
+    args:
+    -----
+    name: unique name of the scenario, used as key in the results
+    setup: called once, returns the state passed to `run`
+    run: the timed function, returns a dictionary of counts of the processed
+         units per run, e.g. {"spectra": 1, "residual_evaluations": 57}
+    repeat: how many times `run` is timed
+    warmup: run once before the timing, to fill the caches and do the lazy imports
+    teardown: called with the state after the measurement, e.g. to remove files
+    """
+
+    def __init__(
+        self,
+        name: str,
+        setup: Callable[[], State],
+        run: Callable[[State], dict[str, float]],
+        repeat: int = 20,
+        warmup: bool = True,
+        teardown: Callable[[State], None] | None = None,
+    ):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.repeat = repeat
+        self.warmup = warmup
+        self.teardown = teardown
+
+    def measure(self, repeat: int | None = None) -> dict[str, float]:
+        state = self.setup()
+        try:
+            return self._measure(state, repeat)
+        finally:
+            if self.teardown is not None:
+                self.teardown(state)
+
+    def _measure(self, state: State, repeat: int | None) -> dict[str, float]:
+        if self.warmup:
+            self.run(state)
+        times = []
+        counts: dict[str, float] = {}
+        for _ in range(repeat or self.repeat):
+            start = time.perf_counter()
+            counts = self.run(state)
+            times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            self.run(state)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        median = statistics.median(times)
+        result = {
+            "repeat": len(times),
+            "best_s": min(times),
+            "median_s": median,
+            "peak_memory_mb": peak / 2**20,
+        }
+        for unit, count in counts.items():
+            result[unit] = count
+            result[f"{unit}_per_s"] = count / median
+        return result
+
+
+def _synthesis_db() -> SpecDB:
+    return SpecDB("OHAX.db")
+
+
+def get_spectrum_scenario(width: float) -> Scenario[SpecDB]:
+    def run(db: SpecDB) -> dict[str, float]:
+        for Trot, Tvib in TEMPERATURES:
+            db.get_spectrum(Trot, Tvib, wmin=306, wmax=306 + width)
+        return {"spectra": len(TEMPERATURES)}
+
+    return Scenario(f"SpecDB.get_spectrum[{width:g}nm]", _synthesis_db, run)
+
+
+def generate_spectrum_scenario(
+    points_per_nm: int,
+) -> Scenario[tuple[Parameters, dict[str, SpecDB]]]:
+    def setup() -> tuple[Parameters, dict[str, SpecDB]]:
+        measured = MeasuredSpectra.from_csv(MEASURED_CSV)
+        specname = next(iter(measured.spectra))
+        measured.add_specie(_synthesis_db(), specname)
+        params = measured.spectra[specname]["params"]
+        params["slitf_gauss"].value = 2.5e-2
+        params["slitf_lorentz"].value = 2.5e-2
+        return params, measured.simulations
+
+    def run(state: tuple[Parameters, dict[str, SpecDB]]) -> dict[str, float]:
+        params, sims = state
+        for Trot, Tvib in TEMPERATURES:
+            params["OHAX_Trot"].value = Trot
+            params["OHAX_Tvib"].value = Tvib
+            generate_spectrum(
+                params,
+                step=params["wav_step"].value,
+                wmin=306,
+                wmax=316,
+                sims=sims,
+                points_per_nm=points_per_nm,
+            )
+        return {"spectra": len(TEMPERATURES)}
+
+    return Scenario(f"generate_spectrum[{points_per_nm}ppnm]", setup, run)
+
+
+def convolve_scenario(instrumental_step: float | None) -> Scenario[spectrum.Spectrum]:
+    def setup() -> spectrum.Spectrum:
+        lines = _synthesis_db().get_spectrum(2000, 4000, wmin=306, wmax=316)
+        assert isinstance(lines, spectrum.Spectrum)
+        lines.refine_mesh(points_per_nm=1000)
+        return lines
+
+    def run(lines: spectrum.Spectrum) -> dict[str, float]:
+        spec = spectrum.Spectrum(x=lines.x, y=lines.y.copy())
+        spec.convolve_with_slit_function(
+            gauss=0.025, lorentz=0.025, instrumental_step=instrumental_step
+        )
+        return {"spectra": 1}
+
+    label = "no_step" if instrumental_step is None else f"step={instrumental_step:g}"
+    return Scenario(f"convolve_with_slit_function[{label}]", setup, run)
+
+
+def slit_kernel_scenario(profile: str) -> Scenario[None]:
+    def run(_) -> dict[str, float]:
+        # the cache would turn all but the first kernel into a lookup
+        spectrum.clear_slit_kernel_cache()
+        for gauss in (0.01, 0.025, 0.05):
+            spectrum.slit_kernel(
+                gauss, 0.025, 1e-3, instrumental_step=0.02, profile=profile
+            )
+        return {"kernels": 3}
+
+    return Scenario(f"slit_kernel[{profile}]", lambda: None, run)
+
+
+def _measured_spectra() -> MeasuredSpectra:
+    """the same starting point as in test/test_measured_spectra.py"""
+    measured = MeasuredSpectra.from_csv(MEASURED_CSV)
+    db = _synthesis_db()
+    for specname in measured.spectra:
+        measured.add_specie(db, specname)
+        params = measured.spectra[specname]["params"]
+        params["wav_shift"].value = -0.02
+        params["slitf_gauss"].value = 2.5e-2
+        params["slitf_lorentz"].value = 2.5e-2
+        params["slitf_gauss"].min = 0
+        params["slitf_lorentz"].min = 0
+    return measured
+
+
+def fit_scenario() -> Scenario[tuple[MeasuredSpectra, Any, Any]]:
+    def setup() -> tuple[MeasuredSpectra, Any, Any]:
+        measured = _measured_spectra()
+        specname = next(iter(measured.spectra))
+        return measured, specname, measured.spectra[specname]["params"].prms.copy()
+
+    def run(state: tuple[MeasuredSpectra, Any, Any]) -> dict[str, float]:
+        measured, specname, initial = state
+        measured.spectra[specname]["params"].prms = initial.copy()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = measured.fit(specname)
+        return {"fits": 1, "residual_evaluations": result.nfev}
+
+    return Scenario("MeasuredSpectra.fit", setup, run, repeat=5)
+
+
+def fit_all_scenario(workers: int, threads: bool = False) -> Scenario[None]:
+    def run(measured: MeasuredSpectra) -> dict[str, float]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = measured.fit_all(
+                workers=workers, threads=threads, progress=lambda *args: None
+            )
+        return {
+            "fits": len(results),
+            "residual_evaluations": sum(r.nfev for r in results.values()),
+        }
+
+    # every run starts from the initial values again, the fits take minutes
+    return Scenario(
+        f"MeasuredSpectra.fit_all[{'threads' if threads else 'workers'}={workers}]",
+        lambda: None,
+        lambda _: run(_measured_spectra()),
+        repeat=1,
+        warmup=False,
+    )
+
+
+def ingest_scenario(
+    name: str, load: Callable[[pathlib.Path], MeasuredSpectra | numpy.ndarray]
+) -> Scenario[pathlib.Path]:
+    """load(directory) reads the test csv, or its copies in the directory"""
+
+    def setup() -> pathlib.Path:
+        directory = pathlib.Path(tempfile.mkdtemp(prefix="oes_bench_"))
+        for i in range(INGEST_FILES):
+            shutil.copy(MEASURED_CSV, directory / f"{i}.csv")
+        return directory
+
+    def run(directory: pathlib.Path) -> dict[str, float]:
+        loaded = load(directory)
+        files = INGEST_FILES if "from_csv_dir" in name else 1
+        if isinstance(loaded, MeasuredSpectra):
+            number_of_spectra = len(loaded.spectra)
+        else:  # the array of numpy.genfromtxt()
+            number_of_spectra = loaded.shape[1] - 1
+        return {
+            "spectra": number_of_spectra,
+            "MB": files * MEASURED_CSV.stat().st_size / 2**20,
+        }
+
+    return Scenario(name, setup, run, repeat=10, teardown=shutil.rmtree)
+
+
+INGEST_FILES = 8
+
+
+def ingest_scenarios() -> list[Scenario[pathlib.Path]]:
+    return [
+        ingest_scenario(
+            "numpy.genfromtxt", lambda _: numpy.genfromtxt(MEASURED_CSV, delimiter=",")
+        ),
+        ingest_scenario(
+            "MeasuredSpectra.from_csv", lambda _: MeasuredSpectra.from_csv(MEASURED_CSV)
+        ),
+        ingest_scenario(
+            "MeasuredSpectra.from_csv[columnar]",
+            lambda _: MeasuredSpectra.from_csv(MEASURED_CSV, columnar=True),
+        ),
+        ingest_scenario(
+            "MeasuredSpectra.ingest_csv[chunksize=256]",
+            lambda directory: MeasuredSpectra.ingest_csv(
+                MEASURED_CSV, directory / "ingested", chunksize=256
+            ),
+        ),
+        ingest_scenario(
+            f"MeasuredSpectra.from_csv_dir[{INGEST_FILES} files, columnar]",
+            lambda directory: MeasuredSpectra.from_csv_dir(directory, columnar=True),
+        ),
+    ]
+
+
+def scenarios(workers: int, threads: bool = False) -> list[Scenario[Any]]:
+    return [
+        *ingest_scenarios(),
+        *(get_spectrum_scenario(width) for width in (1, 10, 50)),
+        *(generate_spectrum_scenario(ppnm) for ppnm in (200, 1000, 5000)),
+        convolve_scenario(None),
+        convolve_scenario(0.02),
+        *(slit_kernel_scenario(profile) for profile in spectrum.VOIGT_PROFILES),
+        fit_scenario(),
+        fit_all_scenario(workers, threads),
+    ]
+
+
+def metadata() -> dict[str, str]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = "unknown"
+    return {
+        "commit": commit,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "machine": platform.platform(),
+    }
+
+
+def compare(results: dict, baseline: dict) -> str:
+    """table of median times and peak memory relative to the baseline"""
+    lines = [
+        f"{'scenario':45} {'median':>10} {'baseline':>10} {'speedup':>8} {'memory':>8}"
+    ]
+    for name, result in results.items():
+        if name not in baseline:
+            lines.append(f"{name:45} {result['median_s']:10.4g} {'-':>10}")
+            continue
+        base = baseline[name]
+        speedup = base["median_s"] / result["median_s"]
+        memory = result["peak_memory_mb"] / max(base["peak_memory_mb"], 1e-9)
+        lines.append(
+            f"{name:45} {result['median_s']:10.4g} {base['median_s']:10.4g} "
+            f"{speedup:7.2f}x {memory:7.2f}x"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-o", "--output", help="save the results to this json file")
+    parser.add_argument("--compare", help="json file with results of an earlier run")
+    parser.add_argument(
+        "-k", dest="select", help="run only scenarios containing this substring"
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="time every scenario only 3 times"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="worker processes of the full-file fit"
+    )
+    parser.add_argument(
+        "--threads",
+        action="store_true",
+        help="run the workers of the full-file fit as threads",
+    )
+    args = parser.parse_args(argv)
+
+    results = {}
+    for scenario in scenarios(args.workers, args.threads):
+        if args.select and args.select not in scenario.name:
+            continue
+        repeat = min(scenario.repeat, 3) if args.quick else None
+        result = scenario.measure(repeat)
+        results[scenario.name] = result
+        throughput = ", ".join(
+            f"{value:.4g} {key}"
+            for key, value in result.items()
+            if key.endswith("_per_s")
+        )
+        print(
+            f"{scenario.name:45} {result['median_s']:10.4g} s  "
+            f"{result['peak_memory_mb']:8.2f} MB  {throughput}",
+            flush=True,
+        )
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump({"metadata": metadata(), "results": results}, fp, indent=2)
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        print(f"\ncompared to {baseline['metadata']['commit']}:")
+        print(compare(results, baseline["results"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import os
+import threading
+import traceback
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+
+from oes.measured_spectra import MeasuredSpectra
+
+
+class BackgroundFit(QObject):
+    """
+    Fits spectra of a MeasuredSpectra by a pool of threads, while the GUI
+    thread keeps handling events. The signals are delivered to the thread
+    the BackgroundFit lives in (the GUI thread), one per spectrum as soon
+    as its fit finishes.
+
+    The fits run by MeasuredSpectra.fit_isolated(), the threads share the
+    SpecDB objects only. cancel() drops the fits not started yet and aborts
+    the running ones at their next evaluation of residuals.
+    """
+
+    started = Signal(object)  # specname
+    fitted = Signal(object, object)  # specname, lmfit.MinimizerResult
+    cancelled = Signal(object)  # specname
+    failed = Signal(object, str)  # specname, traceback
+    progress = Signal(int, int)  # done, total
+    finished = Signal()
+
+    def __init__(
+        self,
+        measured: MeasuredSpectra,
+        specnames: list,
+        workers: int | None = None,
+        parent: QObject | None = None,
+        **fit_kwargs,
+    ):
+        """
+        args:
+        -----
+        measured: MeasuredSpectra with the species added
+        specnames: identificators of the spectra to fit
+        workers: number of threads, defaults to os.cpu_count()
+        parent: QObject owning this one
+
+        **fit_kwargs: passed to MeasuredSpectra.fit()
+        """
+        super().__init__(parent)
+        self.measured = measured
+        self.specnames = list(specnames)
+        self.fit_kwargs = fit_kwargs
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(workers or os.cpu_count() or 1)
+        self.done = 0
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._pending: set = set()
+        self._fitting: set = set()
+        self._signals = _TaskSignals()
+        self._signals.started.connect(self.started)
+        self._signals.done.connect(self._task_done)
+
+    @property
+    def running(self) -> bool:
+        return self.done < len(self.specnames)
+
+    def start(self):
+        with self._lock:
+            self._pending = set(self.specnames)
+        if not self.specnames:
+            self.finished.emit()
+        for specname in self.specnames:
+            self.pool.start(_FitTask(self, specname))
+
+    def cancel(self):
+        """Stop the fitting, the spectra not fitted are reported as cancelled."""
+        self._cancel.set()
+        self.pool.clear()
+        with self._lock:
+            not_started = [name for name in self.specnames if name in self._pending]
+            self._pending.clear()
+        for specname in not_started:
+            self._task_done(specname, None, None)
+
+    def is_fitting(self, specname) -> bool:
+        """True while a thread is fitting the spectrum and changing its params"""
+        with self._lock:
+            return specname in self._fitting
+
+    def wait(self, msecs: int = -1) -> bool:
+        """block until all the threads are done, True if they are"""
+        return self.pool.waitForDone(msecs)
+
+    def _claim(self, specname) -> bool:
+        """called by a task when it starts, False if it was cancelled meanwhile"""
+        with self._lock:
+            if self._cancel.is_set() or specname not in self._pending:
+                return False
+            self._pending.discard(specname)
+            self._fitting.add(specname)
+            return True
+
+    def _abort(self, *args, **kwargs) -> bool:
+        return self._cancel.is_set()
+
+    def _task_done(self, specname, result, error):
+        with self._lock:
+            self._fitting.discard(specname)
+        self.done += 1
+        if error is not None:
+            self.failed.emit(specname, error)
+        elif result is None or result.aborted:
+            self.cancelled.emit(specname)
+        else:
+            self.fitted.emit(specname, result)
+        self.progress.emit(self.done, len(self.specnames))
+        if self.done == len(self.specnames):
+            self.finished.emit()
+
+
+class _TaskSignals(QObject):
+    started = Signal(object)
+    done = Signal(object, object, object)  # specname, result, formatted exception
+
+
+class _FitTask(QRunnable):
+    def __init__(self, fit: BackgroundFit, specname):
+        super().__init__()
+        self.fit = fit
+        self.specname = specname
+
+    def run(self):
+        if not self.fit._claim(self.specname):
+            return  # reported by BackgroundFit.cancel()
+        self.fit._signals.started.emit(self.specname)
+        try:
+            result = self.fit.measured.fit_isolated(
+                self.specname, iter_cb=self.fit._abort, **self.fit.fit_kwargs
+            )
+        except Exception:
+            self.fit._signals.done.emit(self.specname, None, traceback.format_exc())
+            return
+        self.fit._signals.done.emit(self.specname, result, None)
@@ -4,21 +4,46 @@ from PySide6.QtWidgets import (
     QVBoxLayout,
     QFileDialog,
     QMainWindow,
+    QProgressBar,
+    QSplitter,
+    QTableWidget,
+    QTableWidgetItem,
 )
-import read_data
+from PySide6.QtCore import Qt
+from background_fit import BackgroundFit
+from spectrum_view import SpectrumView
+from oes.measured_spectra import MeasuredSpectra
+from oes.specdata import SpecDB
 
 
 class SpecWindow(QMainWindow):
+    # columns of the results table after the spectrum and the status,
+    # the temperatures are added for each specie
+    RESULT_COLUMNS = ["redchi", "nfev"]
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.title = "SpecApp"
         self.layout = QVBoxLayout()
         self.setWindowTitle(self.title)
+        self.species = ["OHAX.db"]
+        self.measured_data = None
+        self.background_fit = None
+        self.results_table = QTableWidget(self)
+        self.results_table.currentCellChanged.connect(
+            lambda row, *args: self.show_spectrum(self.specname_at(row))
+        )
+        self.spectrum_view = SpectrumView(self)
+        self.shown_specname = None
+        splitter = QSplitter(Qt.Vertical, self)
+        splitter.addWidget(self.spectrum_view)
+        splitter.addWidget(self.results_table)
+        self.setCentralWidget(splitter)
+        self.progress_bar = QProgressBar(self)
+        self.statusBar().addPermanentWidget(self.progress_bar)
         self.menu_actions()
         self.show()
 
-        self.measured_data = None
-
     def menu_actions(self):
         self.menuBar = self.menuBar()
         self.fileMenu = self.menuBar.addMenu("File")
@@ -27,16 +52,151 @@ class SpecWindow(QMainWindow):
         self.actionQuit = self.fileMenu.addAction("Exit")
         self.actionQuit.triggered.connect(sys.exit)
 
+        self.fitMenu = self.menuBar.addMenu("Fit")
+        self.actionFitAll = self.fitMenu.addAction("Fit all")
+        self.actionFitAll.triggered.connect(lambda: self.fit_spectra())
+        self.actionCancelFit = self.fitMenu.addAction("Cancel")
+        self.actionCancelFit.triggered.connect(self.cancel_fit)
+        self.update_actions()
+
     def open_file_dialog(self):
         dialog = QFileDialog()
         filename = dialog.getOpenFileName()
-        if filename:
-            self.title = f"SpecApp - {filename[0]}"
-            self.data = read_data.read_data(filename[0])
-            print(self.data)
+        if filename[0]:
+            self.load_file(filename[0])
         else:
             self.title = "SpecApp"
+            self.setWindowTitle(self.title)
+
+    def load_file(self, filename):
+        """read the measured spectra and add self.species to all of them"""
+        self.cancel_fit()
+        self.title = f"SpecApp - {filename}"
+        self.measured_data = MeasuredSpectra.from_csv(filename, columnar=True)
+        for specie in self.species:
+            self.measured_data.add_specie_to_all(SpecDB(specie))
         self.setWindowTitle(self.title)
+        self.reset_results_table()
+        self.update_actions()
+
+    def reset_results_table(self):
+        species = list(self.measured_data.simulations)
+        self.result_columns = [
+            f"{specie}_{T}" for specie in species for T in ("Trot", "Tvib")
+        ] + self.RESULT_COLUMNS
+        self.results_table.clear()
+        self.results_table.setColumnCount(2 + len(self.result_columns))
+        self.results_table.setHorizontalHeaderLabels(
+            ["spectrum", "status"] + self.result_columns
+        )
+        self.results_table.setRowCount(len(self.measured_data.spectra))
+        self.rows = {}
+        for row, specname in enumerate(self.measured_data.spectra):
+            self.rows[specname] = row
+            self.results_table.setItem(row, 0, QTableWidgetItem(str(specname)))
+            self.set_status(specname, "not fitted")
+        self.shown_specname = None
+        self.results_table.setCurrentCell(0, 0)
+
+    def specname_at(self, row):
+        specnames = list(self.rows)
+        return specnames[row] if 0 <= row < len(specnames) else None
+
+    def show_spectrum(self, specname):
+        """plot the measured spectrum with the model of its current params"""
+        if specname is None or specname not in self.rows:
+            return
+        measured = self.measured_data.get_measured_spectrum(specname)
+        if specname == self.shown_specname:
+            self.spectrum_view.set_model(self.model(specname, measured))
+        else:
+            self.spectrum_view.set_spectrum(
+                measured.x, measured.y, self.model(specname, measured)
+            )
+        self.shown_specname = specname
+
+    def model(self, specname, measured):
+        params = self.measured_data.spectra[specname]["params"]
+        if not params.info["species"]:
+            return None
+        if self.fit_running() and self.background_fit.is_fitting(specname):
+            # the params belong to the fit in its thread until it is done,
+            # get_residuals() would store its own values in them
+            return None
+        residuals = self.measured_data.get_residuals(params.prms, specname)
+        return measured.y + residuals
+
+    def set_status(self, specname, status):
+        self.results_table.setItem(self.rows[specname], 1, QTableWidgetItem(status))
+
+    def fit_spectra(self, specnames=None, **fit_kwargs):
+        """
+        Start fitting the spectra (all by default) in the background.
+        The results are shown in the table as the fits finish.
+
+        **fit_kwargs: passed to MeasuredSpectra.fit()
+        """
+        if self.measured_data is None or self.fit_running():
+            return
+        if specnames is None:
+            specnames = list(self.measured_data.spectra)
+        self.background_fit = BackgroundFit(
+            self.measured_data, specnames, parent=self, **fit_kwargs
+        )
+        self.background_fit.started.connect(
+            lambda specname: self.set_status(specname, "fitting")
+        )
+        self.background_fit.fitted.connect(self.show_result)
+        self.background_fit.cancelled.connect(
+            lambda specname: self.set_status(specname, "cancelled")
+        )
+        self.background_fit.failed.connect(
+            lambda specname, error: self.set_status(specname, "failed")
+        )
+        self.background_fit.progress.connect(self.show_progress)
+        self.background_fit.finished.connect(self.update_actions)
+        for specname in specnames:
+            self.set_status(specname, "waiting")
+        self.progress_bar.setRange(0, len(specnames))
+        self.progress_bar.setValue(0)
+        self.background_fit.start()
+        self.update_actions()
+
+    def cancel_fit(self):
+        if self.fit_running():
+            self.background_fit.cancel()
+
+    def fit_running(self):
+        return self.background_fit is not None and self.background_fit.running
+
+    def show_result(self, specname, result):
+        self.set_status(specname, "fitted" if result.success else "not converged")
+        row = self.rows[specname]
+        values = {name: param.value for name, param in result.params.items()}
+        values["redchi"] = result.redchi
+        values["nfev"] = result.nfev
+        for column, name in enumerate(self.result_columns, start=2):
+            if name in values:
+                item = QTableWidgetItem(f"{values[name]:.6g}")
+                self.results_table.setItem(row, column, item)
+        if specname == self.shown_specname:
+            self.show_spectrum(specname)  # only the model is replaced
+
+    def show_progress(self, done, total):
+        self.progress_bar.setValue(done)
+        self.statusBar().showMessage(f"fitted {done}/{total}")
+
+    def update_actions(self):
+        running = self.fit_running()
+        self.actionOpen.setEnabled(not running)
+        self.actionFitAll.setEnabled(self.measured_data is not None and not running)
+        self.actionCancelFit.setEnabled(running)
+
+    def closeEvent(self, event):
+        self.cancel_fit()
+        if self.background_fit is not None:
+            self.background_fit.wait()
+        super().closeEvent(event)
 
 
 if __name__ == "__main__":
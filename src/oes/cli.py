@@ -0,0 +1,184 @@
+"""
+Fit measured spectra from the command line.
+
+Every spectrum of the input files (csv as read by MeasuredSpectra.from_csv(),
+json as saved by MeasuredSpectra.to_json()) is fitted by the given species,
+spread over N worker processes. The results (see MeasuredSpectra.result_row())
+are appended to the output csv as soon as each fit finishes, so that nothing
+is lost when the run is interrupted and the memory does not grow with the
+number of spectra. Running the same command again skips the spectra already
+in the output.
+
+usage:
+------
+    python -m oes.cli spectra.csv [more.csv|.json ...] -o results.csv
+                      [-s OHAX] [-p start.json] [-w N] [--threads]
+                      [--maxiter N] [--method leastsq] [--profile wofz]
+                      [--coarse]
+
+The species are names of SpecDB databases in DATA_DIR (src/oes/data), with
+or without the .db suffix, e.g. OHAX or OHAX.db. The optional json of starting parameters maps the
+names of the parameters to values or to dicts of the arguments of
+lmfit.Parameter.set(), e.g. {"OHAX_Trot": 3000, "wav_shift": {"vary": false}},
+and is applied to all the spectra.
+"""
+
+import argparse
+import csv
+import json
+import pathlib
+import sys
+from typing import Any
+
+from oes.measured_spectra import MeasuredSpectra
+from oes.specdata import SpecDB
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = _parser().parse_args(argv)
+    output = pathlib.Path(args.output)
+    columns, done = _read_output(output)
+    start = _read_start(args.params) if args.params else {}
+    fit_kwargs = {"maxiter": args.maxiter, "method": args.method}
+    if args.profile is not None:
+        fit_kwargs["profile"] = args.profile
+    if args.coarse:
+        fit_kwargs["coarse"] = True
+
+    for filename in args.inputs:
+        measured = load(filename, args.species, start)
+        file_columns = ["file"] + measured.result_columns()
+        if columns is None:
+            columns = file_columns
+            with open(output, "w", newline="") as fp:
+                csv.writer(fp).writerow(columns)
+        elif file_columns != columns:
+            sys.exit(
+                f"The columns of {output} differ from those of {filename}: "
+                f"{columns} != {file_columns}"
+            )
+
+        specnames = [
+            specname
+            for specname in measured.spectra
+            if (str(filename), str(specname)) not in done
+        ]
+        skipped = len(measured.spectra) - len(specnames)
+        if skipped:
+            print(f"{filename}: {skipped} spectra already in {output}", file=sys.stderr)
+        if not specnames:
+            continue
+
+        with open(output, "a", newline="") as fp:
+            writer = csv.DictWriter(fp, fieldnames=columns)
+
+            def write_row(count, total, specname):
+                writer.writerow(dict(measured.result_row(specname), file=filename))
+                fp.flush()
+                print(
+                    f"{filename}: fitted {count}/{total}: {specname}", file=sys.stderr
+                )
+
+            measured.fit_many(
+                specnames,
+                workers=args.workers,
+                progress=write_row,
+                threads=args.threads,
+                keep_results=False,
+                **fit_kwargs,
+            )
+    return 0
+
+
+def load(
+    filename: str, species: list[str], start: dict[str, dict[str, Any]]
+) -> MeasuredSpectra:
+    """
+    Read the spectra, add the species and set the starting parameters.
+
+    args:
+    -----
+    filename: csv or json file with the measured spectra
+    species: names of the SpecDB databases in DATA_DIR, added to all the spectra
+    start: {parameter name: kwargs of lmfit.Parameter.set()}
+
+    return:
+    -------
+    measured: MeasuredSpectra ready to be fitted
+    """
+    if pathlib.Path(filename).suffix.lower() == ".json":
+        measured = MeasuredSpectra.from_json(filename)
+    else:
+        measured = MeasuredSpectra.from_csv(filename, columnar=True)
+    for specie in species:
+        if not pathlib.Path(specie).suffix:
+            specie += ".db"
+        measured.add_specie_to_all(SpecDB(specie))
+    if not measured.simulations:
+        sys.exit(f"No species to fit {filename} by, use --species!")
+
+    for specname in measured.spectra:
+        prms = measured.spectra[specname]["params"].prms
+        for name, kwargs in start.items():
+            if name in prms:
+                prms[name].set(**kwargs)
+    return measured
+
+
+def _read_output(output: pathlib.Path) -> tuple[list[str] | None, set]:
+    """the header and the (file, spectrum) keys of the rows already in output"""
+    if not output.exists() or output.stat().st_size == 0:
+        return None, set()
+    with open(output, newline="") as fp:
+        reader = csv.DictReader(fp)
+        done = {(row["file"], row["spectrum"]) for row in reader}
+        return list(reader.fieldnames or []), done
+
+
+def _read_start(filename: str) -> dict[str, dict[str, Any]]:
+    with open(filename) as fp:
+        loaded = json.load(fp)
+    return {
+        name: value if isinstance(value, dict) else {"value": value}
+        for name, value in loaded.items()
+    }
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="oes-fit", description=__doc__.split("\n\n")[1].replace("\n", " ")
+    )
+    parser.add_argument("inputs", nargs="+", help="csv or json files with spectra")
+    parser.add_argument(
+        "-o", "--output", required=True, help="csv file the results are appended to"
+    )
+    parser.add_argument(
+        "-s",
+        "--species",
+        action="append",
+        default=[],
+        help="SpecDB database in DATA_DIR to fit by, e.g. OHAX "
+        "(repeat for more species)",
+    )
+    parser.add_argument("-p", "--params", help="json file with starting parameters")
+    parser.add_argument(
+        "-w", "--workers", type=int, help="number of workers, defaults to all CPUs"
+    )
+    parser.add_argument(
+        "--threads", action="store_true", help="use threads instead of processes"
+    )
+    parser.add_argument("--maxiter", type=int, default=2000)
+    parser.add_argument("--method", default="leastsq", help="lmfit method")
+    parser.add_argument(
+        "--profile", choices=["wofz", "pseudo_voigt"], help="voigt profile evaluation"
+    )
+    parser.add_argument(
+        "--coarse",
+        action="store_true",
+        help="fit binned pixels first, see MeasuredSpectra.fit(coarse=True)",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(main())
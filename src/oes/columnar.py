@@ -0,0 +1,306 @@
+import copy
+import json
+import os
+import pathlib
+import tempfile
+from collections.abc import Hashable, Iterator, Mapping, MutableMapping
+from typing import Any, Literal
+
+import numpy
+
+from oes import spectrum
+
+
+class ColumnarSpectra(MutableMapping):
+    """
+    Measured spectra sharing one wavelength axis, stored as a single 2D block
+    of intensities of shape (number of spectra, number of pixels). The block can
+    be a numpy.memmap, so that a campaign with tens of thousands of spectra is
+    opened without reading it into memory.
+
+    Behaves like the OrderedDict MeasuredSpectra.spectra, i.e.
+    {specname: {'spectrum': Spectrum, 'params': Parameters}}. The entries are
+    made on demand: 'spectrum' is a Spectrum with views into the shared
+    arrays, 'params' are created at the first access as a deep copy of
+    self.template and kept from then on.
+    """
+
+    KEYS = ("spectrum", "params")
+
+    def __init__(
+        self,
+        x: numpy.ndarray,
+        y: numpy.ndarray,
+        names: list[Hashable] | None = None,
+        template: Any = None,
+        params: dict[Hashable, Any] | None = None,
+    ):
+        """
+        args:
+        -----
+        x: 1D array, the wavelength axis shared by all the spectra
+        y: 2D array of shape (len(names), len(x)), one spectrum per row
+        names: identificators of the spectra, defaults to 0, 1, ...
+        template: Parameters object copied for spectra without params
+        params: {specname: Parameters} of the spectra with params already set
+        """
+        if y.ndim != 2 or y.shape[1] != len(x):
+            raise ValueError(
+                f"Intensities of shape {y.shape} do not match {len(x)} wavelengths!"
+            )
+        if names is None:
+            names = list(range(y.shape[0]))
+        if len(names) != y.shape[0]:
+            raise ValueError(f"{len(names)} names given for {y.shape[0]} spectra!")
+        self.x = x
+        self.y = y
+        self.rows = {name: row for row, name in enumerate(names)}
+        if len(self.rows) != len(names):
+            raise ValueError("The names of the spectra are not unique!")
+        self.template = template
+        self.params = dict(params or {})
+
+    def __getitem__(self, specname: Hashable) -> "_ColumnarEntry":
+        if specname not in self.rows:
+            raise KeyError(specname)
+        return _ColumnarEntry(self, specname)
+
+    def __setitem__(self, specname: Hashable, entry: Mapping):
+        """
+        Spectra with other x-axis than self.x can not be stored. Adding a new
+        specname copies the intensity block into memory.
+        """
+        if "spectrum" in entry:
+            self.set_spectrum(specname, entry["spectrum"])
+        elif specname not in self.rows:
+            raise KeyError(f"New spectrum {specname} needs the 'spectrum' entry!")
+        if "params" in entry:
+            self.params[specname] = entry["params"]
+
+    def __delitem__(self, specname: Hashable):
+        del self.rows[specname]
+        self.params.pop(specname, None)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self.rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, specname: object) -> bool:
+        return specname in self.rows
+
+    def get_spectrum(self, specname: Hashable) -> spectrum.Spectrum:
+        """Spectrum object viewing the row of the block, nothing is copied"""
+        return spectrum.Spectrum(x=self.x, y=self.y[self.rows[specname]])
+
+    def set_spectrum(self, specname: Hashable, spec: spectrum.Spectrum):
+        if not numpy.array_equal(spec.x, self.x):
+            raise ValueError(
+                "The spectrum does not share the wavelengths of the others!"
+            )
+        if specname in self.rows:
+            row = self.rows[specname]
+            if not numpy.shares_memory(spec.y, self.y[row]):
+                self.y[row] = spec.y
+        else:
+            self.rows[specname] = self.y.shape[0]
+            self.y = numpy.vstack([self.y, spec.y])
+
+    def get_params(self, specname: Hashable) -> Any:
+        if specname not in self.params:
+            if specname not in self.rows:
+                raise KeyError(specname)
+            self.params[specname] = copy.deepcopy(self.template)
+        return self.params[specname]
+
+    def save(self, directory: str | pathlib.Path):
+        """
+        Save the wavelengths and intensities as x.npy and y.npy and the names of
+        the spectra as index.json into the directory (created if necessary).
+        Deleted spectra are dropped. The params are not saved, see
+        MeasuredSpectra.save_columnar().
+        """
+        directory = pathlib.Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        rows = list(self.rows.values())
+        unchanged = rows == list(range(self.y.shape[0]))
+        if self._mapped_from(directory / "y.npy"):
+            # saving into the directory opened by ColumnarSpectra.open()
+            if not unchanged:
+                raise ValueError("Can not overwrite the memory-mapped file!")
+            if isinstance(self.y, numpy.memmap) and self.y.flags.writeable:
+                self.y.flush()
+        elif unchanged:
+            numpy.save(directory / "y.npy", numpy.asarray(self.y))
+        else:
+            numpy.save(directory / "y.npy", self.y[rows])
+        numpy.save(directory / "x.npy", numpy.asarray(self.x))
+        with open(directory / "index.json", "w") as fp:
+            json.dump({"names": list(self.rows)}, fp)
+
+    def _mapped_from(self, path: pathlib.Path) -> bool:
+        if not isinstance(self.y, numpy.memmap) or self.y.filename is None:
+            return False
+        return path.exists() and path.samefile(self.y.filename)
+
+    @classmethod
+    def open(
+        cls,
+        directory: str | pathlib.Path,
+        mmap_mode: Literal["r", "r+", "c"] | None = "r",
+        template: Any = None,
+    ) -> "ColumnarSpectra":
+        """
+        Open spectra saved by ColumnarSpectra.save().
+
+        args:
+        -----
+        directory: path to the directory
+        mmap_mode: passed to numpy.load(). With the default 'r', the intensities are
+                   read from the disk only when used and can not be changed, with
+                   'r+' the changes are written to the file, with 'c' they are kept
+                   in memory only. None reads the whole block into memory.
+        template: see ColumnarSpectra.__init__()
+        """
+        directory = pathlib.Path(directory)
+        with open(directory / "index.json") as fp:
+            names = json.load(fp)["names"]
+        return cls(
+            numpy.load(directory / "x.npy"),
+            numpy.load(directory / "y.npy", mmap_mode=mmap_mode),
+            names=[name_from_json(name) for name in names],
+            template=template,
+        )
+
+
+def read_csv(
+    filename: str | os.PathLike, delimiter: str = ","
+) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Read a file with the wavelengths in the first column and one spectrum per
+    each other column by the C parser of pandas, several times faster than
+    numpy.genfromtxt(). The values may differ from those parsed by numpy in the
+    last digit (the relative difference is below 1e-15).
+
+    return:
+    -------
+    (x, y): x is 1D array of the wavelengths, y is C-contiguous 2D array with one
+            spectrum per row, shape (number of columns - 1, len(x))
+    """
+    data = _parse_csv(filename, delimiter)
+    return data[:, 0].copy(), numpy.ascontiguousarray(data[:, 1:].T)
+
+
+def ingest_csv(
+    filename: str | os.PathLike,
+    directory: str | os.PathLike,
+    delimiter: str = ",",
+    chunksize: int = 2**16,
+) -> ColumnarSpectra:
+    """
+    Convert a csv file (see read_csv()) into a directory readable by
+    ColumnarSpectra.open(), reading chunksize lines at once. Files bigger
+    than the memory can be converted, the spectra are memory-mapped from the
+    directory afterwards. The names of the spectra are 1, 2, ... as in
+    MeasuredSpectra.from_csv().
+    """
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    x_chunks = []
+    number_of_spectra = 0
+    with tempfile.TemporaryFile(dir=directory) as raw:
+        # the csv has a line per pixel, the columnar block a row per spectrum:
+        # the chunks are stored as they are and transposed afterwards
+        for chunk in _parse_csv(filename, delimiter, chunksize=chunksize):
+            x_chunks.append(chunk[:, 0].copy())
+            raw.write(numpy.ascontiguousarray(chunk[:, 1:]).tobytes())
+            number_of_spectra = chunk.shape[1] - 1
+        if not x_chunks:
+            raise ValueError(f"No spectra found in {filename}!")
+        x = numpy.concatenate(x_chunks)
+        raw.flush()
+
+        pixels = numpy.memmap(
+            raw, dtype=numpy.float64, mode="r", shape=(len(x), number_of_spectra)
+        )
+        y = numpy.lib.format.open_memmap(
+            directory / "y.npy",
+            mode="w+",
+            dtype=numpy.float64,
+            shape=(number_of_spectra, len(x)),
+        )
+        for start in range(0, len(x), chunksize):
+            y[:, start : start + chunksize] = pixels[start : start + chunksize].T
+        y.flush()
+        del pixels, y
+
+    numpy.save(directory / "x.npy", x)
+    with open(directory / "index.json", "w") as fp:
+        json.dump({"names": list(range(1, number_of_spectra + 1))}, fp)
+    return ColumnarSpectra.open(directory)
+
+
+def _parse_csv(filename, delimiter, chunksize=None):
+    import pandas
+
+    try:
+        parsed = pandas.read_csv(
+            filename,
+            sep=delimiter,
+            header=None,
+            dtype=numpy.float64,
+            chunksize=chunksize,
+        )
+    except pandas.errors.EmptyDataError:
+        if chunksize is None:
+            raise
+        return iter(())  # no chunks, the callers report the empty file
+    if chunksize is None:
+        return parsed.to_numpy()
+    return (chunk.to_numpy() for chunk in parsed)
+
+
+class _ColumnarEntry(MutableMapping):
+    """{'spectrum': Spectrum, 'params': Parameters} of one spectrum of ColumnarSpectra"""
+
+    __slots__ = ("spectra", "specname")
+
+    def __init__(self, spectra: ColumnarSpectra, specname: Hashable):
+        self.spectra = spectra
+        self.specname = specname
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "spectrum":
+            return self.spectra.get_spectrum(self.specname)
+        if key == "params":
+            return self.spectra.get_params(self.specname)
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any):
+        if key == "spectrum":
+            self.spectra.set_spectrum(self.specname, value)
+        elif key == "params":
+            self.spectra.params[self.specname] = value
+        else:
+            raise KeyError(f"Only {ColumnarSpectra.KEYS} can be stored!")
+
+    def __delitem__(self, key: str):
+        raise TypeError("Entries of ColumnarSpectra can not be deleted!")
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(ColumnarSpectra.KEYS)
+
+    def __len__(self) -> int:
+        return len(ColumnarSpectra.KEYS)
+
+    def __contains__(self, key: object) -> bool:
+        # the params exist implicitly, do not create them just by asking
+        return key in ColumnarSpectra.KEYS
+
+
+def name_from_json(name: Any) -> Hashable:
+    """names of spectra loaded from json, which turns tuples into lists"""
+    if isinstance(name, list):
+        return tuple(name_from_json(item) for item in name)
+    return name
@@ -1,14 +1,49 @@
+import contextlib
+import functools
 import json
+import os
+import pathlib
 import pickle
+import time
 import warnings
 from collections import OrderedDict
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from typing import TYPE_CHECKING, Any, Callable, Iterable
 
-import lmfit
 import numpy
-import pandas
-from asteval import valid_symbol_name
 
-from oes.specdata import SpecDB, generate_spectrum, spectrum
+from oes import profiling
+from oes.columnar import ColumnarSpectra, ingest_csv, name_from_json, read_csv
+from oes.specdata import SpecDB, SynthesisCache, generate_spectrum, spectrum
+
+# lmfit, asteval and pandas take most of the import time of the package, they
+# are imported by the functions using them
+if TYPE_CHECKING:
+    import lmfit
+
+
+NPZ_FORMAT_VERSION = 1
+# attributes of MeasuredSpectra saved in the header of to_npz()
+NPZ_METADATA = (
+    "filename",
+    "date",
+    "time",
+    "accumulations",
+    "gatewidth",
+    "regionofinterest_x",
+    "regionofinterest_y",
+)
+
+
+# kwargs of the first fit with MeasuredSpectra.fit(coarse=True): four times fewer
+# pixels and a four times coarser mesh, enough to find the temperatures and
+# wav_shift roughly
+COARSE_FIT = {"binning": 4, "points_per_nm": 250, "maxiter": 200}
 
 
 class Parameters(object):
@@ -38,6 +73,8 @@ class Parameters(object):
 
         simulations: list of specDB objects, or simply empty list []
         """
+        import lmfit
+
         self.number_of_pixels = kwargs.pop("number_of_pixels", 1024)
         self.prms = lmfit.Parameters()
         self.info = {"species": []}
@@ -72,6 +109,8 @@ class Parameters(object):
         """
         specie: specDB object
         """
+        from asteval import valid_symbol_name
+
         Trot = kwargs.pop("Trot", 1e3)
         Tvib = kwargs.pop("Tvib", 1e3)
         intensity = kwargs.pop("intensity", 1)
@@ -119,11 +158,11 @@ class Parameters(object):
 
 class MeasuredSpectra:
     """Class containing the measured data. Suitable for storing number of
-    spectra (high numbers are possible, but it is not optimized to be
-    memory efficient - all spectra will be loaded into the memory at
-    initiating an instance of MeasuredSpectra). A reasonable strategy
-    is to divide large measurements into several MeasuredSpectra
-    objects.
+    spectra. By default, all spectra are loaded into the memory as separate
+    Spectrum objects. Spectra sharing one wavelength axis can be stored in
+    a ColumnarSpectra instead (see from_csv(columnar=True) and
+    open_columnar()), which keeps the intensities in one 2D block, possibly
+    memory-mapped from the disk.
 
     It also keeps references to spectral simulations and contains
     methods for least squares fitting.
@@ -183,10 +222,11 @@ class MeasuredSpectra:
         self.minimizer = None
         self.minimizer_result = None
         self.simulations = {}
+        self.synthesis_cache = SynthesisCache()
         self.create_fit_parameters(**kwargs)
 
     @classmethod
-    def from_csv(cls, filename, **genfromtxtargs):
+    def from_csv(cls, filename, columnar=False, **genfromtxtargs):
         """Used to extract measured data from ASCII files containing the
         wavelengths in the first column and and intensity vectors of
         y-values in other columns. Delimiter can be set via genfromtxtargs:
@@ -197,20 +237,111 @@ class MeasuredSpectra:
 
         Other Parameters
         ----------------
+        columnar: *bool* defaults to False. If True, the spectra are stored
+            in a ColumnarSpectra sharing the wavelength axis.
+
         **genfromtxtargs: forwarded to :py:func:`numpy.genfromtxt`
             default : {"delimiter":','}
         ...
 
         """
         delimiter = genfromtxtargs.pop("delimiter", ",")
-        dataarray = numpy.genfromtxt(filename, delimiter=delimiter, **genfromtxtargs)
+        if genfromtxtargs:  # options only numpy.genfromtxt understands
+            dataarray = numpy.genfromtxt(
+                filename, delimiter=delimiter, **genfromtxtargs
+            )
+            x, y = dataarray[:, 0], numpy.ascontiguousarray(dataarray[:, 1:].T)
+        else:
+            x, y = read_csv(filename, delimiter=delimiter)
+        return cls._from_columns(
+            x, y, list(range(1, len(y) + 1)), columnar=columnar, filename=filename
+        )
+
+    @classmethod
+    def from_csv_dir(
+        cls, directory, pattern="*.csv", columnar=False, workers=None, delimiter=","
+    ):
+        """Load all the csv files in the directory (see from_csv()) into one
+        MeasuredSpectra, reading the files concurrently by a pool of threads.
+        The spectra are identified by (file name without extension, column).
+
+        args:
+        -----
+        directory: path to the directory
+
+        **kwargs:
+        ---------
+        pattern: *string* glob pattern of the files, defaults to '*.csv'
+
+        columnar: *bool* defaults to False. If True, the spectra are stored in
+                  a ColumnarSpectra, all the files must share the wavelengths.
+
+        workers: *int* number of threads, defaults to that of ThreadPoolExecutor
+
+        delimiter: *string* defaults to ','
+        """
+        filenames = sorted(pathlib.Path(directory).glob(pattern))
+        if not filenames:
+            raise FileNotFoundError(f"No {pattern} files in {directory}!")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            loaded = list(
+                executor.map(lambda f: read_csv(f, delimiter=delimiter), filenames)
+            )
+
+        names = [
+            (filename.stem, column)
+            for filename, (_, y) in zip(filenames, loaded)
+            for column in range(1, len(y) + 1)
+        ]
+        x = loaded[0][0]
+        if columnar:
+            for filename, (other_x, _) in zip(filenames, loaded):
+                if not numpy.array_equal(other_x, x):
+                    raise ValueError(
+                        f"Wavelengths in {filename} differ from the others!"
+                    )
+            y = numpy.concatenate([y for _, y in loaded])
+            return cls._from_columns(
+                x, y, names, columnar=True, filename=str(directory)
+            )
+
         spec = OrderedDict()
-        for i in range(1, dataarray.shape[1]):
-            spec[i] = {
-                "spectrum": spectrum.Spectrum(x=dataarray[:, 0], y=dataarray[:, i])
-            }
+        names_iter = iter(names)
+        for file_x, y in loaded:
+            for row in y:
+                spec[next(names_iter)] = {
+                    "spectrum": spectrum.Spectrum(x=file_x, y=row)
+                }
+        return cls._from_spectra(spec, filename=str(directory))
 
-        ret = MeasuredSpectra(filename=filename, spectra=spec)
+    @classmethod
+    def ingest_csv(cls, filename, directory, delimiter=",", chunksize=2**16):
+        """Convert a csv file (see from_csv()) to a directory, which is then opened
+        memory-mapped by open_columnar(). Reads the file by chunks of chunksize
+        lines, so that files bigger than the memory can be processed.
+        """
+        ingest_csv(filename, directory, delimiter=delimiter, chunksize=chunksize)
+        return cls.open_columnar(directory)
+
+    @classmethod
+    def _from_columns(cls, x, y, names, columnar=False, **kwargs):
+        if not columnar:
+            spec = OrderedDict(
+                (name, {"spectrum": spectrum.Spectrum(x=x, y=row)})
+                for name, row in zip(names, y)
+            )
+            return cls._from_spectra(spec, **kwargs)
+
+        step = numpy.mean(numpy.diff(x))
+        if step <= 0:
+            raise ValueError("The spectrum x-axis must be ordered ascendingly!")
+        template = Parameters(number_of_pixels=len(x), wav_step=step)
+        spectra = ColumnarSpectra(x, y, names, template=template)
+        return MeasuredSpectra(spectra=spectra, **kwargs)
+
+    @classmethod
+    def _from_spectra(cls, spec, **kwargs):
+        ret = MeasuredSpectra(spectra=spec, **kwargs)
         for spec in ret.spectra:
             s = ret.spectra[spec]
             step = numpy.mean(numpy.diff(s["spectrum"].x))
@@ -235,6 +366,20 @@ class MeasuredSpectra:
             self.simulations[specie.specie_name] = specie
         self.spectra[specname]["params"].add_specie(specie, **kwargs)
 
+    def add_specie_to_all(self, specie, **kwargs):
+        """Same as add_specie() for all the spectra. With ColumnarSpectra,
+        the specie is added also to the template of the params not created yet.
+        """
+        if isinstance(self.spectra, ColumnarSpectra):
+            if specie.specie_name not in self.simulations:
+                self.simulations[specie.specie_name] = specie
+            self.spectra.template.add_specie(specie, **kwargs)
+            for params in self.spectra.params.values():
+                params.add_specie(specie, **kwargs)
+            return
+        for specname in self.spectra:
+            self.add_specie(specie, specname, **kwargs)
+
     def create_fit_parameters(self, **kwargs):
         """
             **kwargs:
@@ -243,8 +388,19 @@ class MeasuredSpectra:
         wav_shift: a shift of the wavelength-axis in nm
 
         other kwargs are passed directly to Parameters.__init__()
+
+        With ColumnarSpectra, the params of the spectra are created later from
+        the template, the species are added to the template.
         """
         simulated_spectra = kwargs.pop("simulated_spectra", [])
+        if isinstance(self.spectra, ColumnarSpectra):
+            if self.spectra.template is None:
+                self.spectra.template = Parameters(
+                    number_of_pixels=len(self.spectra.x), **kwargs
+                )
+            for specie in simulated_spectra:
+                self.add_specie_to_all(specie, **kwargs)
+            return
         for spec in self.spectra:
             if "params" not in self.spectra[spec]:
                 self.spectra[spec]["params"] = Parameters(
@@ -275,12 +431,7 @@ class MeasuredSpectra:
             else:
                 spectra[str(specname)] = list(self.spectra[specname]["spectrum"])
 
-            par = self.spectra[specname]["params"]
-            params[str(specname)] = {
-                "number_of_pixels": par.number_of_pixels,
-                "info": par.info,
-                "prms": par.prms.dumps(),
-            }
+            params[str(specname)] = _params_to_dict(self.spectra[specname]["params"])
 
         simulations = []
         for simkey in self.simulations:
@@ -312,51 +463,441 @@ class MeasuredSpectra:
             sims[sim] = SpecDB(sim + ".db")
 
         for param, s in zip(loaded["params"], list(spec.keys())):
-            to_app = Parameters(
-                number_of_pixels=loaded["params"][param]["number_of_pixels"]
-            )
-            to_app.info = loaded["params"][param]["info"]
-            try:
-                to_app.prms.loads(loaded["params"][param]["prms"])
-            except TypeError:
-                for entry in json.loads(loaded["params"][param]["prms"]):
-                    to_app.prms.add(
-                        entry[0],
-                        value=entry[1],
-                        vary=entry[2],
-                        min=entry[4],
-                        max=entry[5],
-                    )
-            spec[s]["params"] = to_app
+            spec[s]["params"] = _params_from_dict(loaded["params"][param])
 
         ret = MeasuredSpectra(spectra=spec)
 
         ret.simulations = sims
         return ret
 
-    def get_residuals(self, params: lmfit.Parameters, specname: str, **kwargs):
+    def to_npz(self, filename):
+        """
+        Save the spectra, params and metadata as uncompressed .npz file: the arrays
+        are stored in the binary form (the x-axes shared by several spectra only
+        once) and the rest in a small json header. Much faster and smaller than
+        to_json() and, unlike save(), independent of the pickled classes.
+        Of the fit statistics, only the stderr of the parameters is kept.
+        """
+        header = {
+            "format": NPZ_FORMAT_VERSION,
+            "metadata": {key: getattr(self, key) for key in NPZ_METADATA},
+            "simulations": list(self.simulations),
+            "spectra": [],
+        }
+        arrays = {}
+        x_axes: list[numpy.ndarray] = []
+        for i, specname in enumerate(self.spectra):
+            entry = self.spectra[specname]
+            spec = entry["spectrum"]
+            described = {"name": specname, "x": None}
+            if hasattr(spec, "x"):
+                for k, x in enumerate(x_axes):
+                    if x is spec.x or numpy.array_equal(x, spec.x):
+                        break
+                else:
+                    k = len(x_axes)
+                    x_axes.append(spec.x)
+                    arrays[f"x_{k}"] = spec.x
+                described["x"] = k
+                arrays[f"y_{i}"] = spec.y
+            else:
+                arrays[f"y_{i}"] = numpy.asarray(spec)
+            if "params" in entry:
+                described["params"] = _params_to_header(entry["params"])
+            header["spectra"].append(described)
+
+        encoded = json.dumps(header, default=str).encode()
+        with open(filename, "wb") as fp:
+            numpy.savez(
+                fp, header=numpy.frombuffer(encoded, dtype=numpy.uint8), **arrays
+            )
+
+    @staticmethod
+    def from_npz(filename, specnames=None):
+        """
+        Load spectra saved by to_npz().
+
+        args:
+        -----
+        filename: path to the .npz file
+
+        **kwargs:
+        ---------
+        specnames: *iterable* if given, only these spectra are loaded from the file
+        """
+        with numpy.load(filename, allow_pickle=False) as loaded:
+            header = json.loads(
+                loaded["header"].tobytes(), object_pairs_hook=OrderedDict
+            )
+            if header["format"] > NPZ_FORMAT_VERSION:
+                raise ValueError(f"{filename} was saved by a newer version!")
+            selected = None if specnames is None else set(specnames)
+
+            spec = OrderedDict()
+            x_axes: dict[int, numpy.ndarray] = {}
+            for i, described in enumerate(header["spectra"]):
+                specname = name_from_json(described["name"])
+                if selected is not None and specname not in selected:
+                    continue
+                y = loaded[f"y_{i}"]
+                k = described["x"]
+                if k is None:
+                    spec[specname] = {"spectrum": y}
+                else:
+                    if k not in x_axes:
+                        x_axes[k] = loaded[f"x_{k}"]
+                    spec[specname] = {"spectrum": spectrum.Spectrum(x=x_axes[k], y=y)}
+                if "params" in described:
+                    spec[specname]["params"] = _params_from_header(described["params"])
+
+        if selected is not None and len(spec) < len(selected):
+            missing = selected - set(spec)
+            raise KeyError(f"Spectra {missing} not found in {filename}!")
+
+        metadata = header["metadata"]
+        ret = MeasuredSpectra(
+            spectra=spec,
+            ROI_x=metadata.pop("regionofinterest_x"),
+            ROI_y=metadata.pop("regionofinterest_y"),
+            **metadata,
+        )
+        ret.simulations = {sim: SpecDB(sim + ".db") for sim in header["simulations"]}
+        return ret
+
+    def save_columnar(self, directory):
+        """
+        Save the spectra into a directory readable by open_columnar(): the shared
+        wavelengths and the block of intensities as .npy files, the params as
+        params.json. Only the params created so far are saved.
+        Requires all the spectra to share the same wavelengths.
+        """
+        spectra = self.spectra
+        if not isinstance(spectra, ColumnarSpectra):
+            specnames = list(self.spectra)
+            x = self.spectra[specnames[0]]["spectrum"].x
+            for specname in specnames:
+                if not numpy.array_equal(self.spectra[specname]["spectrum"].x, x):
+                    raise ValueError(f"Spectrum {specname} has different wavelengths!")
+            spectra = ColumnarSpectra(
+                x,
+                numpy.array([self.spectra[s]["spectrum"].y for s in specnames]),
+                specnames,
+                params={s: self.spectra[s]["params"] for s in specnames},
+            )
+        spectra.save(directory)
+
+        to_save = {
+            "template": (
+                None if spectra.template is None else _params_to_dict(spectra.template)
+            ),
+            "params": [
+                [specname, _params_to_dict(params)]
+                for specname, params in spectra.params.items()
+                if specname in spectra
+            ],
+            "simulations": list(self.simulations),
+        }
+        with open(pathlib.Path(directory) / "params.json", "w") as fp:
+            json.dump(to_save, fp)
+
+    @classmethod
+    def open_columnar(cls, directory, mmap_mode="r"):
+        """
+        Open spectra saved by save_columnar() or ingest_csv(). By default, the
+        intensities are memory-mapped read-only and read from the disk only when
+        needed.
+
+        args:
+        -----
+        directory: path to the directory
+
+        **kwargs:
+        ---------
+        mmap_mode: see ColumnarSpectra.open()
+        """
+        spectra = ColumnarSpectra.open(directory, mmap_mode=mmap_mode)
+        loaded = {"template": None, "params": [], "simulations": []}
+        if (pathlib.Path(directory) / "params.json").exists():
+            with open(pathlib.Path(directory) / "params.json") as fp:
+                loaded = json.load(fp, object_pairs_hook=OrderedDict)
+        if loaded["template"] is not None:
+            spectra.template = _params_from_dict(loaded["template"])
+        else:
+            step = numpy.mean(numpy.diff(spectra.x))
+            spectra.template = Parameters(
+                number_of_pixels=len(spectra.x), wav_step=step
+            )
+        for specname, params in loaded["params"]:
+            spectra.params[name_from_json(specname)] = _params_from_dict(params)
+
+        ret = MeasuredSpectra(spectra=spectra)
+        ret.simulations = {sim: SpecDB(sim + ".db") for sim in loaded["simulations"]}
+        return ret
+
+    @profiling.profiled("MeasuredSpectra.get_residuals")
+    def get_residuals(self, params: "lmfit.Parameters", specname: str, **kwargs):
         """
         method with the desired signature for lmfit.minimize
+
+        **kwargs:
+        ---------
+        render_on_pixels: *bool* defaults to True. The simulated lines are rendered
+                          directly onto the pixels of the measured spectrum. If False,
+                          the simulation is done on a fine mesh and interpolated.
+        use_cache: *bool* defaults to True. The stages of the synthesis are cached
+                   in self.synthesis_cache and only those depending on the changed
+                   parameters are recomputed, see specdata.SynthesisCache.
+        profile: *str* defaults to "wofz". Evaluation of the voigt profile of the
+                 slit function, "pseudo_voigt" is faster but less accurate, see
+                 spectrum.VOIGT_PROFILES.
+        binning: *int* defaults to 1. Every `binning` neighbouring pixels are summed
+                 into one (see spectrum.bin_pixels()), so that there are
+                 `binning` times fewer residuals to synthesize.
+        points_per_nm: *int* defaults to 1000. Density of the synthesis mesh (or of
+                       the sampling of the slit function with render_on_pixels).
         """
         convolve = kwargs.pop("convolve", True)
+        render_on_pixels = kwargs.pop("render_on_pixels", True)
+        use_cache = kwargs.pop("use_cache", True)
+        profile = kwargs.pop("profile", "wofz")
+        binning = kwargs.pop("binning", 1)
+        points_per_nm = kwargs.pop("points_per_nm", 1000)
         step = params["wav_step"].value
 
         self.spectra[specname]["params"].prms = params
         our_params: Parameters = self.spectra[specname]["params"]
 
-        measured_spec = self.get_measured_spectrum(specname)
+        measured_spec = spectrum.bin_pixels(
+            self.get_measured_spectrum(specname), binning
+        )
+        profiling.PROFILER.count(
+            "MeasuredSpectra.get_residuals", "size", len(measured_spec)
+        )
         simulated_spec = generate_spectrum(
             our_params,
-            step=step,
+            step=step * binning,
             sims=self.simulations,
             wmin=measured_spec.x.min(),
             wmax=measured_spec.x.max(),
+            points_per_nm=points_per_nm,
+            x=measured_spec.x if render_on_pixels else None,
+            cache=self.synthesis_cache if use_cache else None,
+            profile=profile,
+        )
+
+        residuals = spectrum.compare_spectra(
+            measured_spec,
+            simulated_spec,
+            resampler=self.synthesis_cache.resampler if use_cache else None,
         )
+        if binning > 1:
+            # the binned pixels sum the baseline of `binning` pixels, the
+            # simulation adds it only once
+            residuals += (binning - 1) * (
+                params["baseline"].value
+                + params["baseline_slope"].value
+                * (measured_spec.x - measured_spec.x.min())
+            )
+        return residuals
+
+    @profiling.profiled("MeasuredSpectra.get_jacobian")
+    def get_jacobian(self, params: "lmfit.Parameters", specname: str, **kwargs):
+        """
+        Jacobian of get_residuals() with the desired signature for Dfun of
+        lmfit.minimize(method='leastsq'). Rows correspond to pixels, columns to
+        the varying parameters in the order of lmfit.
+
+        The derivatives by intensities, temperatures, baseline, baseline_slope and
+        wav_shift are analytic, all the species share a single rendering of the
+        lines. The slit function parameters and wav_step are differentiated numerically.
+        Parameters constrained by expressions are not supported, the columns of the
+        parameters they depend on miss the derivatives through them.
+        Takes the binning and points_per_nm kwargs of get_residuals().
+        """
+        kwargs.pop("render_on_pixels", True)
+        profile = kwargs.pop("profile", "wofz")
+        binning = kwargs.pop("binning", 1)
+        step = params["wav_step"].value
+
+        self.spectra[specname]["params"].prms = params
+        our_params: Parameters = self.spectra[specname]["params"]
+        measured_spec = spectrum.bin_pixels(
+            self.get_measured_spectrum(specname), binning
+        )
+        x = measured_spec.x
+        wmin = x.min()
+        slit = {
+            "gauss": params["slitf_gauss"].value,
+            "lorentz": params["slitf_lorentz"].value,
+            "instrumental_step": step * binning,
+            "points_per_nm": kwargs.pop("points_per_nm", 1000),
+            "profile": profile,
+        }
+
+        var_names = [
+            name for name in params if params[name].vary and params[name].expr is None
+        ]
+        jac = numpy.zeros((len(x), len(var_names)))
+        columns = {name: i for i, name in enumerate(var_names)}
+
+        all_x = []
+        all_y = []
+        for specie in our_params.info["species"]:
+            Trot = params[specie + "_Trot"].value
+            Tvib = params[specie + "_Tvib"].value
+            intensity = params[specie + "_intensity"].value
+            lines = self.simulations[specie].get_lines(
+                Trot, Tvib, wmin=wmin, wmax=x.max()
+            )
+            all_x.append(lines["x"])
+            all_y.append(lines["y"] * intensity)
+
+            rendered = spectrum.render_lines(
+                lines["x"],
+                numpy.array(
+                    [
+                        lines["y"],
+                        lines["dy_dTrot"] * intensity,
+                        lines["dy_dTvib"] * intensity,
+                    ]
+                ),
+                x,
+                **slit,
+            )
+            for name, column in zip(("_intensity", "_Trot", "_Tvib"), rendered):
+                if specie + name in columns:
+                    jac[:, columns[specie + name]] = column
+
+        if "baseline" in columns:
+            jac[:, columns["baseline"]] = binning
+        if "baseline_slope" in columns:
+            jac[:, columns["baseline_slope"]] = binning * (x - wmin)
+
+        if not all_x:
+            return jac
+        line_x = numpy.concatenate(all_x)
+        line_y = numpy.concatenate(all_y)
+
+        if "wav_shift" in columns:
+            jac[:, columns["wav_shift"]] = spectrum.render_lines(
+                line_x, line_y, x, derivative=True, **slit
+            )
+
+        numeric = [name for name in ("slitf_gauss", "slitf_lorentz") if name in columns]
+        if "wav_step" in columns:
+            numeric.append("wav_step")
+        if numeric:
+            model = spectrum.render_lines(line_x, line_y, x, **slit)
+            keys = {
+                "slitf_gauss": "gauss",
+                "slitf_lorentz": "lorentz",
+                "wav_step": "instrumental_step",
+            }
+            for name in numeric:
+                perturbed = dict(slit)
+                # the same relative step as leastsq uses by default (epsfcn=1e-10)
+                h = 1e-5 * abs(params[name].value) or 1e-5
+                # the instrumental step is wav_step * binning
+                perturbed[keys[name]] += h * (binning if name == "wav_step" else 1)
+                jac[:, columns[name]] = (
+                    spectrum.render_lines(line_x, line_y, x, **perturbed) - model
+                ) / h
+        return jac
+
+    @profiling.profiled("MeasuredSpectra.get_residuals_batch")
+    def get_residuals_batch(self, values, specname, names=None, profile="wofz"):
+        """
+        Residuals of many candidate parameter sets at once, e.g. for grid searches,
+        differential evolution or MCMC. Equivalent to calling get_residuals() for each
+        row of `values`, with the lines rendered directly on the pixels.
+
+        The populations of all candidates are calculated as a single matrix and the
+        candidates sharing the slit function and wav_shift are rendered in one go.
+
+        args:
+        -----
+        values: 2D array of shape (N, len(names)), each row is one candidate
+        specname: identificator of the spectrum
+        names: names of the parameters in the columns of `values`. Defaults to the
+               varying parameters in the order of lmfit. Other parameters are taken
+               from self.spectra[specname]['params'] and the stored values are not
+               changed.
+        profile: evaluation of the voigt profile, see spectrum.VOIGT_PROFILES
+
+        return:
+        -------
+        residuals: 2D array of shape (N, number of pixels)
+        """
+        our_params: Parameters = self.spectra[specname]["params"]
+        values = numpy.atleast_2d(numpy.asarray(values, dtype=float))
+        if names is None:
+            names = [
+                name
+                for name in our_params.prms
+                if our_params[name].vary and our_params[name].expr is None
+            ]
+        columns = {
+            name: numpy.full(len(values), our_params[name].value)
+            for name in our_params.keys()
+        }
+        for i, name in enumerate(names):
+            columns[name] = values[:, i]
+
+        measured = self.spectra[specname]["spectrum"]
+        wmin = measured.x.min() + columns["wav_shift"].min()
+        wmax = measured.x.max() + columns["wav_shift"].max()
+
+        line_x = []
+        line_y = []
+        for specie in our_params.info["species"]:
+            x, y = _get_spectrum_batch(
+                self.simulations[specie],
+                columns[specie + "_Trot"],
+                columns[specie + "_Tvib"],
+                wmin=wmin,
+                wmax=wmax,
+            )
+            line_x.append(x)
+            line_y.append(y * columns[specie + "_intensity"][:, numpy.newaxis])
+
+        residuals = numpy.zeros((len(values), len(measured.x)))
+        if line_x:
+            line_x = numpy.concatenate(line_x)
+            line_y = numpy.concatenate(line_y, axis=1)
+            slits = numpy.column_stack(
+                [
+                    columns["slitf_gauss"],
+                    columns["slitf_lorentz"],
+                    columns["wav_step"],
+                    columns["wav_shift"],
+                ]
+            )
+            unique_slits, group = numpy.unique(slits, axis=0, return_inverse=True)
+            group = group.ravel()
+            for i, (gauss, lorentz, step, shift) in enumerate(unique_slits):
+                rows = group == i
+                residuals[rows] = spectrum.render_lines(
+                    line_x,
+                    line_y[rows],
+                    measured.x + shift,
+                    gauss=gauss,
+                    lorentz=lorentz,
+                    instrumental_step=step,
+                    profile=profile,
+                )
+            residuals[numpy.isnan(residuals).any(axis=1)] = 1e100
 
-        return spectrum.compare_spectra(measured_spec, simulated_spec)
+        residuals += columns["baseline"][:, numpy.newaxis]
+        residuals += numpy.outer(
+            columns["baseline_slope"], measured.x - measured.x.min()
+        )
+        residuals -= measured.y
+        return residuals
 
+    @profiling.profiled("MeasuredSpectra.fit")
     def fit(self, specname, **kwargs):
         """Find optimal values of the fit parameters for spectrum identified by specname. The optimal values are then stored in self.spectra[specname]['params'], not returned!
+        The final residuals are summarized there as well, see fit_summary().
 
         args:
         -----
@@ -364,31 +905,88 @@ class MeasuredSpectra:
 
         **kwargs:
         ---------
-        maxiter: *int* maximal number of itertions, handy with slower optimization methods
+        maxiter: *int* maximal number of itertions, handy with slower optimization methods.
+                 With method='leastsq', the maximal number of function evaluations.
 
         method: *string* see lmfit documentation for available methods
 
+        analytic_jacobian: *bool* defaults to True. With method='leastsq', the jacobian
+                           is calculated by MeasuredSpectra.get_jacobian() instead of
+                           finite differences. Ignored with render_on_pixels=False
+                           and when any parameter is constrained by an expression.
+
+        profile: *str* "wofz" (default, exact) or "pseudo_voigt" (faster), the
+                 evaluation of the voigt profile, see MeasuredSpectra.get_residuals().
+
         by_peaks: *bool* defaults to False. If you own echelle spectrometer,
                   play around with enabling this option. Otherwise, leave it at false.
                   Never properly tested.
 
+        iter_cb: *callable* called by lmfit after every evaluation of the residuals
+                 as iter_cb(params, iteration, residuals, specname, **kwargs). Returning True
+                 aborts the fit (result.aborted is then True).
+
+        binning, points_per_nm: see MeasuredSpectra.get_residuals()
+
+        coarse: *bool* or *dict* defaults to False. If given, the spectrum is fitted
+                first with these kwargs replacing the others (True means COARSE_FIT),
+                typically on binned pixels and a coarser mesh. The fit then continues
+                on the full data from the coarse result. Pays off when the starting
+                values are far from the optimum, a coarse evaluation is about
+                `binning` times cheaper.
+
         return:
         -------
         result: *bool*, True if the fit converged successfully, False otherwise
 
         """
 
+        import lmfit
+
+        coarse = kwargs.pop("coarse", False)
+        start = time.perf_counter()
+        if coarse:
+            coarse_kwargs = dict(kwargs, **(COARSE_FIT if coarse is True else coarse))
+            # lmfit sets result.aborted also when max_nfev is reached, only
+            # the abort by iter_cb stops the fit before the full data
+            cancelled = False
+            user_cb = coarse_kwargs.get("iter_cb")
+
+            def coarse_cb(*args, **cb_kwargs):
+                nonlocal cancelled
+                cancelled = bool(user_cb(*args, **cb_kwargs))
+                return cancelled
+
+            if user_cb is not None:
+                coarse_kwargs["iter_cb"] = coarse_cb
+            self.fit(specname, **coarse_kwargs)
+            if cancelled:
+                return self.minimizer_result
+
         print("********* specname = ", specname, " ************")
         kwargs["number_of_pixels"] = self.spectra[specname]["params"].number_of_pixels
         maxiter = kwargs.pop("maxiter", 2000)
         method = kwargs.pop("method", "leastsq")
+        analytic_jacobian = kwargs.pop("analytic_jacobian", True)
+        iter_cb = kwargs.pop("iter_cb", None)
+        minimize_kws = {}
         if method == "leastsq":
+            prms = self.spectra[specname]["params"].prms
+            # get_jacobian() does not chain the derivatives through expressions
+            constrained = any(prms[name].expr for name in prms)
+            if (
+                analytic_jacobian
+                and kwargs.get("render_on_pixels", True)
+                and not constrained
+            ):
+                minimize_kws["Dfun"] = self.get_jacobian
             self.minimizer = lmfit.Minimizer(
                 self.get_residuals,
                 self.spectra[specname]["params"].prms,
                 fcn_args=(specname,),
                 fcn_kws=kwargs,
-                maxfev=maxiter,
+                iter_cb=iter_cb,
+                max_nfev=maxiter,
             )
         else:
             self.minimizer = lmfit.Minimizer(
@@ -396,88 +994,557 @@ class MeasuredSpectra:
                 self.spectra[specname]["params"].prms,
                 fcn_args=(specname,),
                 fcn_kws=kwargs,
+                iter_cb=iter_cb,
                 options={"maxiter": maxiter, "xtol": 0.05},
             )
 
-        self.minimizer_result = self.minimizer.minimize(method=method)
+        self.minimizer_result = self.minimizer.minimize(method=method, **minimize_kws)
+        elapsed = time.perf_counter() - start
         self.spectra[specname]["params"].prms = self.minimizer_result.params
+        if kwargs.get("binning", 1) == 1:
+            # export_results() takes the residuals from here instead of a new synthesis
+            self._summarize(
+                specname,
+                self.minimizer_result.residual,
+                nfev=self.minimizer_result.nfev,
+                fit_time=elapsed,
+            )
+        else:
+            self.spectra[specname]["params"].info.pop("summary", None)
         return self.minimizer_result
 
-    def export_results(self, filename):
-        """
-        Save the results of the optimisation as csv file. Uses pandas.
+    def fit_many(
+        self,
+        specnames: Iterable,
+        workers: int | None = None,
+        progress: Callable[[int, int, Any], None] | None = None,
+        threads: bool = False,
+        keep_results: bool = True,
+        **kwargs,
+    ):
+        """Fit several spectra, spreading them over a pool of processes (or threads).
+        The optimal values are stored in self.spectra[specname]['params'],
+        just like with MeasuredSpectra.fit().
 
         args:
         -----
-        filename: *string* a name of the file, the data will be exported to.
-                  Does NOT ask for confirmation before overwritng!
+        specnames: identificators of spectra to fit
+
+        **kwargs:
+        ---------
+        workers: *int* number of worker processes, defaults to os.cpu_count().
+                 With workers=1 the spectra are fitted one by one in this process.
+
+        progress: *callable* called as progress(done, total, specname) every time a fit
+                  finishes. Defaults to printing the progress.
+
+        threads: *bool* defaults to False. If True, the workers are threads of this
+                 process sharing self.simulations (see SpecDB for the thread safety)
+                 instead of processes, which need their own copies of the databases.
+                 Pays off when most of the time is spent in numpy and scipy, which
+                 release the GIL.
+
+        keep_results: *bool* defaults to True. If False, the lmfit.MinimizerResults
+                      are dropped as soon as progress() is called, so that the memory
+                      does not grow with the number of spectra (the optimal values are
+                      still stored in the params). The returned OrderedDict is empty.
+
+        other kwargs are passed to MeasuredSpectra.fit()
+
+        return:
+        -------
+        results: *OrderedDict* {specname: lmfit.MinimizerResult} in the order of finishing
         """
+        specnames = list(specnames)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, len(specnames)))
+        if progress is None:
+            progress = _print_progress
+
+        results = OrderedDict()
+        done = 0
+        if workers == 1:
+            for specname in specnames:
+                result = self.fit(specname, **kwargs)
+                if keep_results:
+                    results[specname] = result
+                done += 1
+                progress(done, len(specnames), specname)
+            return results
+
+        executor: Executor
+        worker: Callable
+        with contextlib.ExitStack() as stack:
+            if threads:
+                executor = stack.enter_context(ThreadPoolExecutor(max_workers=workers))
+                # the threads share the databases and the profiler, nothing to merge
+                worker = functools.partial(_fit_in_thread, self.simulations)
+            else:
+                # the workers map the lines from shared memory instead of loading them
+                for sim in self.simulations.values():
+                    if isinstance(sim, SpecDB) and (
+                        sim.shared_line_table is None or sim.shared_line_table.closed
+                    ):
+                        stack.callback(sim.share_line_table().close)
+                executor = stack.enter_context(
+                    ProcessPoolExecutor(
+                        max_workers=workers,
+                        initializer=_init_fit_worker,
+                        initargs=(pickle.dumps(self.simulations),),
+                    )
+                )
+                worker = _fit_worker
+            futures = [
+                executor.submit(
+                    worker,
+                    specname,
+                    self.spectra[specname]["spectrum"],
+                    self.spectra[specname]["params"],
+                    kwargs,
+                    profiling.PROFILER.enabled,
+                )
+                for specname in specnames
+            ]
+            for future in as_completed(futures):
+                specname, params, result, stats = future.result()
+                profiling.PROFILER.merge(stats)
+                self.spectra[specname]["params"] = params
+                self.minimizer_result = result
+                if keep_results:
+                    results[specname] = result
+                done += 1
+                progress(done, len(specnames), specname)
+        return results
+
+    def fit_isolated(self, specname, **kwargs):
+        """
+        Same as MeasuredSpectra.fit(), but done by a separate MeasuredSpectra sharing
+        only the spectrum, its params and self.simulations. The minimizer and the
+        synthesis cache are not shared, so that spectra with different specnames can
+        be fitted by several threads at once. self.minimizer_result is not set.
+        """
+        params, result = _fit_one(
+            self.simulations,
+            specname,
+            self.spectra[specname]["spectrum"],
+            self.spectra[specname]["params"],
+            kwargs,
+        )
+        self.spectra[specname]["params"] = params
+        return result
+
+    def fit_all(self, **kwargs):
+        """Fit all the spectra, see MeasuredSpectra.fit_many() for the kwargs."""
+        return self.fit_many(list(self.spectra), **kwargs)
+
+    def fit_series(
+        self,
+        specnames: Iterable | None = None,
+        narrow: float | dict[str, float] | None = None,
+        seeded_maxiter: int = 200,
+        progress: Callable[[int, int, Any], None] | None = None,
+        **kwargs,
+    ):
+        """Fit spectra one after another, starting every fit from the optimal values
+        found for the previous spectrum. Meant for series of spectra (time delays,
+        positions), where the neighbours differ only a little, so that the fits
+        need far fewer function evaluations than starting from the defaults.
 
-        result = {"spectrum": [], "reduced_sumsq": []}
+        args:
+        -----
+        specnames: identificators of spectra in the order of the series,
+                   defaults to all the spectra in their order
 
-        for specie in self.simulations:
-            result[specie + "_Trot"] = []
-            result[specie + "_Trot_dev"] = []
-            result[specie + "_Tvib"] = []
-            result[specie + "_Tvib_dev"] = []
-            result[specie + "_intensity"] = []
-            result[specie + "_intensity_dev"] = []
+        **kwargs:
+        ---------
+        narrow: *float* or *dict* {parameter name: float}. If given, the bounds of the
+                seeded parameters are narrowed to value*(1 -/+ narrow) during the fit
+                (never widened). A float applies to the temperatures of all species,
+                relative bounds make little sense for parameters close to zero, such
+                as wav_shift or baseline. A fit ending at a narrowed bound is repeated
+                with the original bounds. The original bounds are kept in the stored
+                parameters.
 
-        for specname in self.spectra:
-            result["spectrum"].append(specname)
-            # if the list of simulations is empty, do not calculate residuals
-            if not self.spectra[specname]["params"].info["species"]:
-                sumsq = numpy.nan
+        seeded_maxiter: *int* maxiter of the seeded fits, the first fit uses maxiter
+
+        progress: *callable* called as progress(done, total, specname) every time a fit
+                  finishes. Defaults to printing the progress.
+
+        other kwargs are passed to MeasuredSpectra.fit()
+
+        return:
+        -------
+        results: *OrderedDict* {specname: lmfit.MinimizerResult} in the order of the series
+        """
+        specnames = list(self.spectra if specnames is None else specnames)
+        if progress is None:
+            progress = _print_progress
+
+        results = OrderedDict()
+        seed = None
+        for specname in specnames:
+            if seed is None:
+                result = self.fit(specname, **kwargs)
             else:
-                residuals = self.get_residuals(
-                    self.spectra[specname]["params"].prms, specname
+                result = self._fit_seeded(
+                    specname, seed, narrow, dict(kwargs, maxiter=seeded_maxiter)
+                )
+            if result.success:
+                seed = result.params
+            results[specname] = result
+            progress(len(results), len(specnames), specname)
+        return results
+
+    def _fit_seeded(self, specname, seed, narrow, kwargs):
+        prms = self.spectra[specname]["params"].prms
+        bounds = {name: (prms[name].min, prms[name].max) for name in prms}
+        if narrow is not None and not isinstance(narrow, dict):
+            narrow = {
+                f"{specie}_{T}": narrow
+                for specie in self.spectra[specname]["params"].info["species"]
+                for T in ("Trot", "Tvib")
+            }
+        narrowed = []
+        for name in prms:
+            if not prms[name].vary or prms[name].expr or name not in seed:
+                continue
+            value = seed[name].value
+            prms[name].set(value=value)
+            width = narrow.get(name) if narrow else None
+            if width and value != 0:
+                prms[name].set(
+                    min=max(prms[name].min, value - width * abs(value)),
+                    max=min(prms[name].max, value + width * abs(value)),
                 )
+                narrowed.append(name)
+
+        result = self.fit(specname, **kwargs)
+        prms = self.spectra[specname]["params"].prms
+        at_bound = [
+            name for name in narrowed if _at_narrowed_bound(prms[name], bounds[name])
+        ]
+        for name, (low, high) in bounds.items():
+            prms[name].set(min=low, max=high)
+        if at_bound:
+            result = self.fit(specname, **kwargs)
+        return result
+
+    def result_columns(self) -> list[str]:
+        """names of the values in the rows of MeasuredSpectra.result_row()"""
+        columns = ["spectrum", "reduced_sumsq"]
+        for specie in self.simulations:
+            for name in ("Trot", "Tvib", "intensity"):
+                columns += [f"{specie}_{name}", f"{specie}_{name}_dev"]
+        return columns + ["nfev", "fit_time"]
+
+    def result_row(self, specname) -> dict[str, Any]:
+        """
+        The results of the fit of one spectrum, as exported by export_results().
+        reduced_sumsq, nfev and fit_time come from fit_summary(), the residuals
+        are computed again only for spectra without a valid summary.
+
+        args:
+        -----
+        specname: identificator of the spectrum
+
+        return:
+        -------
+        row: *dict* {column: value} with the columns of result_columns(),
+             NaN for the species not added to this spectrum
+        """
+        params = self.spectra[specname]["params"]
+        # if the list of simulations is empty, do not calculate residuals
+        if not params.info["species"]:
+            summary = {}
+        else:
+            summary = self.fit_summary(specname) or self._summarize(
+                specname, self.get_residuals(params.prms, specname)
+            )
 
-                sumsq = numpy.sum(residuals[~numpy.isinf(residuals)] ** 2)
-                if hasattr(self.spectra[specname]["spectrum"], "y"):
-                    y = self.spectra[specname]["spectrum"].y
+        row = {
+            "spectrum": specname,
+            "reduced_sumsq": summary.get("reduced_sumsq", numpy.nan),
+        }
+        for specie in self.simulations:
+            for name in ("Trot", "Tvib", "intensity"):
+                if specie in params.info["species"]:
+                    param = params[f"{specie}_{name}"]
+                    row[f"{specie}_{name}"] = param.value
+                    row[f"{specie}_{name}_dev"] = param.stderr
                 else:
-                    y = self.spectra[specname]["spectrum"]
-                sumsq /= numpy.sum(
-                    y
-                    - self.spectra[specname]["params"]["baseline"].value
-                    - self.spectra[specname]["params"]["baseline_slope"]
-                    * numpy.arange(len(self.spectra[specname]["spectrum"]))
-                )
-            result["reduced_sumsq"].append(sumsq)
-            for specie in self.simulations:
-                if specie in self.spectra[specname]["params"].info["species"]:
-                    result[specie + "_Trot"].append(
-                        self.spectra[specname]["params"][specie + "_Trot"].value
-                    )
+                    row[f"{specie}_{name}"] = numpy.nan
+                    row[f"{specie}_{name}_dev"] = numpy.nan
+        row["nfev"] = summary.get("nfev", numpy.nan)
+        row["fit_time"] = summary.get("fit_time", numpy.nan)
+        return row
 
-                    result[specie + "_Trot_dev"].append(
-                        self.spectra[specname]["params"][specie + "_Trot"].stderr
-                    )
+    def fit_summary(self, specname) -> dict[str, Any] | None:
+        """
+        Summary of the residuals of the spectrum kept by fit() in the params (as
+        params.info['summary'], so that it is saved with them and comes back
+        from the workers of fit_many()).
 
-                    result[specie + "_Tvib"].append(
-                        self.spectra[specname]["params"][specie + "_Tvib"].value
-                    )
+        return:
+        -------
+        summary: *dict* with 'reduced_sumsq', 'nfev', 'fit_time' (in seconds) and
+                 'values' of the parameters it belongs to. None if the spectrum
+                 was not fitted or its parameters have changed since.
+        """
+        params = self.spectra[specname]["params"]
+        summary = params.info.get("summary")
+        if summary is None or summary["values"] != _param_values(params):
+            return None
+        return summary
 
-                    result[specie + "_Tvib_dev"].append(
-                        self.spectra[specname]["params"][specie + "_Tvib"].stderr
-                    )
+    def summarize(self, specnames: Iterable | None = None, workers: int | None = None):
+        """
+        Compute the summaries (see fit_summary()) missing or outdated, for spectra
+        not fitted by this MeasuredSpectra, e.g. loaded from older files.
+        Every summary needs a synthesis, they are spread over a pool of threads
+        sharing self.simulations like fit_many(threads=True).
 
-                    result[specie + "_intensity"].append(
-                        self.spectra[specname]["params"][specie + "_intensity"].value
-                    )
+        args:
+        -----
+        specnames: identificators of the spectra, defaults to all
 
-                    result[specie + "_intensity_dev"].append(
-                        self.spectra[specname]["params"][specie + "_intensity"].stderr
-                    )
-                else:
-                    result[specie + "_Trot"].append(numpy.nan)
-                    result[specie + "_Tvib"].append(numpy.nan)
-                    result[specie + "_Trot_dev"].append(numpy.nan)
-                    result[specie + "_Tvib_dev"].append(numpy.nan)
-                    result[specie + "_intensity"].append(numpy.nan)
-                    result[specie + "_intensity_dev"].append(numpy.nan)
-
-        out = pandas.DataFrame(result)
-        out.to_csv(filename)
+        **kwargs:
+        ---------
+        workers: *int* number of threads, defaults to os.cpu_count()
+        """
+        missing = [
+            specname
+            for specname in (self.spectra if specnames is None else specnames)
+            if self.spectra[specname]["params"].info["species"]
+            and self.fit_summary(specname) is None
+        ]
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers == 1 or len(missing) <= 1:
+            for specname in missing:
+                params = self.spectra[specname]["params"]
+                self._summarize(specname, self.get_residuals(params.prms, specname))
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            summaries = executor.map(
+                lambda specname: _summarize_one(
+                    self.simulations,
+                    specname,
+                    self.spectra[specname]["spectrum"],
+                    self.spectra[specname]["params"],
+                ),
+                missing,
+            )
+            list(summaries)  # stored in the params by _summarize_one()
+
+    def _summarize(self, specname, residuals, **kwargs) -> dict[str, Any]:
+        """store the summary of the residuals (and kwargs) in the params"""
+        params = self.spectra[specname]["params"]
+        residuals = numpy.asarray(residuals)
+        sumsq = numpy.sum(residuals[~numpy.isinf(residuals)] ** 2)
+        if hasattr(self.spectra[specname]["spectrum"], "y"):
+            y = self.spectra[specname]["spectrum"].y
+        else:
+            y = self.spectra[specname]["spectrum"]
+        sumsq /= numpy.sum(
+            y
+            - params["baseline"].value
+            - params["baseline_slope"]
+            * numpy.arange(len(self.spectra[specname]["spectrum"]))
+        )
+        summary = {
+            "reduced_sumsq": float(sumsq),
+            "values": _param_values(params),
+            **kwargs,
+        }
+        params.info["summary"] = summary
+        return summary
+
+    def export_results(
+        self,
+        filename,
+        profile_filename=None,
+        specnames: Iterable | None = None,
+        append: bool = False,
+        workers: int | None = None,
+    ):
+        """
+        Save the results of the optimisation as csv file. Uses pandas.
+        See MeasuredSpectra.result_row() for the columns. The residuals are
+        summarized by the fits, spectra without a summary (see summarize())
+        are synthesized again by a pool of threads.
+
+        args:
+        -----
+        filename: *string* a name of the file, the data will be exported to.
+                  Does NOT ask for confirmation before overwritng!
+
+        **kwargs:
+        ---------
+        profile_filename: *string* if given, the statistics of the stages collected
+                          by oes.profiling are saved into this csv file.
+
+        specnames: identificators of the spectra to export, defaults to all
+
+        append: *bool* defaults to False. If True and the file exists, only the
+                spectra not in the file yet are appended to it, so that the export
+                can be repeated while the fits go on or after an interruption.
+
+        workers: *int* number of threads computing the missing summaries,
+                 defaults to os.cpu_count()
+
+        return:
+        -------
+        pandas.DataFrame with the rows written by this call
+        """
+        import pandas
+
+        specnames = list(self.spectra if specnames is None else specnames)
+        columns = self.result_columns()
+        first_row = 0
+        if append and os.path.exists(filename) and os.path.getsize(filename):
+            exported = pandas.read_csv(filename, index_col=0, dtype={"spectrum": str})
+            if list(exported.columns) != columns:
+                raise ValueError(
+                    f"Columns of {filename} differ from {columns}, cannot append!"
+                )
+            first_row = len(exported)
+            done = set(exported["spectrum"])
+            specnames = [name for name in specnames if str(name) not in done]
+
+        self.summarize(specnames, workers=workers)
+        out = pandas.DataFrame(
+            [self.result_row(specname) for specname in specnames],
+            columns=columns,
+            index=range(first_row, first_row + len(specnames)),
+        )
+        out.to_csv(filename, mode="a" if first_row else "w", header=not first_row)
+        if profile_filename is not None:
+            profiling.report().to_csv(profile_filename)
         return out
+
+
+# simulations shared by all fits in a worker process of MeasuredSpectra.fit_many()
+_worker_simulations: dict = {}
+
+
+def _init_fit_worker(simulations: bytes):
+    global _worker_simulations
+    _worker_simulations = pickle.loads(simulations)
+
+
+def _fit_worker(specname, spec, params, kwargs, profile):
+    if profile:
+        profiling.enable(reset=True)
+    params, result = _fit_one(_worker_simulations, specname, spec, params, kwargs)
+    # the jacobian is a bound method of the minimizer, it does not pickle
+    getattr(result, "call_kws", {}).pop("Dfun", None)
+    stats = profiling.PROFILER.snapshot() if profile else {}
+    return specname, params, result, stats
+
+
+def _fit_in_thread(simulations, specname, spec, params, kwargs, profile):
+    params, result = _fit_one(simulations, specname, spec, params, kwargs)
+    return specname, params, result, {}
+
+
+def _fit_one(simulations, specname, spec, params, kwargs):
+    """
+    Fit a single spectrum by its own MeasuredSpectra, which keeps the state of
+    the fit (the minimizer and the synthesis cache) away from the other workers.
+    """
+    measured = MeasuredSpectra(
+        spectra=OrderedDict([(specname, {"spectrum": spec, "params": params})])
+    )
+    measured.simulations = simulations
+    result = measured.fit(specname, **kwargs)
+    return measured.spectra[specname]["params"], result
+
+
+def _summarize_one(simulations, specname, spec, params):
+    """MeasuredSpectra.summarize() of one spectrum, like _fit_one()"""
+    measured = MeasuredSpectra(
+        spectra=OrderedDict([(specname, {"spectrum": spec, "params": params})])
+    )
+    measured.simulations = simulations
+    residuals = measured.get_residuals(params.prms, specname)
+    return measured._summarize(specname, residuals)
+
+
+def _param_values(par: Parameters) -> list[float]:
+    return [float(param.value) for param in par.prms.values()]
+
+
+def _get_spectrum_batch(sim, Trot, Tvib, wmin, wmax):
+    if hasattr(sim, "get_spectrum_batch"):
+        return sim.get_spectrum_batch(Trot, Tvib, wmin=wmin, wmax=wmax)
+    spectra = [
+        sim.get_spectrum(rot, vib, wmin=wmin, wmax=wmax, as_spectrum=False)
+        for rot, vib in zip(Trot, Tvib)
+    ]
+    return spectra[0][:, 0], numpy.array([spec[:, 1] for spec in spectra])
+
+
+def _params_to_dict(par: Parameters) -> dict[str, Any]:
+    return {
+        "number_of_pixels": par.number_of_pixels,
+        "info": par.info,
+        "prms": par.prms.dumps(),
+    }
+
+
+def _params_from_dict(loaded: dict[str, Any]) -> Parameters:
+    to_app = Parameters(number_of_pixels=loaded["number_of_pixels"])
+    to_app.info = loaded["info"]
+    try:
+        to_app.prms.loads(loaded["prms"])
+    except TypeError:
+        for entry in json.loads(loaded["prms"]):
+            to_app.prms.add(
+                entry[0],
+                value=entry[1],
+                vary=entry[2],
+                min=entry[4],
+                max=entry[5],
+            )
+    return to_app
+
+
+def _params_to_header(par: Parameters) -> dict[str, Any]:
+    """
+    Unlike lmfit.Parameters.dumps(), keeps only the attributes of the parameters,
+    which is orders of magnitude faster.
+    """
+    return {
+        "number_of_pixels": par.number_of_pixels,
+        "info": par.info,
+        "prms": [
+            [p.name, p.value, p.vary, p.min, p.max, p.expr, p.stderr]
+            for p in par.prms.values()
+        ],
+    }
+
+
+def _params_from_header(loaded: dict[str, Any]) -> Parameters:
+    to_app = Parameters(number_of_pixels=loaded["number_of_pixels"])
+    to_app.info = loaded["info"]
+    to_app.prms.clear()  # the defaults, creating new lmfit.Parameters is slower
+    for name, value, vary, low, high, _, stderr in loaded["prms"]:
+        to_app.prms.add(name, value=value, vary=vary, min=low, max=high)
+        to_app.prms[name].stderr = stderr
+    for name, *_, expr, _ in loaded["prms"]:
+        if expr:  # after all the parameters the expression may refer to exist
+            to_app.prms[name].expr = expr
+    return to_app
+
+
+def _at_narrowed_bound(param: "lmfit.Parameter", original: tuple[float, float]):
+    tolerance = 1e-6 * (param.max - param.min)
+    return any(
+        abs(param.value - bound) <= tolerance and bound not in original
+        for bound in (param.min, param.max)
+    )
+
+
+def _print_progress(done, total, specname):
+    print(f"fitted {done}/{total}: {specname}")
@@ -0,0 +1,169 @@
+"""
+Optional instrumentation of the synthesis and fitting pipeline.
+
+Every instrumented stage records the number of calls, the cumulative wall
+time and any counters the stage reports (cache hits, array sizes, ...).
+Disabled by default. When disabled, an instrumented call costs a single
+attribute lookup, when enabled two calls of time.perf_counter().
+
+usage:
+------
+    with profiling.profile() as prof:
+        measured_spectra.fit(specname)
+    print(prof.report())
+"""
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Callable, Iterator, TypeVar
+
+if TYPE_CHECKING:
+    import pandas
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class Profiler:
+    """Cumulative statistics of named stages."""
+
+    def __init__(self):
+        self.enabled = False
+        self.stats: dict[str, dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+
+    def record(self, name: str, elapsed: float):
+        """add a call of stage `name` that took `elapsed` seconds"""
+        with self._lock:
+            stage = self.stats.setdefault(name, {"calls": 0, "time": 0.0})
+            stage["calls"] += 1
+            stage["time"] += elapsed
+
+    def count(self, name: str, counter: str, n: float = 1):
+        """
+        Increment `counter` of stage `name` by n, if enabled. Typically used
+        for cache hits and misses, or for sizes of the processed arrays.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            stage = self.stats.setdefault(name, {"calls": 0, "time": 0.0})
+            stage[counter] = stage.get(counter, 0) + n
+
+    def stage(self, name: str) -> "_Stage | _NullStage":
+        """context manager timing a block of code as stage `name`"""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            return {name: dict(stage) for name, stage in self.stats.items()}
+
+    def merge(self, stats: dict[str, dict[str, float]]):
+        """add statistics collected elsewhere, e.g. in a worker process"""
+        with self._lock:
+            for name, other in stats.items():
+                stage = self.stats.setdefault(name, {"calls": 0, "time": 0.0})
+                for counter, value in other.items():
+                    stage[counter] = stage.get(counter, 0) + value
+
+    def report(self) -> "pandas.DataFrame":
+        """
+        return:
+        -------
+        pandas.DataFrame with one row per stage and columns 'calls', 'time',
+        'time_per_call' and the counters reported by the stage
+        """
+        import pandas
+
+        report = pandas.DataFrame.from_dict(self.snapshot(), orient="index")
+        if len(report) == 0:
+            return pandas.DataFrame(columns=["calls", "time", "time_per_call"])
+        report.index.name = "stage"
+        report["time_per_call"] = report["time"] / report["calls"].where(
+            report["calls"] > 0
+        )
+        return report.sort_values("time", ascending=False)
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+PROFILER = Profiler()
+
+
+def profiled(name: str) -> Callable[[F], F]:
+    """decorator timing every call of the function as stage `name` of PROFILER"""
+
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                PROFILER.record(name, time.perf_counter() - start)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+def enable(reset: bool = False):
+    if reset:
+        PROFILER.reset()
+    PROFILER.enabled = True
+
+
+def disable():
+    PROFILER.enabled = False
+
+
+def report() -> "pandas.DataFrame":
+    return PROFILER.report()
+
+
+@contextmanager
+def profile(reset: bool = True) -> Iterator[Profiler]:
+    """
+    Enable the profiling within the block. By default, the statistics
+    collected before are discarded.
+    """
+    was_enabled = PROFILER.enabled
+    enable(reset=reset)
+    try:
+        yield PROFILER
+    finally:
+        PROFILER.enabled = was_enabled
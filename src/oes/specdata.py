@@ -1,38 +1,238 @@
+import os
 import pathlib
 import sqlite3 as sqlite
-from typing import TYPE_CHECKING, Any, Literal, cast
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Literal, cast
 import warnings
 from copy import copy
 
 import numpy
-import pandas as pd
-from scipy.constants import physical_constants
 
 from oes import spectrum
+from oes.profiling import PROFILER, profiled
 
 if TYPE_CHECKING:
+    import pandas as pd
+
     from oes.measured_spectra import Parameters
 
 DATA_DIR = pathlib.Path(__file__).parent / "data"
 
 
-kB = physical_constants["Boltzmann constant in inverse meters per kelvin"][0]
-kB /= 100  # inverse cm
+# Boltzmann constant in inverse cm per kelvin, the value of scipy.constants
+# ("Boltzmann constant in inverse meters per kelvin" / 100), not imported for it
+kB = 0.69503457
 
 
 WAV_RESERVE = 2
 
+# SharedLineTable files go to memory-backed /dev/shm where available
+SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
 
 class DatabaseError(Exception):
     pass
 
 
+class LineTable:
+    """
+    Lines of a spectral database joined with their upper states, held in
+    memory as contiguous numpy columns. The columns are stored twice, sorted
+    by air and by vacuum wavelength, so that any wavelength window is
+    a contiguous slice found by numpy.searchsorted().
+
+    The columns are read-only, the instance holds no mutable state.
+    """
+
+    LINE_COLUMNS = (
+        "air_wavelength",
+        "vacuum_wavelength",
+        "A",
+        "J",
+        "E_J",
+        "E_v",
+        "wavenumber",
+    )
+    STATE_COLUMNS = ("J", "E_J", "E_v")
+
+    def __init__(
+        self,
+        lines: dict[str, numpy.ndarray],
+        states: dict[str, numpy.ndarray],
+    ):
+        """
+        args:
+        -----
+        lines: dictionary {column name: 1D array}, see LineTable.LINE_COLUMNS
+        states: dictionary {column name: 1D array} of all upper states,
+                see LineTable.STATE_COLUMNS
+        """
+        self.columns: dict[str, dict[str, numpy.ndarray]] = {}
+        for wav in ("air_wavelength", "vacuum_wavelength"):
+            order = numpy.argsort(lines[wav], kind="stable")
+            self.columns[wav] = {
+                name: _read_only(numpy.ascontiguousarray(lines[name][order]))
+                for name in self.LINE_COLUMNS
+            }
+        self.states = {
+            name: _read_only(numpy.ascontiguousarray(states[name], dtype=float))
+            for name in self.STATE_COLUMNS
+        }
+
+    @classmethod
+    def from_connection(cls, conn: sqlite.Connection) -> "LineTable":
+        q = "SELECT " + ", ".join(cls.LINE_COLUMNS)
+        q += " FROM lines INNER JOIN upper_states on upper_state=upper_states.id"
+        lines = numpy.array(conn.execute(q).fetchall(), dtype=float)
+        lines = lines.reshape(-1, len(cls.LINE_COLUMNS))
+
+        q = "SELECT " + ", ".join(cls.STATE_COLUMNS) + " FROM upper_states"
+        states = numpy.array(conn.execute(q).fetchall(), dtype=float)
+        states = states.reshape(-1, len(cls.STATE_COLUMNS))
+
+        return cls(
+            lines={name: lines[:, i] for i, name in enumerate(cls.LINE_COLUMNS)},
+            states={name: states[:, i] for i, name in enumerate(cls.STATE_COLUMNS)},
+        )
+
+    @classmethod
+    def attach(cls, descriptor: dict[str, Any]) -> "LineTable":
+        """
+        LineTable viewing the columns published by SharedLineTable, nothing
+        is copied. `descriptor` is SharedLineTable.descriptor.
+        """
+        line_table = cls.__new__(cls)
+        line_table.columns = {"air_wavelength": {}, "vacuum_wavelength": {}}
+        line_table.states = {}
+        block: numpy.ndarray
+        if os.path.getsize(descriptor["path"]) > 0:
+            block = numpy.memmap(descriptor["path"], dtype=numpy.uint8, mode="r")
+        else:  # empty tables, numpy.memmap() can not map empty files
+            block = numpy.empty(0, dtype=numpy.uint8)
+        for group, name, offset, length, dtype in descriptor["layout"]:
+            dtype = numpy.dtype(dtype)
+            column = block[offset : offset + length * dtype.itemsize].view(dtype)
+            if group == "states":
+                line_table.states[name] = column
+            else:
+                line_table.columns[group][name] = column
+        return line_table
+
+    def __len__(self) -> int:
+        return len(self.columns["air_wavelength"]["A"])
+
+    def window(
+        self,
+        wmin: float,
+        wmax: float,
+        wav: Literal["air_wavelength", "vacuum_wavelength"] = "air_wavelength",
+    ) -> slice:
+        """
+        return:
+        -------
+        slice of the columns sorted by `wav` with wmin <= wav <= wmax
+        """
+        wavelengths = self.columns[wav][wav]
+        start = numpy.searchsorted(wavelengths, wmin, side="left")
+        stop = numpy.searchsorted(wavelengths, wmax, side="right")
+        return slice(int(start), int(stop))
+
+
+class SharedLineTable:
+    """
+    The columns of a LineTable published once in a file in shared memory
+    (/dev/shm where available), so that worker processes map them by
+    LineTable.attach() instead of loading their own copies from the database.
+    All the processes share the same physical pages.
+
+    The file is removed by close(), at the end of the with-block or when the
+    object is garbage collected. The processes attached already keep their mapping.
+    """
+
+    ALIGNMENT = 64
+
+    def __init__(self, line_table: LineTable):
+        arrays = [
+            (group, name, column)
+            for group, columns in line_table.columns.items()
+            for name, column in columns.items()
+        ]
+        arrays += [
+            ("states", name, column) for name, column in line_table.states.items()
+        ]
+        fd, self.path = tempfile.mkstemp(
+            prefix="oes_lines_", suffix=".bin", dir=SHARED_DIR
+        )
+        layout = []
+        offset = 0
+        with os.fdopen(fd, "wb") as fp:
+            for group, name, column in arrays:
+                padding = -offset % self.ALIGNMENT
+                fp.write(bytes(padding))
+                offset += padding
+                fp.write(numpy.ascontiguousarray(column).tobytes())
+                layout.append((group, name, offset, len(column), column.dtype.str))
+                offset += column.nbytes
+        self.descriptor = {"path": self.path, "layout": layout}
+        self._remove = weakref.finalize(self, os.unlink, self.path)
+
+    @property
+    def closed(self) -> bool:
+        return not self._remove.alive
+
+    def close(self):
+        self._remove()
+
+    def __enter__(self) -> "SharedLineTable":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _read_only(arr: numpy.ndarray) -> numpy.ndarray:
+    arr.flags.writeable = False
+    return arr
+
+
+class _SpecDBState(threading.local):
+    """
+    State of SpecDB private to each thread: the connection to the database and
+    the results of the last call kept to be reused by the next one.
+    """
+
+    def __init__(self, uri: str):
+        self.uri = uri
+        self.conn: sqlite.Connection | None = None
+        self.last_Trot: float | None = None
+        self.last_Tvib: float | None = None
+        self.norm: float | None = None
+        self.spec: spectrum.Spectrum | numpy.ndarray | None = None
+        self.last_wmin: float = 0
+        self.last_wmax: float = numpy.inf
+        self.table: "pd.DataFrame | None" = None
+        self.line_pops: dict[str, tuple[float, float, numpy.ndarray]] = {}
+
+    def connection(self) -> sqlite.Connection:
+        if self.conn is None:
+            self.conn = sqlite.connect(self.uri, uri=True)
+        return self.conn
+
+
 class SpecDB:
     """
     Class for working with spectral databases, using pandas
+
+    The database is opened read-only and every thread gets its own connection
+    and its own caches of the last populations, see _SpecDBState. The LineTable
+    is shared, it is never modified after loading. A single SpecDB can thus be
+    used by many threads at once, e.g. by MeasuredSpectra.fit_many(threads=True).
     """
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, in_memory: bool = False):
         """
         args:
         -----
@@ -40,10 +240,14 @@ class SpecDB:
         will be ALWAYS searched for exclusively in lighteroes/data
         directory. Providing full path will result in error.
 
+        in_memory: *bool* defaults to False. If True, the lines are loaded into a LineTable
+        at once and get_spectrum() never queries the database again.
+
         """
 
         self.specie_name = filename.replace(".db", "")
         self.filename = filename
+        self.in_memory = in_memory
         self.uorl = "upper"  # default, fuck off lower
 
         to_open = DATA_DIR / filename
@@ -51,16 +255,16 @@ class SpecDB:
         if not SpecDB.isSQLite3(to_open):
             raise DatabaseError(f"{to_open} is not a valid sqllite database!")
 
-        self.conn = sqlite.connect(to_open)
+        # immutable: sqlite neither locks the file nor checks it for changes
+        self.uri = to_open.resolve().as_uri() + "?mode=ro&immutable=1"
+        self.local = _SpecDBState(self.uri)
+        self._lock = threading.Lock()
 
-        self.states = pd.read_sql_query("select J,E_J,E_v from upper_states", self.conn)
-        self.last_Trot: float | None = None
-        self.last_Tvib: float | None = None
-        self.norm: float | None = None
-        self.spec: spectrum.Spectrum | numpy.ndarray | None = None
-        self.last_wmin: float = 0
-        self.last_wmax: float = numpy.inf
-        self.table: pd.DataFrame | None = None
+        self._states: "pd.DataFrame | None" = None
+        self.line_table: LineTable | None = None
+        self.shared_line_table: SharedLineTable | None = None
+        if in_memory:
+            self.load_line_table()
 
     @staticmethod
     def isSQLite3(filename: pathlib.Path) -> bool:
@@ -75,22 +279,204 @@ class SpecDB:
             header = fd.read(100)
         return header[:16] == b"SQLite format 3\x00"
 
-    def __getstate__(self) -> str:
-        return self.filename
+    @property
+    def conn(self) -> sqlite.Connection:
+        """read-only connection to the database, opened for each thread"""
+        return self.local.connection()
+
+    @property
+    def states(self) -> "pd.DataFrame":
+        """J, E_J and E_v of all the upper states, read at the first use"""
+        if self._states is None:
+            import pandas as pd
+
+            self._states = pd.read_sql_query(
+                "select J,E_J,E_v from upper_states", self.conn
+            )
+        return self._states
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = {"filename": self.filename, "in_memory": self.in_memory}
+        if self.shared_line_table is not None and not self.shared_line_table.closed:
+            state["line_table"] = self.shared_line_table.descriptor
+        return state
+
+    def __setstate__(self, state: str | dict[str, Any]) -> None:
+        if isinstance(state, str):  # pickled by older versions
+            state = {"filename": state}
+        descriptor = state.pop("line_table", None)
+        if descriptor is None or not os.path.exists(descriptor["path"]):
+            # not shared, or the SharedLineTable was closed since the pickling
+            self.__init__(**state)  # type: ignore[misc]
+            return
+        self.__init__(state["filename"])  # type: ignore[misc]
+        self.in_memory = state.get("in_memory", False)
+        # not a single query, the lines are mapped from the shared memory
+        self.line_table = LineTable.attach(descriptor)
 
-    def __setstate__(self, filename: str) -> "SpecDB":
-        return self.__init__(filename)  # type: ignore[misc]
+    def share_line_table(self) -> SharedLineTable:
+        """
+        Load the LineTable and publish it in shared memory. Until the returned
+        SharedLineTable is closed, copies of this SpecDB made by pickle (e.g. in
+        worker processes) attach to it instead of loading the lines again.
+        """
+        if self.shared_line_table is None or self.shared_line_table.closed:
+            self.shared_line_table = SharedLineTable(self.load_line_table())
+        return self.shared_line_table
+
+    @profiled("SpecDB.load_line_table")
+    def load_line_table(self) -> LineTable:
+        """
+        Load all lines into memory (if not done already). Used by
+        get_spectrum() in the in_memory mode.
+        """
+        if self.line_table is None:
+            with self._lock:
+                if self.line_table is None:
+                    self.line_table = LineTable.from_connection(self.conn)
+        return self.line_table
 
     def calculate_norm(
         self,
         Trot: float,
         Tvib: float,
     ) -> float:
+        if self.line_table is not None:
+            states = self.line_table.states
+            parts = (2 * states["J"] + 1) * numpy.exp(
+                -states["E_J"] / (kB * Trot) - states["E_v"] / (kB * Tvib)
+            )
+            return float(numpy.sum(parts))
         parts = (2 * self.states.J + 1) * numpy.exp(
             -self.states.E_J / (kB * Trot) - self.states.E_v / (kB * Tvib)
         )
         return numpy.sum(parts)
 
+    def get_populations(
+        self,
+        Trot: float,
+        Tvib: float,
+        wav: Literal["air_wavelength", "vacuum_wavelength"] = "air_wavelength",
+    ) -> numpy.ndarray:
+        """
+        Relative populations of upper states of all the lines in self.line_table,
+        in the order of `wav`. The last result for each ordering is cached
+        (separately for each thread).
+        """
+        cached = self.local.line_pops.get(wav)
+        if cached is not None and cached[0] == Trot and cached[1] == Tvib:
+            PROFILER.count("SpecDB.populations", "cache_hits")
+            return cached[2]
+        columns = self.load_line_table().columns[wav]
+        with PROFILER.stage("SpecDB.populations"):
+            pops = (2 * columns["J"] + 1) * numpy.exp(
+                -columns["E_v"] / (kB * Tvib) - columns["E_J"] / (kB * Trot)
+            )
+            pops /= self.calculate_norm(Trot, Tvib)
+        self.local.line_pops[wav] = (Trot, Tvib, pops)
+        return pops
+
+    def get_mean_energies(self, Trot: float, Tvib: float) -> tuple[float, float]:
+        """
+        Mean rotational and vibrational energy (in cm-1) of the upper states
+        in the Boltzmann equilibrium at given temperatures.
+        """
+        states = self.load_line_table().states
+        weights = (2 * states["J"] + 1) * numpy.exp(
+            -states["E_J"] / (kB * Trot) - states["E_v"] / (kB * Tvib)
+        )
+        norm = numpy.sum(weights)
+        return (
+            float(numpy.dot(weights, states["E_J"]) / norm),
+            float(numpy.dot(weights, states["E_v"]) / norm),
+        )
+
+    def get_lines(
+        self,
+        Trot: float,
+        Tvib: float,
+        wmin: float,
+        wmax: float,
+        y_scaling: Literal["intensity", "photon_flux"] = "photon_flux",
+        refractive_index: Literal["vacuum", "air"] = "air",
+    ) -> dict[str, numpy.ndarray]:
+        """
+        Lines in the range [wmin, wmax] (with WAV_RESERVE) together with derivatives
+        of their intensities by the temperatures, as needed for the jacobian of a fit.
+        The y-axis is the same as from get_spectrum().
+
+        return:
+        -------
+        dictionary with 1D arrays 'x', 'y', 'dy_dTrot' and 'dy_dTvib'
+        """
+        wav = cast(
+            Literal["vacuum_wavelength", "air_wavelength"],
+            refractive_index + "_wavelength",
+        )
+        line_table = self.load_line_table()
+        window = line_table.window(wmin - WAV_RESERVE, wmax + WAV_RESERVE, wav=wav)
+        columns = line_table.columns[wav]
+
+        y = self.get_populations(Trot, Tvib, wav=wav)[window] * columns["A"][window]
+        if y_scaling == "intensity":
+            y *= columns["wavenumber"][window]
+
+        # d(ln pops)/dT = (E - <E>) / (kB T^2), <E> comes from the partition sum
+        mean_E_J, mean_E_v = self.get_mean_energies(Trot, Tvib)
+        return {
+            "x": columns[wav][window],
+            "y": y,
+            "dy_dTrot": y * (columns["E_J"][window] - mean_E_J) / (kB * Trot**2),
+            "dy_dTvib": y * (columns["E_v"][window] - mean_E_v) / (kB * Tvib**2),
+        }
+
+    def get_spectrum_batch(
+        self,
+        Trot: numpy.ndarray,
+        Tvib: numpy.ndarray,
+        wmin: float,
+        wmax: float,
+        y_scaling: Literal["intensity", "photon_flux"] = "photon_flux",
+        refractive_index: Literal["vacuum", "air"] = "air",
+    ) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Same as get_spectrum(), but for many pairs of temperatures at once.
+
+        args:
+        -----
+        Trot, Tvib: 1D arrays of the same length N
+
+        return:
+        -------
+        (x, y): x is 1D array of the positions of the lines,
+                y is 2D array of shape (N, len(x))
+        """
+        wav = cast(
+            Literal["vacuum_wavelength", "air_wavelength"],
+            refractive_index + "_wavelength",
+        )
+        line_table = self.load_line_table()
+        window = line_table.window(wmin - WAV_RESERVE, wmax + WAV_RESERVE, wav=wav)
+        columns = line_table.columns[wav]
+        states = line_table.states
+        inv_kTrot = 1 / (kB * numpy.asarray(Trot, dtype=float)[:, numpy.newaxis])
+        inv_kTvib = 1 / (kB * numpy.asarray(Tvib, dtype=float)[:, numpy.newaxis])
+
+        norm = numpy.sum(
+            (2 * states["J"] + 1)
+            * numpy.exp(-states["E_J"] * inv_kTrot - states["E_v"] * inv_kTvib),
+            axis=1,
+        )
+        y = (2 * columns["J"][window] + 1) * numpy.exp(
+            -columns["E_v"][window] * inv_kTvib - columns["E_J"][window] * inv_kTrot
+        )
+        y *= columns["A"][window]
+        y /= norm[:, numpy.newaxis]
+        if y_scaling == "intensity":
+            y *= columns["wavenumber"][window]
+        return columns[wav][window], y
+
+    @profiled("SpecDB.get_spectrum")
     def get_spectrum(
         self,
         Trot: float,
@@ -115,44 +501,80 @@ class SpecDB:
             Literal["vacuum_wavelength", "air_wavelength"],
             refractive_index + "_wavelength",
         )
+        if self.in_memory:
+            return self._get_spectrum_in_memory(
+                Trot, Tvib, wmin, wmax, as_spectrum, y_scaling, wav
+            )
+        state = self.local
         recalculate_pops = False
 
-        if wmin < self.last_wmin or wmax > self.last_wmax or self.table is None:
+        if wmin < state.last_wmin or wmax > state.last_wmax or state.table is None:
 
-            self.last_wmin = wmin - WAV_RESERVE
-            self.last_wmax = wmax + WAV_RESERVE
-            self.table = self.get_table_from_DB(self.last_wmin, self.last_wmax, wav=wav)
+            state.last_wmin = wmin - WAV_RESERVE
+            state.last_wmax = wmax + WAV_RESERVE
+            state.table = self.get_table_from_DB(
+                state.last_wmin, state.last_wmax, wav=wav
+            )
             recalculate_pops = True
+        else:
+            PROFILER.count("SpecDB.fetch", "cache_hits")
 
-        if self.last_Trot != Trot or self.last_Tvib != Tvib or recalculate_pops:
-            self.norm = self.calculate_norm(Trot, Tvib)
-            self.last_Trot = Trot
-            self.last_Tvib = Tvib
-            self.table["pops"] = (
-                (2 * self.table["J"] + 1)
-                * numpy.exp(
-                    -self.table["E_v"] / (kB * Tvib) - self.table["E_J"] / (kB * Trot)  # type: ignore[operator]
+        if state.last_Trot != Trot or state.last_Tvib != Tvib or recalculate_pops:
+            with PROFILER.stage("SpecDB.populations"):
+                state.norm = self.calculate_norm(Trot, Tvib)
+                state.last_Trot = Trot
+                state.last_Tvib = Tvib
+                state.table["pops"] = (
+                    (2 * state.table["J"] + 1)
+                    * numpy.exp(
+                        -state.table["E_v"] / (kB * Tvib) - state.table["E_J"] / (kB * Trot)  # type: ignore[operator]
+                    )
+                    / state.norm
                 )
-                / self.norm
-            )
+        else:
+            PROFILER.count("SpecDB.populations", "cache_hits")
 
-        self.table["y"] = self.table["pops"] * self.table["A"]
+        state.table["y"] = state.table["pops"] * state.table["A"]
 
         if y_scaling == "intensity":
-            self.table["y"] *= self.table["wavenumber"]
+            state.table["y"] *= state.table["wavenumber"]
         if as_spectrum:
-            self.spec = spectrum.Spectrum(x=self.table[wav], y=self.table["y"])
+            state.spec = spectrum.Spectrum(x=state.table[wav], y=state.table["y"])
         else:
-            self.spec = numpy.array([self.table[wav], self.table["y"]]).T
+            state.spec = numpy.array([state.table[wav], state.table["y"]]).T
+
+        return copy(state.spec)
+
+    def _get_spectrum_in_memory(
+        self,
+        Trot: float,
+        Tvib: float,
+        wmin: float,
+        wmax: float,
+        as_spectrum: bool,
+        y_scaling: Literal["intensity", "photon_flux"],
+        wav: Literal["air_wavelength", "vacuum_wavelength"],
+    ) -> spectrum.Spectrum | numpy.ndarray:
+        line_table = self.load_line_table()
+        window = line_table.window(wmin - WAV_RESERVE, wmax + WAV_RESERVE, wav=wav)
+        columns = line_table.columns[wav]
+        PROFILER.count("SpecDB.fetch", "cache_hits")
 
-        return copy(self.spec)
+        y = self.get_populations(Trot, Tvib, wav=wav)[window] * columns["A"][window]
+        if y_scaling == "intensity":
+            y *= columns["wavenumber"][window]
 
+        if as_spectrum:
+            return spectrum.Spectrum(x=columns[wav][window], y=y)
+        return numpy.array([columns[wav][window], y]).T
+
+    @profiled("SpecDB.fetch")
     def get_table_from_DB(
         self,
         wmin=None,
         wmax=None,
         wav: Literal["air_wavelength", "vacuum_wavelength"] = "air_wavelength",
-    ) -> pd.DataFrame:
+    ) -> "pd.DataFrame":
         """ """
         q = "SELECT air_wavelength, vacuum_wavelength, A, J, E_J, E_v, wavenumber"
         q += " FROM "
@@ -165,6 +587,8 @@ class SpecDB:
         q += " INNER JOIN "
         q += " upper_states on upper_state=upper_states.id"
         q += " ORDER BY " + wav
+        import pandas as pd
+
         table = pd.read_sql_query(q, self.conn, params=params)
         return table
 
@@ -204,6 +628,8 @@ class SpecDB:
             q += " and J <= ?"
             params.append(max_J)
 
+        import pandas as pd
+
         big_table = pd.read_sql_query(q, self.conn, params=params)
 
         if singlet_like:
@@ -238,6 +664,203 @@ class SpecDB:
         }
 
 
+class LineList:
+    """
+    Lines of several species in a wavelength window, merged into a single
+    list sorted by wavelength. The merge and the sort are done once, the
+    weights of the lines (population * emission coefficient * intensity of the
+    specie) are then written in place into self.y by update(), without sorting
+    or allocating.
+
+    self.x holds the sorted positions of the lines, self.positions[specie] the
+    indices of the lines of the specie in the merged list, in the order of the
+    LineTable of the specie.
+    """
+
+    def __init__(
+        self,
+        sims: dict[str, "SpecDB"],
+        wmin: float,
+        wmax: float,
+        refractive_index: Literal["vacuum", "air"] = "air",
+    ):
+        """
+        args:
+        -----
+        sims: dictionary {specie_name: SpecDB} of the merged species
+        wmin, wmax: wavelength window, widened by WAV_RESERVE as in SpecDB.get_spectrum()
+        refractive_index: 'air' or 'vacuum' wavelengths
+        """
+        self.sims = sims
+        self.wav = cast(
+            Literal["vacuum_wavelength", "air_wavelength"],
+            refractive_index + "_wavelength",
+        )
+        self.windows: dict[str, slice] = {}
+        self.columns: dict[str, dict[str, numpy.ndarray]] = {}
+        for specie, sim in sims.items():
+            line_table = sim.load_line_table()
+            self.windows[specie] = line_table.window(
+                wmin - WAV_RESERVE, wmax + WAV_RESERVE, wav=self.wav
+            )
+            self.columns[specie] = {
+                name: column[self.windows[specie]]
+                for name, column in line_table.columns[self.wav].items()
+            }
+
+        unsorted = numpy.concatenate(
+            [columns[self.wav] for columns in self.columns.values()]
+        )
+        order = numpy.argsort(unsorted, kind="stable")
+        self.x = _read_only(unsorted[order])
+        rank = numpy.empty(len(order), dtype=numpy.intp)
+        rank[order] = numpy.arange(len(order))
+        self.positions: dict[str, numpy.ndarray] = {}
+        start = 0
+        for specie, columns in self.columns.items():
+            stop = start + len(columns[self.wav])
+            self.positions[specie] = _read_only(rank[start:stop])
+            start = stop
+
+        self.y = numpy.zeros(len(self.x))
+        self._buffers = {
+            specie: numpy.empty(len(positions))
+            for specie, positions in self.positions.items()
+        }
+        self._weights: dict[str, tuple[float, float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def window(self, wmin: float, wmax: float) -> slice:
+        """
+        return:
+        -------
+        slice of self.x and self.y with wmin <= x <= wmax
+        """
+        start = numpy.searchsorted(self.x, wmin, side="left")
+        stop = numpy.searchsorted(self.x, wmax, side="right")
+        return slice(int(start), int(stop))
+
+    def set_weights(
+        self, specie: str, Trot: float, Tvib: float, intensity: float = 1.0
+    ) -> numpy.ndarray:
+        """
+        Write the weights of the lines of `specie` into self.y (the y-axis of
+        SpecDB.get_spectrum() times `intensity`). Nothing is done if the
+        arguments did not change since the last call.
+        """
+        weights = (Trot, Tvib, intensity)
+        if self._weights.get(specie) == weights:
+            return self.y
+        buffer = self._buffers[specie]
+        pops = self.sims[specie].get_populations(Trot, Tvib, wav=self.wav)
+        numpy.multiply(
+            pops[self.windows[specie]], self.columns[specie]["A"], out=buffer
+        )
+        buffer *= intensity
+        self.y[self.positions[specie]] = buffer
+        self._weights[specie] = weights
+        return self.y
+
+    def update(self, params: "Parameters") -> numpy.ndarray:
+        """
+        Set the weights of all the species from {specie}_Trot, {specie}_Tvib and
+        {specie}_intensity of `params`, return self.y.
+        """
+        for specie in self.sims:
+            self.set_weights(
+                specie,
+                params[specie + "_Trot"].value,
+                params[specie + "_Tvib"].value,
+                params[specie + "_intensity"].value,
+            )
+        return self.y
+
+
+class SynthesisCache:
+    """
+    Recent outputs of the stages of generate_spectrum(), each keyed on the
+    values the stage depends on:
+
+    'lines': lines of a specie, on (specie, Trot, Tvib, window)
+    'shape': lines of unit intensity rendered onto the pixels, on the key of
+             the lines plus the slit function, the mesh density and the pixels
+    'spectrum': the convolved spectrum of the fine-mesh path (no pixels given),
+                on all the parameters except the baseline
+
+    The cache also holds the spectrum.Resampler matching the fine-mesh spectra
+    onto the pixels, its weights are kept while the mesh and the pixels stay,
+    and the LineList objects merging the lines of the species, see line_list().
+
+    The intensity of a specie only scales its shape and the baseline is added
+    last, so changing them costs no synthesis at all. Changing wav_shift moves
+    the pixels and renders the shapes again, but reuses the lines.
+
+    Every stage keeps `maxsize` entries, enough for the finite differences of
+    the optimizers, which perturb one parameter at a time. The cached arrays
+    are read-only. Pickled empty.
+    """
+
+    STAGES = ("lines", "shape", "spectrum")
+
+    def __init__(self, maxsize: int = 16):
+        self.maxsize = maxsize
+        self.stages: dict[str, OrderedDict[tuple, Any]] = {
+            stage: OrderedDict() for stage in self.STAGES
+        }
+        self.resampler = spectrum.Resampler()
+        self.line_lists: OrderedDict[tuple, LineList] = OrderedDict()
+
+    def __getstate__(self) -> dict[str, Any]:
+        return {"maxsize": self.maxsize}
+
+    def __setstate__(self, state: dict[str, Any]):
+        self.__init__(**state)  # type: ignore[misc]
+
+    def clear(self):
+        for entries in self.stages.values():
+            entries.clear()
+        self.resampler = spectrum.Resampler()
+        self.line_lists.clear()
+
+    def get(self, stage: str, key: tuple, compute: Callable[[], Any]) -> Any:
+        """return the output of `stage` for `key`, calling compute() if not cached"""
+        entries = self.stages[stage]
+        if key in entries:
+            entries.move_to_end(key)
+            PROFILER.count(f"SynthesisCache.{stage}", "cache_hits")
+            return entries[key]
+        PROFILER.count(f"SynthesisCache.{stage}", "cache_misses")
+        value = compute()
+        for array in value if isinstance(value, tuple) else (value,):
+            array.flags.writeable = False
+        entries[key] = value
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+        return value
+
+    def line_list(
+        self, sims: dict[str, "SpecDB"], wmin: float, wmax: float
+    ) -> LineList:
+        """LineList of the species in `sims` for the window, merged only once"""
+        key = (tuple((specie, id(sim)) for specie, sim in sims.items()), wmin, wmax)
+        if key in self.line_lists:
+            self.line_lists.move_to_end(key)
+            PROFILER.count("SynthesisCache.line_list", "cache_hits")
+            return self.line_lists[key]
+        PROFILER.count("SynthesisCache.line_list", "cache_misses")
+        line_list = self.line_lists[key] = LineList(sims, wmin, wmax)
+        if len(self.line_lists) > self.maxsize:
+            self.line_lists.popitem(last=False)
+        return line_list
+
+
+def _pixels_key(x: numpy.ndarray) -> tuple:
+    return (len(x), hash(x.tobytes()))
+
+
+@profiled("generate_spectrum")
 def generate_spectrum(
     params: "Parameters",
     step: float,
@@ -245,32 +868,164 @@ def generate_spectrum(
     wmax: float,
     sims: dict = {},
     points_per_nm: int = 1000,
+    x: numpy.ndarray | None = None,
+    cache: SynthesisCache | None = None,
+    profile: str = "wofz",
 ) -> spectrum.Spectrum:
+    """
+    Simulate the spectrum described by `params` in the range [wmin, wmax].
 
-    spectra = []
-    for specie in params.info["species"]:
-        temp_spec = sims[specie].get_spectrum(
-            params[specie + "_Trot"].value,
-            params[specie + "_Tvib"].value,
-            wmin=wmin,
-            wmax=wmax,
-            as_spectrum=False,
-        )
-        temp_spec[:, 1] *= params[specie + "_intensity"].value
-        spectra.append(temp_spec)
-    if len(spectra) == 0:
+    args:
+    -----
+    params: Parameters object
+    step: *float* distance between pixels of the spectrometer in nm
+    wmin, wmax: *float* wavelength range in nm
+    sims: dictionary {specie_name: SpecDB}
+    points_per_nm: density of the mesh the lines are broadened on
+    x: *numpy array* optional x-axis (typically the pixels of the measured spectrum).
+       If given, the lines are rendered directly onto it by
+       spectrum.render_lines() instead of refining the mesh.
+    cache: SynthesisCache object, if given, only the stages depending on
+           the changed parameters are recomputed
+    profile: evaluation of the voigt profile, see spectrum.VOIGT_PROFILES
+
+    return:
+    -------
+    Spectrum object
+    """
+
+    species = params.info["species"]
+    if len(species) == 0:
         warnings.warn("No simulation files given, returning empty spectrum!", Warning)
         return spectrum.Spectrum(x=[], y=[])
 
-    spec = numpy.concatenate(spectra)
-    spec = spec[spec[:, 0].argsort()]
-    spec = spectrum.Spectrum(x=spec[:, 0], y=spec[:, 1])
-    spec.refine_mesh(points_per_nm=points_per_nm)
-    spec.convolve_with_slit_function(
-        gauss=params["slitf_gauss"].value,
-        lorentz=params["slitf_lorentz"].value,
-        instrumental_step=step,
-    )
+    # lines farther than WAV_RESERVE from the pixels do not contribute to the
+    # rendered spectrum, the window is widened to multiples of WAV_RESERVE
+    # so that the cached lines survive small changes of wav_shift
+    if cache is None:
+        lines_window = (wmin, wmax)
+    else:
+        lines_window = (
+            numpy.floor(wmin / WAV_RESERVE) * WAV_RESERVE,
+            numpy.ceil(wmax / WAV_RESERVE) * WAV_RESERVE,
+        )
+
+    def get_lines(specie: str) -> numpy.ndarray:
+        Trot = params[specie + "_Trot"].value
+        Tvib = params[specie + "_Tvib"].value
+
+        def fetch() -> numpy.ndarray:
+            return sims[specie].get_spectrum(
+                Trot, Tvib, *lines_window, as_spectrum=False
+            )
+
+        if cache is None:
+            return fetch()
+        return cache.get("lines", (specie, Trot, Tvib, *lines_window), fetch)
+
+    def get_all_lines(low: float, high: float) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """sorted positions and weights of the lines of all the species in [low, high]"""
+        if cache is not None and all(
+            hasattr(sims[specie], "load_line_table") for specie in species
+        ):
+            # the merged list is kept by the cache, only the weights are updated
+            specie_sims = {specie: sims[specie] for specie in species}
+            line_list = cache.line_list(specie_sims, *lines_window)
+            line_list.update(params)
+            window = line_list.window(low, high)
+            return line_list.x[window], line_list.y[window]
+        # without a cache, the windowed queries are cheaper than loading the
+        # whole LineTable and merging it on every call; sims without a
+        # LineTable, e.g. PopulationSurrogate, provide only the lines anyway
+        lines = numpy.concatenate(
+            [
+                get_lines(specie) * [1.0, params[specie + "_intensity"].value]
+                for specie in species
+            ]
+        )
+        lines = lines[numpy.argsort(lines[:, 0], kind="stable")]
+        inside = (lines[:, 0] >= low) & (lines[:, 0] <= high)
+        return lines[inside, 0], lines[inside, 1]
+
+    gauss = params["slitf_gauss"].value
+    lorentz = params["slitf_lorentz"].value
+    if x is None:
+
+        def convolve() -> tuple[numpy.ndarray, numpy.ndarray]:
+            # the lines of the exact window, as SpecDB.get_spectrum() returns them
+            line_x, line_y = get_all_lines(wmin - WAV_RESERVE, wmax + WAV_RESERVE)
+            spec = spectrum.Spectrum(x=line_x, y=line_y)
+            spec.refine_mesh(points_per_nm=points_per_nm)
+            spec.convolve_with_slit_function(
+                gauss=gauss, lorentz=lorentz, instrumental_step=step, profile=profile
+            )
+            return spec.x, spec.y
+
+        if cache is None:
+            mesh, y = convolve()
+        else:
+            spectrum_key = (
+                *(
+                    (
+                        specie,
+                        params[specie + "_Trot"].value,
+                        params[specie + "_Tvib"].value,
+                        params[specie + "_intensity"].value,
+                    )
+                    for specie in species
+                ),
+                gauss,
+                lorentz,
+                step,
+                points_per_nm,
+                wmin,
+                wmax,
+                profile,
+            )
+            mesh, y = cache.get("spectrum", spectrum_key, convolve)
+        spec = spectrum.Spectrum(x=mesh, y=y.copy())
+    else:
+
+        def render(line_x: numpy.ndarray, line_y: numpy.ndarray) -> numpy.ndarray:
+            return spectrum.render_lines(
+                line_x,
+                line_y,
+                x,
+                gauss=gauss,
+                lorentz=lorentz,
+                instrumental_step=step,
+                points_per_nm=points_per_nm,
+                profile=profile,
+            )
+
+        def render_specie(specie: str) -> numpy.ndarray:
+            lines = get_lines(specie)
+            return render(lines[:, 0], lines[:, 1])
+
+        if cache is None:
+            # all the species in a single rendering
+            y = render(*get_all_lines(-numpy.inf, numpy.inf))
+        else:
+            # the shapes of the species are cached, the intensities only scale them
+            y = numpy.zeros(len(x))
+            for specie in species:
+                shape_key = (
+                    specie,
+                    params[specie + "_Trot"].value,
+                    params[specie + "_Tvib"].value,
+                    *lines_window,
+                    gauss,
+                    lorentz,
+                    step,
+                    points_per_nm,
+                    profile,
+                    _pixels_key(x),
+                )
+                shape = cache.get("shape", shape_key, lambda: render_specie(specie))
+                y += params[specie + "_intensity"].value * shape
+        if any(numpy.isnan(y)):
+            y[:] = 1e100
+        spec = spectrum.Spectrum(x=x, y=y)
     if len(spec.y) > 0:
         spec.y += params["baseline"].value
         spec.y += params["baseline_slope"].value * (spec.x - wmin)
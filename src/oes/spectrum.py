@@ -1,10 +1,11 @@
+import functools
 import logging
 import warnings
 
 import numpy as np
-from scipy.interpolate import interp1d  # type: ignore [import-untyped]
-from scipy.signal import fftconvolve  # type: ignore [import-untyped]
-from scipy.special import wofz  # type: ignore [import-untyped]
+import numpy.typing
+
+from oes.profiling import PROFILER, profiled
 
 
 class Spectrum:
@@ -36,57 +37,52 @@ class Spectrum:
     def __len__(self):
         return len(self.x)
 
+    @profiled("Spectrum.convolve_with_slit_function")
     def convolve_with_slit_function(
         self,
         gauss: float = 0.1,
         lorentz: float = 1e-9,
         instrumental_step: float | None = None,
+        profile: str = "wofz",
     ):
         """
         Broaden the peaks in the spectrum by voigt profile and by a rectangle of given width.
         Changes state of the instance, returns nothing.
 
+        The kernel is that of slit_kernel(), normalised over its own window.
+        Older versions normalised the voigt profile over the whole mesh, so that
+        the result depended on the simulated range, e.g. it was 0.8% lower for
+        gauss = lorentz = 0.025 nm on 306-316 nm. The fitted intensities
+        are lower by as much now, with render_on_pixels=False too.
+
         **kwargs:
         ---------
         gauss: *float* gaussian HWHM, defaults to 0.1
         lorentz: *float* lorentzian HWHM, defaults to 1e-9
         step: *float* distance between pixels in nm
+        profile: *str* evaluation of the voigt profile, see VOIGT_PROFILES
 
         return:
         -------
         None, modifies the spectrum in place
         """
+        # scipy.signal takes half a second to import, only on the first call
+        from scipy.signal import fftconvolve  # type: ignore [import-untyped]
 
-        slit = voigt(self.x, gauss, lorentz, np.mean(self.x), 1.0)  # type: ignore [arg-type]
-        slit /= np.sum(slit)
-
-        numpoints = len(self.y)
-        if instrumental_step is None:
-            convolution_profile = slit[slit > max(slit) / 1000.0]
-        else:
-            # covolve with a rectangle of width equal to the instrumental step
-            # to avoid losing thin lines
+        if len(self.x) > 1:
             simulated_step = self.x[1] - self.x[0]
-            if instrumental_step / simulated_step < 1:
-                msg = "Your simulated spectra resolution is more rough than experimental data."
-                warnings.warn(msg, UserWarning)
-                convolution_profile = slit[slit > max(slit) / 1000.0]
-            else:
-                instrumental_step_profile = np.ones(
-                    int(instrumental_step / simulated_step) + 1
-                )
-                if len(slit) >= len(instrumental_step_profile):
-                    convolution_profile_uncut = fftconvolve(
-                        slit, instrumental_step_profile, mode="same"
-                    )
-                else:
-                    convolution_profile_uncut = fftconvolve(
-                        instrumental_step_profile, slit, mode="same"
-                    )
-                convolution_profile = convolution_profile_uncut[
-                    convolution_profile_uncut > max(convolution_profile_uncut) / 1000
-                ]
+        else:
+            simulated_step = 1.0
+        _, convolution_profile = slit_kernel(
+            gauss,
+            lorentz,
+            simulated_step,
+            instrumental_step=instrumental_step,
+            profile=profile,
+        )
 
+        numpoints = len(self.y)
+        PROFILER.count("Spectrum.convolve_with_slit_function", "size", numpoints)
         self.y = fftconvolve(self.y, convolution_profile, mode="same")
 
         if len(self.y) == 0:
@@ -98,6 +94,7 @@ class Spectrum:
             self.y[:] = 1e100
         return
 
+    @profiled("Spectrum.refine_mesh")
     def refine_mesh(self, points_per_nm: int = 3000):
         """
         adds artificial zeros in between lines. Usually used after creating
@@ -112,6 +109,7 @@ class Spectrum:
         end_spec = np.max(self.x) + 2
 
         no_of_points = int(np.abs(end_spec - start_spec) * points_per_nm)
+        PROFILER.count("Spectrum.refine_mesh", "size", no_of_points)
 
         spec = np.zeros((no_of_points, 2))
 
@@ -125,16 +123,374 @@ class Spectrum:
         return spec
 
 
-def match_spectra(sim_spec: Spectrum, exp_spec: Spectrum) -> tuple[Spectrum, Spectrum]:
+SLIT_KERNEL_CACHE_SIZE = 128
+
+
+def slit_kernel(
+    gauss: float,
+    lorentz: float,
+    simulated_step: float,
+    instrumental_step: float | None = None,
+    profile: str = "wofz",
+) -> tuple[np.typing.NDArray[np.float64], np.typing.NDArray[np.float64]]:
+    """
+    Build the slit function sampled with `simulated_step`, cut where it drops
+    below 1/1000 of its maximum. This is the kernel used by
+    Spectrum.convolve_with_slit_function() and render_lines().
+
+    The kernels are kept in a LRU cache of SLIT_KERNEL_CACHE_SIZE entries, see
+    slit_kernel_cache_info(). The returned arrays are read-only.
+
+    args:
+    -----
+    gauss: *float* gaussian HWHM
+    lorentz: *float* lorentzian HWHM
+    simulated_step: *float* distance between the points of the kernel in nm
+    instrumental_step: *float* distance between pixels in nm. If given, the voigt
+                       profile is convolved with a rectangle of this width
+                       to avoid losing thin lines.
+    profile: *str* evaluation of the voigt profile, one of VOIGT_PROFILES
+
+    return:
+    -------
+    (offsets, profile): offsets from the line centre in nm and the values of the
+    kernel. The voigt part is normalised to unit sum over the window of
+    4*gauss + 60*lorentz (+ instrumental_step) around the centre, before the
+    cut, the rectangle is not normalised.
+    The kernel is padded by a single zero on both sides.
+    """
+    key = (
+        float(gauss),
+        float(lorentz),
+        float(simulated_step),
+        None if instrumental_step is None else float(instrumental_step),
+        _check_profile(profile),
+    )
+    if not PROFILER.enabled:
+        return _cached_slit_kernel(*key)
+    misses = _cached_slit_kernel.cache_info().misses
+    with PROFILER.stage("slit_kernel"):
+        kernel = _cached_slit_kernel(*key)
+    if _cached_slit_kernel.cache_info().misses == misses:
+        PROFILER.count("slit_kernel", "cache_hits")
+    else:
+        PROFILER.count("slit_kernel", "cache_misses")
+    return kernel
+
+
+def slit_kernel_cache_info() -> functools._CacheInfo:
+    """
+    Statistics of the slit kernel cache: hits, misses, maxsize and currsize.
+    """
+    return _cached_slit_kernel.cache_info()
+
+
+def clear_slit_kernel_cache():
+    _cached_slit_kernel.cache_clear()
+
+
+@functools.lru_cache(maxsize=SLIT_KERNEL_CACHE_SIZE)
+def _cached_slit_kernel(
+    gauss: float,
+    lorentz: float,
+    simulated_step: float,
+    instrumental_step: float | None,
+    profile: str,
+) -> tuple[np.typing.NDArray[np.float64], np.typing.NDArray[np.float64]]:
+    # the lorentzian wings decay slowly, the cut at 1/1000 of the maximum
+    # is always inside of this window
+    half_width = 4 * gauss + 60 * lorentz + (instrumental_step or 0.0)
+    n = int(half_width / simulated_step) + 1
+    offsets = np.arange(-n, n + 1) * simulated_step
+    # the profile is symmetric, only the right half is evaluated
+    right = voigt(offsets[n:], gauss, lorentz, 0.0, 1.0, profile=profile)
+    slit = np.concatenate([right[:0:-1], right])
+    slit /= np.sum(slit)
+
+    if instrumental_step is None:
+        kernel = slit
+    elif instrumental_step / simulated_step < 1:
+        msg = "Your simulated spectra resolution is more rough than experimental data."
+        warnings.warn(msg, UserWarning)
+        kernel = slit
+    else:
+        instrumental_step_profile = np.ones(int(instrumental_step / simulated_step) + 1)
+        if len(slit) >= len(instrumental_step_profile):
+            kernel = _box_filter(slit, len(instrumental_step_profile))
+        else:
+            from scipy.signal import fftconvolve  # type: ignore [import-untyped]
+
+            kernel = fftconvolve(instrumental_step_profile, slit, mode="same")
+
+    (above,) = np.nonzero(kernel > np.max(kernel, initial=-np.inf) / 1000.0)
+    if len(above) == 0:
+        # e.g. negative widths, the NaN makes the callers return huge residuals
+        return _read_only(np.zeros(1)), _read_only(np.full(1, np.nan))
+    start = max(above[0] - 1, 0)
+    stop = min(above[-1] + 2, len(kernel))
+    offsets = offsets[start:stop].copy()
+    kernel = kernel[start:stop].copy()
+    kernel[0 : above[0] - start] = 0
+    kernel[above[-1] - start + 1 :] = 0
+    return _read_only(offsets), _read_only(kernel)
+
+
+def _box_filter(
+    values: np.typing.NDArray[np.float64], width: int
+) -> np.typing.NDArray[np.float64]:
+    """
+    fftconvolve(values, np.ones(width), mode="same") for width <= len(values),
+    as differences of the cumulative sum
+    """
+    cumulative = np.zeros(len(values) + 1)
+    np.cumsum(values, out=cumulative[1:])
+    # the full convolution is sum(values[k - width + 1 : k + 1]) at k
+    k = np.arange(len(values)) + (width - 1) // 2
+    return (
+        cumulative[np.minimum(k + 1, len(values))]
+        - cumulative[np.maximum(k - width + 1, 0)]
+    )
+
+
+def _read_only(array: np.typing.NDArray[np.float64]) -> np.typing.NDArray[np.float64]:
+    array.flags.writeable = False
+    return array
+
+
+@profiled("render_lines")
+def render_lines(
+    line_x: np.typing.NDArray[np.float64],
+    line_y: np.typing.NDArray[np.float64],
+    grid_x: np.typing.NDArray[np.float64],
+    gauss: float,
+    lorentz: float,
+    instrumental_step: float | None = None,
+    points_per_nm: int = 1000,
+    derivative: bool = False,
+    profile: str = "wofz",
+) -> np.typing.NDArray[np.float64]:
+    """
+    Broaden the lines by the slit function and evaluate the result directly
+    at the points of `grid_x` (typically the pixels of the detector). Each
+    line is evaluated only on the pixels covered by the slit kernel, so
+    no dense mesh is ever created.
+
+    Gives the same result as Spectrum.refine_mesh(), followed by
+    Spectrum.convolve_with_slit_function() and match_spectra(), just without
+    snapping the lines to the fine mesh.
+
+    args:
+    -----
+    line_x: positions of the lines in nm
+    line_y: intensities of the lines. Can be 2D array of shape (k, len(line_x)),
+            then k spectra sharing the line positions are rendered at once.
+    grid_x: ascending x-axis, the lines will be rendered on
+    gauss, lorentz, instrumental_step, profile: see slit_kernel()
+    points_per_nm: sampling of the slit kernel, the kernel is interpolated
+                   linearly in between
+    derivative: *bool* if True, the derivative of the slit kernel is used instead,
+                i.e. the derivative of the result by a shift of grid_x is returned
+
+    return:
+    -------
+    numpy array of len(grid_x), or of shape (k, len(grid_x)) for 2D line_y
+    """
+    out = np.zeros(np.shape(line_y)[:-1] + (len(grid_x),))
+    if len(line_x) == 0 or len(grid_x) == 0:
+        return out
+
+    offsets, kernel = slit_kernel(
+        gauss,
+        lorentz,
+        1.0 / points_per_nm,
+        instrumental_step=instrumental_step,
+        profile=profile,
+    )
+    if not np.isfinite(kernel).all():
+        out[...] = np.nan  # e.g. negative widths, see slit_kernel()
+        return out
+    first = np.searchsorted(grid_x, line_x + offsets[0], side="left")
+    last = np.searchsorted(grid_x, line_x + offsets[-1], side="right")
+    width = int(np.max(last - first))
+    if width == 0:
+        return out
+    PROFILER.count("render_lines", "size", len(line_x) * width)
+
+    pixels = first[:, np.newaxis] + np.arange(width)
+    outside = pixels >= last[:, np.newaxis]
+    pixels[outside] = 0
+
+    # linear interpolation in the equidistant kernel
+    position = grid_x[pixels]
+    position -= line_x[:, np.newaxis]
+    position -= offsets[0]
+    position *= points_per_nm
+    np.clip(position, 0, len(kernel) - 1, out=position)
+    index = position.astype(np.intp)
+    np.minimum(index, len(kernel) - 2, out=index)
+    position -= index
+    if derivative:
+        # the exact derivative of the linear interpolation, so that it matches
+        # the differences of the rendered spectra
+        weights = kernel[index + 1] - kernel[index]
+        weights *= points_per_nm
+    else:
+        weights = kernel[index]
+        weights += position * (kernel[index + 1] - weights)
+    weights[outside] = 0
+
+    pixels = pixels.ravel()
+    if np.ndim(line_y) == 2:
+        # all the rows share the line positions: a single sparse (pixel x line) product
+        from scipy.sparse import csr_matrix  # type: ignore [import-untyped]
+
+        lines = np.repeat(np.arange(len(line_x)), width)
+        broadening = csr_matrix(
+            (weights.ravel(), (pixels, lines)), shape=(len(grid_x), len(line_x))
+        )
+        out += (broadening @ np.transpose(line_y)).T
+        return out
+    weights *= line_y[:, np.newaxis]
+    out += np.bincount(pixels, weights=weights.ravel(), minlength=len(grid_x))
+    return out
+
+
+# match_spectra() pads the simulated spectrum with zeros this far beyond its ends
+MATCH_PADDING = 1e-3
+
+
+class Resampler:
+    """
+    Linear interpolation from the points `source_x` to the points `target_x`,
+    precomputed as sparse weights: every target point is a weighted sum of two
+    neighbouring source points. Outside of the source range, the source is
+    padded by zeros MATCH_PADDING away from its ends, as in match_spectra().
+
+    Building the weights costs a search of the target points in the source
+    grid (plain arithmetic for equidistant source grids). Applying them is
+    a two-diagonal sparse product writing into preallocated buffers.
+    update() keeps the weights while the grids are the same and moves them
+    in place when only the target points moved (e.g. by wav_shift).
+    """
+
+    def __init__(
+        self,
+        source_x: np.typing.NDArray[np.float64] | None = None,
+        target_x: np.typing.NDArray[np.float64] | None = None,
+    ):
+        self.source_x: np.typing.NDArray[np.float64] = np.empty(0)
+        self.target_x: np.typing.NDArray[np.float64] = np.empty(0)
+        self.left: np.typing.NDArray[np.intp] = np.empty(0, dtype=np.intp)
+        self.right: np.typing.NDArray[np.intp] = np.empty(0, dtype=np.intp)
+        self.left_weights: np.typing.NDArray[np.float64] = np.empty(0)
+        self.right_weights: np.typing.NDArray[np.float64] = np.empty(0)
+        self._buffer: np.typing.NDArray[np.float64] = np.empty(0)
+        self._equidistant = False
+        if source_x is not None and target_x is not None:
+            self.update(source_x, target_x)
+
+    def update(
+        self,
+        source_x: np.typing.NDArray[np.float64],
+        target_x: np.typing.NDArray[np.float64],
+    ) -> "Resampler":
+        """Resample from source_x to target_x from now on, return self."""
+        if not _same_points(source_x, self.source_x):
+            self.source_x = source_x
+            steps = np.diff(source_x)
+            self._equidistant = len(steps) > 0 and bool(
+                np.allclose(steps, steps[0], rtol=1e-9, atol=0)
+            )
+        elif _same_points(target_x, self.target_x):
+            return self
+        PROFILER.count("Resampler", "updates")
+        self._set_target(target_x)
+        return self
+
+    def _set_target(self, target_x: np.typing.NDArray[np.float64]):
+        source = self.source_x
+        if len(target_x) != len(self.target_x):
+            self.left = np.empty(len(target_x), dtype=np.intp)
+            self.right = np.empty(len(target_x), dtype=np.intp)
+            self.left_weights = np.empty(len(target_x))
+            self.right_weights = np.empty(len(target_x))
+            self._buffer = np.empty(len(target_x))
+        self.target_x = target_x
+        last = len(source) - 1
+
+        if last < 1:
+            position = np.zeros(len(target_x))
+        elif self._equidistant:
+            position = (target_x - source[0]) * (last / (source[-1] - source[0]))
+        else:
+            index = np.searchsorted(source, target_x, side="right") - 1
+            np.clip(index, 0, last - 1, out=index)
+            position = index + (target_x - source[index]) / (
+                source[index + 1] - source[index]
+            )
+        np.floor(np.clip(position, 0, max(last - 1, 0)), out=self.left_weights)
+        self.left[:] = self.left_weights
+        np.minimum(self.left + 1, last, out=self.right)
+        np.subtract(position, self.left, out=self.right_weights)
+        np.subtract(1, self.right_weights, out=self.left_weights)
+
+        # the zero padding: linear ramps from zero MATCH_PADDING beyond the ends
+        before = target_x < source[0]
+        self.left_weights[before] = np.maximum(
+            1 - (source[0] - target_x[before]) / MATCH_PADDING, 0
+        )
+        self.right_weights[before] = 0
+        after = target_x > source[-1]
+        self.left_weights[after] = 0
+        self.right_weights[after] = np.maximum(
+            1 - (target_x[after] - source[-1]) / MATCH_PADDING, 0
+        )
+
+    def __call__(
+        self,
+        y: np.typing.NDArray[np.float64],
+        out: np.typing.NDArray[np.float64] | None = None,
+    ) -> np.typing.NDArray[np.float64]:
+        """
+        y: values at source_x, 1D, or 2D of shape (k, len(source_x))
+        out: optional output array. If not given, a new array is returned.
+        """
+        if np.ndim(y) == 2:
+            return y[:, self.left] * self.left_weights + y[:, self.right] * (
+                self.right_weights
+            )
+        if out is None:
+            out = np.empty(len(self.target_x))
+        np.take(y, self.left, out=out)
+        out *= self.left_weights
+        np.take(y, self.right, out=self._buffer)
+        self._buffer *= self.right_weights
+        out += self._buffer
+        return out
+
+
+def _same_points(
+    x: np.typing.NDArray[np.float64], other: np.typing.NDArray[np.float64]
+) -> bool:
+    return x is other or (len(x) == len(other) and np.array_equal(x, other))
+
+
+@profiled("match_spectra")
+def match_spectra(
+    sim_spec: Spectrum, exp_spec: Spectrum, resampler: Resampler | None = None
+) -> tuple[Spectrum, Spectrum]:
     """
     Take two Spectrum objects with different x-axes
     (the ranges must partially overlap)
     and return a tuple of Spectrum objects defined at the same x-points.
-    This enables comparing.
+    This enables comparing. The simulated spectrum is interpolated linearly,
+    padded with zeros beyond its ends. Neither of the spectra is modified.
     Args:
     ----
     exp_spec: *Spectrum object*, experimental spectrum
     sim_spec: *Spectrum object*, simulated spectrum.
+    resampler: *Resampler object*, optional. If given, it is updated to the x-axes
+               and reused, i.e. the weights are computed only when the axes change.
 
     Returns:
     (Spectrum_simulated, Spectrum_experimental): a tuple of Spectrum objects, with identical x-axes.
@@ -142,32 +498,27 @@ def match_spectra(sim_spec: Spectrum, exp_spec: Spectrum) -> tuple[Spectrum, Spe
     if len(sim_spec.x) == 0:
         return (Spectrum(x=exp_spec.x, y=np.zeros_like(exp_spec.x)), exp_spec)
 
-    if np.min(exp_spec.x) < np.min(sim_spec.x):
-        sim_spec.x = np.concatenate(
-            [[min(exp_spec.x)], [min(sim_spec.x) - 1e-3], sim_spec.x]
-        )
-        sim_spec.y = np.concatenate([[0], [0], sim_spec.y])
-    if np.max(exp_spec.x) > np.max(sim_spec.x):
-        sim_spec.x = np.concatenate(
-            [sim_spec.x, [max(sim_spec.x) + 1e-3], [max(exp_spec.x)]]
-        )
-        sim_spec.y = np.concatenate([sim_spec.y, [0], [0]])
-    interp = interp1d(sim_spec.x, sim_spec.y)
-    y_interp = interp(exp_spec.x)
+    if _same_points(sim_spec.x, exp_spec.x):
+        # already rendered on the experimental x-axis, e.g. by render_lines()
+        return (Spectrum(x=exp_spec.x, y=sim_spec.y), exp_spec)
 
-    return (Spectrum(x=exp_spec.x, y=y_interp), exp_spec)
+    if resampler is None:
+        resampler = Resampler()
+    resampler.update(sim_spec.x, exp_spec.x)
+    return (Spectrum(x=exp_spec.x, y=resampler(sim_spec.y)), exp_spec)
 
 
-def compare_spectra(spectrum_exp, spectrum_sim):
+def compare_spectra(spectrum_exp, spectrum_sim, resampler=None):
     """
     spectrum_exp: Spectrum object
     spectrum_sim: Spectrum object
     The wavelength axes are expected to differ, but overlap
+    resampler: optional Resampler object, see match_spectra()
 
     returns: sqrt of (sum of squares of differences of the spectra divided
              by (the number of points)**2 )
     """
-    matched = match_spectra(spectrum_sim, spectrum_exp)
+    matched = match_spectra(spectrum_sim, spectrum_exp, resampler=resampler)
     dif = matched[0].y - matched[1].y
     logging.debug("len(dif) = %i", len(dif))
     logging.debug("dif = ")
@@ -175,6 +526,32 @@ def compare_spectra(spectrum_exp, spectrum_sim):
     return dif
 
 
+def bin_pixels(spec: Spectrum, binning: int) -> Spectrum:
+    """
+    Merge every `binning` neighbouring points of the spectrum into one, at their
+    mean x with the sum of their y, like a detector with `binning` times wider
+    pixels. The points left over at the end are dropped. The lines are modelled
+    on the binned pixels with the instrumental step multiplied by `binning`.
+
+    args:
+    -----
+    spec: Spectrum object with ascending x
+    binning: *int* number of points merged
+
+    return:
+    -------
+    Spectrum object with len(spec) // binning points, spec itself for binning=1
+    """
+    if binning == 1:
+        return spec
+    if binning < 1:
+        raise ValueError(f"binning must be a positive integer, not {binning}!")
+    size = len(spec.x) // binning * binning
+    x = np.asarray(spec.x[:size], dtype=float).reshape(-1, binning).mean(axis=1)
+    y = np.asarray(spec.y[:size], dtype=float).reshape(-1, binning).sum(axis=1)
+    return Spectrum(x=x, y=y)
+
+
 def _voigt(x: np.typing.NDArray[np.float64], y: np.typing.NDArray[np.float64]):
     """
     Taken from `astro.rug.nl <http://www.astro.rug.nl/software/kapteyn-beta/kmpfittutorial.html?highlight=voigt#voigt-profiles/>`_
@@ -184,17 +561,62 @@ def _voigt(x: np.typing.NDArray[np.float64], y: np.typing.NDArray[np.float64]):
     which is also known as the Faddeeva function. Scipy has
     implemented this function under the name `wofz()`
     """
+    from scipy.special import wofz  # type: ignore [import-untyped]
+
     z = x + 1j * y
     I = wofz(z).real
     return I
 
 
+# Evaluations of the voigt profile, selected by the `profile` argument of
+# voigt(), slit_kernel() and the functions calling them:
+#  "wofz": the real part of the Faddeeva function, exact to the double precision
+#  "pseudo_voigt": weighted sum of a gaussian and a lorentzian of the same FWHM,
+#      by Thompson, Cox & Hastings, J. Appl. Cryst. 20 (1987) 79. The profile
+#      alone is evaluated about 3x faster, a slit kernel (2000 points, with the
+#      instrumental step) is built about 1.8x faster: 140 us instead of 250 us.
+#      The largest difference from "wofz" is 1.3 % of the maximum of the profile,
+#      the relative error grows to 27 % in the wings, where the slit kernel is
+#      above 1/1000 of its maximum (measured for lorentz/gauss from 1e-9 to 1e3).
+VOIGT_PROFILES = ("wofz", "pseudo_voigt")
+
+
+def _check_profile(profile: str) -> str:
+    if profile not in VOIGT_PROFILES:
+        raise ValueError(f"Unknown profile {profile!r}, use one of {VOIGT_PROFILES}!")
+    return profile
+
+
+def _pseudo_voigt(
+    nu: np.typing.NDArray[np.float64], alphaD: float, alphaL: float
+) -> np.typing.NDArray[np.float64]:
+    """pseudo-voigt profile of unit area centred at zero, see VOIGT_PROFILES"""
+    fwhm_g = 2 * alphaD
+    fwhm_l = 2 * alphaL
+    fwhm = (
+        fwhm_g**5
+        + 2.69269 * fwhm_g**4 * fwhm_l
+        + 2.42843 * fwhm_g**3 * fwhm_l**2
+        + 4.47163 * fwhm_g**2 * fwhm_l**3
+        + 0.07842 * fwhm_g * fwhm_l**4
+        + fwhm_l**5
+    ) ** 0.2
+    ratio = fwhm_l / fwhm
+    eta = 1.36603 * ratio - 0.47719 * ratio**2 + 0.11116 * ratio**3
+    hwhm = fwhm / 2
+    square = (nu / hwhm) ** 2
+    lorentzian = 1 / (np.pi * hwhm * (1 + square))
+    gaussian = np.sqrt(np.log(2) / np.pi) / hwhm * np.exp(-np.log(2) * square)
+    return eta * lorentzian + (1 - eta) * gaussian
+
+
 def voigt(
     nu: np.typing.NDArray[np.float64],
     alphaD: float,
     alphaL: float,
     nu_0: float,
     A: float,
+    profile: str = "wofz",
 ):
     """
     Taken from `astro.rug.nl <http://www.astro.rug.nl/software/kapteyn-beta/kmpfittutorial.html?highlight=voigt#voigt-profiles/>`_
@@ -212,6 +634,9 @@ def voigt(
 
       **A**:  integral under the line
 
+      **profile**:  "wofz" (exact) or "pseudo_voigt" (faster approximation),
+      see VOIGT_PROFILES for the accuracy
+
     Returns:
       **V**: The voigt profile on the nu axis
     """
@@ -219,6 +644,8 @@ def voigt(
         alphaD = 1e-10
     if alphaL == 0:
         alphaL = 1e-10
+    if _check_profile(profile) == "pseudo_voigt":
+        return A * _pseudo_voigt(nu - nu_0, alphaD, alphaL)
     f = np.sqrt(np.log(2))
     x = (nu - nu_0) / alphaD * f
     y = alphaL / alphaD * f
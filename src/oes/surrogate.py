@@ -0,0 +1,280 @@
+import pathlib
+from typing import Literal, cast
+
+import numpy
+
+from oes import spectrum
+from oes.specdata import DATA_DIR, WAV_RESERVE, SpecDB, kB
+
+
+class PopulationSurrogate:
+    """
+    Populations times emission coefficients of all lines of one specie in
+    a fixed wavelength window, precomputed for fast evaluation at any
+    rotational and vibrational temperature.
+
+    log(pops * A) of a line is linear in 1/Trot and 1/Tvib except for the
+    logarithm of the partition sum, which is the same for all the lines.
+    The surrogate therefore keeps the constant and linear parts per line and
+    tabulates only the partition sum on a grid equidistant in (1/Trot, 1/Tvib).
+    This is the same as bilinear interpolation in a full (Trot, Tvib, line)
+    table, at a fraction of its size. With the default grid, the relative error
+    of the spectra is below 1e-4 and no sum over the states is evaluated.
+
+    Can be used instead of SpecDB in MeasuredSpectra.simulations and
+    generate_spectrum(), as it provides get_spectrum() and get_lines() with the
+    same signatures. The table can be saved next to the databases and reused.
+    """
+
+    LINE_COLUMNS = ("x", "wavenumber", "log_gA", "E_J", "E_v")
+
+    def __init__(
+        self,
+        specie_name: str,
+        wmin: float,
+        wmax: float,
+        refractive_index: Literal["vacuum", "air"],
+        lines: dict[str, numpy.ndarray],
+        Trot: numpy.ndarray,
+        Tvib: numpy.ndarray,
+        log_norm: numpy.ndarray,
+    ):
+        """
+        Usually created by PopulationSurrogate.from_specdb() or PopulationSurrogate.load().
+
+        args:
+        -----
+        specie_name: name of the specie, same as SpecDB.specie_name
+        wmin, wmax: the window, the surrogate can be used for
+        refractive_index: 'air' or 'vacuum', the wavelengths of the lines
+        lines: dictionary of 1D arrays sorted by 'x': 'x', 'wavenumber',
+               'log_gA' (log of degeneracy times A), 'E_J' and 'E_v' (in kelvins)
+        Trot, Tvib: 1D arrays, the temperature grid, equidistant in 1/T
+        log_norm: array of shape (len(Trot), len(Tvib)), logarithm of the partition
+                  sum on the temperature grid
+        """
+        self.specie_name = specie_name
+        self.wmin = wmin
+        self.wmax = wmax
+        self.refractive_index = refractive_index
+        self.lines = lines
+        self.Trot = Trot
+        self.Tvib = Tvib
+        self.log_norm = log_norm
+
+    @classmethod
+    def from_specdb(
+        cls,
+        specdb: SpecDB,
+        wmin: float,
+        wmax: float,
+        Trot: tuple[float, float, int] = (300, 10000, 2048),
+        Tvib: tuple[float, float, int] = (300, 10000, 1024),
+        refractive_index: Literal["vacuum", "air"] = "air",
+    ) -> "PopulationSurrogate":
+        """
+        Tabulate the lines of `specdb` in the window [wmin, wmax].
+
+        args:
+        -----
+        specdb: SpecDB object
+        wmin, wmax: *float* the window in nm. The surrogate covers the requests of
+                    get_spectrum() with wmin and wmax shifted by up to WAV_RESERVE.
+        Trot, Tvib: (lowest temperature, highest temperature, number of points)
+                    of the grid
+        refractive_index: 'air' or 'vacuum'
+        """
+        wav = cast(
+            Literal["vacuum_wavelength", "air_wavelength"],
+            refractive_index + "_wavelength",
+        )
+        line_table = specdb.load_line_table()
+        window = line_table.window(
+            wmin - 2 * WAV_RESERVE, wmax + 2 * WAV_RESERVE, wav=wav
+        )
+        columns = line_table.columns[wav]
+        states = line_table.states
+
+        Trot_grid = _inverse_grid(*Trot)
+        Tvib_grid = _inverse_grid(*Tvib)
+
+        # Q = sum_v exp(-E_v/kTvib) sum_J (2J+1) exp(-E_J/kTrot), grouped by E_v
+        E_v, group = numpy.unique(states["E_v"], return_inverse=True)
+        rotational = (2 * states["J"] + 1) * numpy.exp(
+            -numpy.outer(1 / (kB * Trot_grid), states["E_J"])
+        )
+        per_group = numpy.zeros((len(Trot_grid), len(E_v)))
+        numpy.add.at(per_group.T, group, rotational.T)
+        vibrational = numpy.exp(-numpy.outer(E_v, 1 / (kB * Tvib_grid)))
+        log_norm = numpy.log(per_group @ vibrational)
+
+        lines = {
+            "x": numpy.array(columns[wav][window]),
+            "wavenumber": numpy.array(columns["wavenumber"][window]),
+            "log_gA": numpy.log((2 * columns["J"][window] + 1) * columns["A"][window]),
+            "E_J": columns["E_J"][window] / kB,
+            "E_v": columns["E_v"][window] / kB,
+        }
+        return cls(
+            specdb.specie_name,
+            wmin,
+            wmax,
+            refractive_index,
+            lines,
+            Trot_grid,
+            Tvib_grid,
+            log_norm,
+        )
+
+    def default_filename(self) -> pathlib.Path:
+        name = f"{self.specie_name}_{self.wmin:g}-{self.wmax:g}nm_"
+        name += f"{self.refractive_index}.npz"
+        return DATA_DIR / name
+
+    def save(self, filename: str | pathlib.Path | None = None) -> pathlib.Path:
+        """
+        Save the table as .npz file. By default, the file is placed next to
+        the databases in DATA_DIR, see default_filename().
+
+        return:
+        -------
+        path to the saved file
+        """
+        path = pathlib.Path(filename) if filename else self.default_filename()
+        with open(path, "wb") as fp:
+            numpy.savez(
+                fp,
+                specie_name=self.specie_name,
+                window=[self.wmin, self.wmax],
+                refractive_index=self.refractive_index,
+                Trot=self.Trot,
+                Tvib=self.Tvib,
+                log_norm=self.log_norm,
+                **self.lines,
+            )
+        return path
+
+    @classmethod
+    def load(cls, filename: str | pathlib.Path) -> "PopulationSurrogate":
+        """
+        filename: path to a file saved by PopulationSurrogate.save(). Files not
+                  found at the given path are searched for in DATA_DIR.
+        """
+        path = pathlib.Path(filename)
+        if not path.exists():
+            path = DATA_DIR / path
+        with numpy.load(path) as loaded:
+            return cls(
+                str(loaded["specie_name"]),
+                float(loaded["window"][0]),
+                float(loaded["window"][1]),
+                cast(Literal["vacuum", "air"], str(loaded["refractive_index"])),
+                {name: loaded[name] for name in cls.LINE_COLUMNS},
+                loaded["Trot"],
+                loaded["Tvib"],
+                loaded["log_norm"],
+            )
+
+    def _window(self, wmin: float, wmax: float, refractive_index: str) -> slice:
+        if refractive_index != self.refractive_index:
+            raise ValueError(
+                f"The surrogate is tabulated for {self.refractive_index} wavelengths!"
+            )
+        if wmin < self.wmin - WAV_RESERVE or wmax > self.wmax + WAV_RESERVE:
+            raise ValueError(
+                f"Window [{wmin}, {wmax}] is outside of the tabulated range "
+                f"[{self.wmin}, {self.wmax}]!"
+            )
+        start, stop = numpy.searchsorted(
+            self.lines["x"], [wmin - WAV_RESERVE, wmax + WAV_RESERVE]
+        )
+        return slice(int(start), int(stop))
+
+    def _cell(self, grid: numpy.ndarray, T: float, name: str) -> tuple[int, float]:
+        if not grid[0] <= T <= grid[-1]:
+            raise ValueError(
+                f"{name}={T} is outside of the tabulated range [{grid[0]}, {grid[-1]}]!"
+            )
+        # the grid is equidistant in 1/T
+        position = (1 / T - 1 / grid[0]) / (1 / grid[-1] - 1 / grid[0])
+        position *= len(grid) - 1
+        index = min(int(position), len(grid) - 2)
+        return index, position - index
+
+    def _interpolate(
+        self, Trot: float, Tvib: float, window: slice
+    ) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """
+        return:
+        -------
+        log(y) of the lines in the window and its derivatives by 1/Trot and 1/Tvib
+        """
+        i, s = self._cell(self.Trot, Trot, "Trot")
+        j, t = self._cell(self.Tvib, Tvib, "Tvib")
+        f00, f01 = self.log_norm[i, j : j + 2]
+        f10, f11 = self.log_norm[i + 1, j : j + 2]
+        log_norm = f00 + s * (f10 - f00) + t * ((1 - s) * (f01 - f00) + s * (f11 - f10))
+        d_rot = ((1 - t) * (f10 - f00) + t * (f11 - f01)) / (
+            1 / self.Trot[i + 1] - 1 / self.Trot[i]
+        )
+        d_vib = ((1 - s) * (f01 - f00) + s * (f11 - f10)) / (
+            1 / self.Tvib[j + 1] - 1 / self.Tvib[j]
+        )
+
+        E_J = self.lines["E_J"][window]
+        E_v = self.lines["E_v"][window]
+        log_y = self.lines["log_gA"][window] - E_J / Trot - E_v / Tvib - log_norm
+        return log_y, -E_J - d_rot, -E_v - d_vib
+
+    def get_spectrum(
+        self,
+        Trot: float,
+        Tvib: float,
+        wmin: float,
+        wmax: float,
+        as_spectrum: bool = True,
+        y_scaling: Literal["intensity", "photon_flux"] = "photon_flux",
+        refractive_index: Literal["vacuum", "air"] = "air",
+    ) -> spectrum.Spectrum | numpy.ndarray:
+        """
+        Same as SpecDB.get_spectrum(), only interpolated in the table.
+        """
+        window = self._window(wmin, wmax, refractive_index)
+        y = numpy.exp(self._interpolate(Trot, Tvib, window)[0])
+        if y_scaling == "intensity":
+            y *= self.lines["wavenumber"][window]
+        if as_spectrum:
+            return spectrum.Spectrum(x=self.lines["x"][window], y=y)
+        return numpy.array([self.lines["x"][window], y]).T
+
+    def get_lines(
+        self,
+        Trot: float,
+        Tvib: float,
+        wmin: float,
+        wmax: float,
+        y_scaling: Literal["intensity", "photon_flux"] = "photon_flux",
+        refractive_index: Literal["vacuum", "air"] = "air",
+    ) -> dict[str, numpy.ndarray]:
+        """
+        Same as SpecDB.get_lines(), the derivatives are those of the interpolation.
+        """
+        window = self._window(wmin, wmax, refractive_index)
+        log_y, d_inv_Trot, d_inv_Tvib = self._interpolate(Trot, Tvib, window)
+        y = numpy.exp(log_y)
+        if y_scaling == "intensity":
+            y *= self.lines["wavenumber"][window]
+        return {
+            "x": self.lines["x"][window],
+            "y": y,
+            "dy_dTrot": -y * d_inv_Trot / Trot**2,
+            "dy_dTvib": -y * d_inv_Tvib / Tvib**2,
+        }
+
+
+def _inverse_grid(Tmin: float, Tmax: float, num: int) -> numpy.ndarray:
+    """ascending temperatures equidistant in 1/T, with exact end points"""
+    grid = 1 / numpy.linspace(1 / Tmin, 1 / Tmax, num)
+    grid[0] = Tmin
+    grid[-1] = Tmax
+    return grid
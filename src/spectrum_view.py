@@ -0,0 +1,153 @@
+import numpy
+from PySide6.QtCharts import QChart, QChartView, QLineSeries, QValueAxis
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QPainter
+
+
+def decimate(
+    x: numpy.ndarray, y: numpy.ndarray, start: float, stop: float, buckets: int
+) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Min/max decimation of the points with start <= x <= stop for plotting.
+
+    The visible points (plus one on each side, so that the line reaches the
+    edges) are split into `buckets` groups of equal size, typically one per
+    horizontal pixel, and only the lowest and the highest point of each group
+    are kept, in their original order. The plotted line then looks the same as
+    with all the points, the peaks are never lost. Ranges with up to
+    2 * buckets points are returned as they are.
+
+    args:
+    -----
+    x: ascending x-axis
+    y: values at x
+    start, stop: visible range of x
+    buckets: number of groups, at most 2 * buckets points are returned
+
+    return:
+    -------
+    (x, y) of the points to plot, views of the input if nothing is dropped
+    """
+    first = max(int(numpy.searchsorted(x, start, side="left")) - 1, 0)
+    last = min(int(numpy.searchsorted(x, stop, side="right")) + 1, len(x))
+    x = x[first:last]
+    y = y[first:last]
+    if len(x) <= 2 * buckets:
+        return x, y
+
+    size = len(x) // buckets
+    groups = y[: size * buckets].reshape(buckets, size)
+    lowest = numpy.argmin(groups, axis=1)
+    highest = numpy.argmax(groups, axis=1)
+    base = numpy.arange(buckets) * size
+    index = numpy.empty((buckets, 2), dtype=numpy.intp)
+    index[:, 0] = base + numpy.minimum(lowest, highest)
+    index[:, 1] = base + numpy.maximum(lowest, highest)
+    # the last few points not filling a whole group are kept
+    index = numpy.concatenate([index.ravel(), numpy.arange(size * buckets, len(x))])
+    return x[index], y[index]
+
+
+class SpectrumView(QChartView):
+    """
+    Measured spectrum, its model and the residuals (model - measured) in a chart.
+
+    The series hold only the points decimated for the current zoom by decimate(),
+    about two per pixel of the plot width, so that redrawing costs the same for
+    a spectrum with thousands or millions of pixels. The full arrays are kept
+    here and decimated again whenever the visible x-range changes. Zoom in by
+    dragging a rectangle, out by the right button, pan by the arrow keys.
+    """
+
+    SERIES = ("measured", "model", "residuals")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        chart = QChart()
+        self.series = {}
+        for name in self.SERIES:
+            series = QLineSeries()
+            series.setName(name)
+            chart.addSeries(series)
+            self.series[name] = series
+        self.axis_x = QValueAxis()
+        self.axis_y = QValueAxis()
+        chart.addAxis(self.axis_x, Qt.AlignBottom)
+        chart.addAxis(self.axis_y, Qt.AlignLeft)
+        for series in self.series.values():
+            series.attachAxis(self.axis_x)
+            series.attachAxis(self.axis_y)
+        self.setChart(chart)
+        self.setRenderHint(QPainter.Antialiasing, False)
+        self.setRubberBand(QChartView.RectangleRubberBand)
+
+        self.x = numpy.empty(0)
+        self.order: slice | numpy.ndarray = slice(None)
+        self.data: dict[str, numpy.ndarray] = {}
+        self.axis_x.rangeChanged.connect(lambda *args: self.refresh())
+
+    def set_spectrum(self, x, measured, model=None):
+        """Show a new spectrum, the axes are reset to its full range."""
+        x = numpy.asarray(x, dtype=float)
+        if numpy.all(x[1:] >= x[:-1]):
+            self.order = slice(None)
+        else:
+            self.order = numpy.argsort(x, kind="stable")
+        self.x = x[self.order]
+        self.data = {"measured": numpy.asarray(measured, dtype=float)[self.order]}
+        self._set_model(model)
+        self.reset_range()
+
+    def set_model(self, model):
+        """Replace the model (and the residuals) of the shown spectrum."""
+        self._set_model(model)
+        self.refresh(["model", "residuals"])
+
+    def _set_model(self, model):
+        if model is None:
+            self.data.pop("model", None)
+            self.data.pop("residuals", None)
+            return
+        self.data["model"] = numpy.asarray(model, dtype=float)[self.order]
+        self.data["residuals"] = self.data["model"] - self.data["measured"]
+
+    def reset_range(self):
+        finite = [y[numpy.isfinite(y)] for y in self.data.values()]
+        finite = [y for y in finite if len(y)]
+        if len(self.x) == 0 or not finite:
+            self.refresh()
+            return
+        low = min(y.min() for y in finite)
+        high = max(y.max() for y in finite)
+        margin = 0.05 * (high - low) or 1.0
+        self.axis_y.setRange(low - margin, high + margin)
+        if self.axis_x.min() == self.x[0] and self.axis_x.max() == self.x[-1]:
+            self.refresh()  # setRange() would not emit rangeChanged
+        else:
+            self.axis_x.setRange(self.x[0], self.x[-1])
+
+    def refresh(self, names=None):
+        """decimate the series `names` (all by default) for the visible range"""
+        buckets = max(int(self.chart().plotArea().width()), 100)
+        for name in names or self.SERIES:
+            if name in self.data:
+                x, y = decimate(
+                    self.x,
+                    self.data[name],
+                    self.axis_x.min(),
+                    self.axis_x.max(),
+                    buckets,
+                )
+                self.series[name].replaceNp(x, y)
+            else:
+                self.series[name].clear()
+
+    def keyPressEvent(self, event):
+        # left and right arrows pan by a tenth of the plot width
+        step = self.chart().plotArea().width() / 10
+        if event.key() == Qt.Key_Left:
+            self.chart().scroll(-step, 0)
+        elif event.key() == Qt.Key_Right:
+            self.chart().scroll(step, 0)
+        else:
+            super().keyPressEvent(event)
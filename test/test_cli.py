@@ -0,0 +1,43 @@
+import csv
+import json
+import pathlib
+
+import numpy
+import pytest
+
+from oes import cli
+
+CSV = pathlib.Path(__file__).parent / "OH_310nm_surfatron_80Hz_mod.csv"
+
+
+@pytest.fixture
+def spectra_csv(tmp_path):
+    data = numpy.loadtxt(CSV, delimiter=",")
+    filename = tmp_path / "spectra.csv"
+    numpy.savetxt(filename, data[:, :3], delimiter=",")
+    return str(filename)
+
+
+def read_rows(filename):
+    with open(filename, newline="") as fp:
+        return list(csv.DictReader(fp))
+
+
+def test_fit_and_resume(spectra_csv, tmp_path, capsys):
+    output = tmp_path / "results.csv"
+    start = tmp_path / "start.json"
+    start.write_text(json.dumps({"wav_shift": -0.02, "OHAX_Trot": {"value": 2000}}))
+    args = [spectra_csv, "-o", str(output), "-s", "OHAX", "-p", str(start)]
+
+    assert cli.main(args + ["-w", "1", "--maxiter", "30"]) == 0
+    rows = read_rows(output)
+    assert [row["spectrum"] for row in rows] == ["1", "2"]
+    assert all(row["file"] == spectra_csv for row in rows)
+    assert 300 <= float(rows[0]["OHAX_Trot"]) <= 10000
+    assert float(rows[0]["OHAX_Trot"]) != 2000
+
+    # everything is in the output already, nothing is fitted again
+    capsys.readouterr()
+    assert cli.main(args) == 0
+    assert read_rows(output) == rows
+    assert "2 spectra already in" in capsys.readouterr().err
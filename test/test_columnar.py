@@ -0,0 +1,126 @@
+import numpy
+import pytest
+from oes.columnar import ColumnarSpectra, read_csv
+from oes.measured_spectra import MeasuredSpectra
+from oes.specdata import SpecDB
+from oes.spectrum import Spectrum
+import pathlib
+
+CSV = pathlib.Path(__file__).parent / "OH_310nm_surfatron_80Hz_mod.csv"
+
+
+def test_columnar_matches_dict():
+    columnar = MeasuredSpectra.from_csv(CSV, columnar=True)
+    separate = MeasuredSpectra.from_csv(CSV)
+    assert isinstance(columnar.spectra, ColumnarSpectra)
+    assert list(columnar.spectra) == list(separate.spectra)
+
+    assert len(columnar.spectra.params) == 0
+    specname = list(separate.spectra)[3]
+    spec = columnar.get_measured_spectrum(specname)
+    assert numpy.array_equal(spec.y, separate.get_measured_spectrum(specname).y)
+    assert numpy.shares_memory(spec.y, columnar.spectra.y)
+    assert (
+        columnar.spectra[specname]["params"]["wav_step"].value
+        == separate.spectra[specname]["params"]["wav_step"].value
+    )
+    assert list(columnar.spectra.params) == [specname]
+
+
+def test_columnar_memmap_roundtrip(tmp_path):
+    measured = MeasuredSpectra.from_csv(CSV, columnar=True)
+    measured.add_specie_to_all(SpecDB("OHAX.db"))
+    specname = list(measured.spectra)[1]
+    measured.spectra[specname]["params"]["OHAX_Trot"].value = 2500
+    measured.save_columnar(tmp_path)
+
+    opened = MeasuredSpectra.open_columnar(tmp_path)
+    assert isinstance(opened.spectra.y, numpy.memmap)
+    assert list(opened.spectra) == list(measured.spectra)
+    assert list(opened.spectra.params) == [specname]
+    assert opened.spectra[specname]["params"]["OHAX_Trot"].value == 2500
+    assert opened.spectra[5]["params"]["OHAX_Trot"].value == 1000
+    assert numpy.array_equal(
+        opened.get_measured_spectrum(5).y, measured.get_measured_spectrum(5).y
+    )
+    assert "OHAX" in opened.simulations
+
+    # saving into the mapped directory keeps the file, nothing to copy
+    opened.spectra.save(tmp_path)
+    assert numpy.array_equal(
+        ColumnarSpectra.open(tmp_path).y, numpy.asarray(measured.spectra.y)
+    )
+    del opened.spectra[5]
+    with pytest.raises(ValueError):
+        opened.spectra.save(tmp_path)
+
+
+def test_columnar_simulated_spectra():
+    x = numpy.linspace(306, 312, 50)
+    measured = MeasuredSpectra(
+        spectra=ColumnarSpectra(x, numpy.zeros((2, 50)), ["a", "b"]),
+        simulated_spectra=[SpecDB("OHAX.db")],
+    )
+    assert "OHAX" in measured.simulations
+    assert measured.spectra["b"]["params"].number_of_pixels == 50
+    assert "OHAX_Trot" in measured.spectra["b"]["params"].prms
+    assert measured.spectra.template.info["species"] == ["OHAX"]
+
+
+def test_columnar_mapping():
+    spectra = ColumnarSpectra(numpy.arange(3.0), numpy.zeros((2, 3)), ["a", "b"])
+    spectra["c"] = {"spectrum": Spectrum(x=numpy.arange(3.0), y=numpy.ones(3))}
+    assert list(spectra) == ["a", "b", "c"]
+    assert spectra["c"]["spectrum"].y.sum() == 3
+
+    del spectra["a"]
+    assert list(spectra) == ["b", "c"]
+    with pytest.raises(ValueError):
+        spectra["d"] = {"spectrum": Spectrum(x=numpy.ones(3), y=numpy.ones(3))}
+
+
+def test_read_csv_matches_genfromtxt():
+    data = numpy.genfromtxt(CSV, delimiter=",")
+    x, y = read_csv(CSV)
+    assert x == pytest.approx(data[:, 0], rel=1e-15)
+    assert numpy.allclose(y, data[:, 1:].T, rtol=1e-15, atol=0, equal_nan=True)
+    assert y.flags.c_contiguous
+
+
+def test_ingest_csv_by_chunks(tmp_path):
+    measured = MeasuredSpectra.ingest_csv(CSV, tmp_path, chunksize=100)
+    separate = MeasuredSpectra.from_csv(CSV)
+    assert isinstance(measured.spectra.y, numpy.memmap)
+    assert list(measured.spectra) == list(separate.spectra)
+    for specname in [1, 17, 51]:
+        assert numpy.array_equal(
+            measured.get_measured_spectrum(specname).y,
+            separate.get_measured_spectrum(specname).y,
+            equal_nan=True,
+        )
+
+    measured.add_specie_to_all(SpecDB("OHAX.db"))
+    measured.save_columnar(tmp_path)  # next to the memory-mapped intensities
+    assert "OHAX" in MeasuredSpectra.open_columnar(tmp_path).simulations
+
+
+@pytest.mark.parametrize("content", ["", "\n\n"])
+def test_ingest_empty_csv(tmp_path, content):
+    filename = tmp_path / "empty.csv"
+    filename.write_text(content)
+    with pytest.raises(ValueError, match="empty.csv"):
+        MeasuredSpectra.ingest_csv(filename, tmp_path / "ingested")
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_from_csv_dir(tmp_path, columnar):
+    for name in ["a", "b"]:
+        (tmp_path / f"{name}.csv").write_bytes(CSV.read_bytes())
+    measured = MeasuredSpectra.from_csv_dir(tmp_path, columnar=columnar, workers=2)
+    assert len(measured.spectra) == 102
+    assert list(measured.spectra)[50:52] == [("a", 51), ("b", 1)]
+    assert numpy.array_equal(
+        measured.get_measured_spectrum(("b", 3)).y,
+        MeasuredSpectra.from_csv(CSV).get_measured_spectrum(3).y,
+        equal_nan=True,
+    )
@@ -1,5 +1,9 @@
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
 import pytest
-from oes.specdata import SpecDB
+from oes.specdata import LineList, SpecDB
 
 
 @pytest.fixture
@@ -13,3 +17,104 @@ def test_get_spectrum(oh_ax):
     assert spec.y[:10].sum() == pytest.approx(11599, rel=1)
     assert spec.y[-10:].sum() == pytest.approx(1170, rel=1)
     assert spec.y[100:200].sum() == pytest.approx(198190, rel=1)
+
+
+@pytest.mark.parametrize("refractive_index", ["air", "vacuum"])
+@pytest.mark.parametrize("y_scaling", ["photon_flux", "intensity"])
+def test_get_spectrum_in_memory(oh_ax, refractive_index, y_scaling):
+    in_memory = SpecDB("OHAX.db", in_memory=True)
+    kwargs = dict(
+        Trot=2500,
+        Tvib=4000,
+        wmin=306,
+        wmax=312,
+        refractive_index=refractive_index,
+        y_scaling=y_scaling,
+        as_spectrum=False,
+    )
+    expected = oh_ax.get_spectrum(**kwargs)
+    spec = in_memory.get_spectrum(**kwargs)
+    assert numpy.sort(spec, axis=0) == pytest.approx(numpy.sort(expected, axis=0))
+
+    # a different window is answered without going back to the database
+    in_memory.conn.close()
+    spec = in_memory.get_spectrum(Trot=2500, Tvib=4000, wmin=280, wmax=290)
+    assert spec.x.min() >= 278 and spec.x.max() <= 292
+    assert len(spec) > 0
+
+
+def test_pickle_in_memory():
+    spec_db = pickle.loads(pickle.dumps(SpecDB("OHAX.db", in_memory=True)))
+    assert spec_db.line_table is not None
+
+
+def test_line_list_matches_merged_spectra():
+    oh_ax = SpecDB("OHAX.db")
+    second = SpecDB("OHAX.db", in_memory=True)
+    line_list = LineList({"OHAX": oh_ax, "second": second}, wmin=306, wmax=312)
+    y = line_list.set_weights("OHAX", 2500, 4000)
+    line_list.set_weights("second", 1000, 3000, intensity=0.5)
+    assert y is line_list.y
+    assert numpy.all(numpy.diff(line_list.x) >= 0)
+
+    expected = numpy.concatenate(
+        [
+            oh_ax.get_spectrum(2500, 4000, wmin=306, wmax=312, as_spectrum=False),
+            second.get_spectrum(1000, 3000, wmin=306, wmax=312, as_spectrum=False)
+            * [1, 0.5],
+        ]
+    )
+    assert numpy.sort(expected[:, 0]) == pytest.approx(line_list.x)
+    assert line_list.y.sum() == pytest.approx(expected[:, 1].sum())
+    positions = line_list.positions["second"]
+    assert line_list.y[positions] == pytest.approx(expected[len(positions) :, 1])
+
+
+def test_shared_between_threads(oh_ax):
+    temperatures = [(Trot, 3000) for Trot in range(1000, 3000, 100)]
+    expected = [
+        SpecDB("OHAX.db").get_spectrum(Trot, Tvib, wmin=306, wmax=312).y.to_numpy()
+        for Trot, Tvib in temperatures
+    ]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        spectra = list(
+            executor.map(
+                lambda T: oh_ax.get_spectrum(*T, wmin=306, wmax=312).y.to_numpy(),
+                temperatures,
+            )
+        )
+    for spec, exp in zip(spectra, expected):
+        assert spec == pytest.approx(exp)
+
+
+def test_shared_line_table():
+    spec_db = SpecDB("OHAX.db")
+    with spec_db.share_line_table() as shared:
+        attached = pickle.loads(pickle.dumps(spec_db))
+        assert attached._states is None  # nothing read from the database
+        columns = attached.line_table.columns["air_wavelength"]
+        assert isinstance(columns["A"].base, numpy.memmap)
+        assert not columns["A"].flags.writeable
+        for wav, expected in spec_db.line_table.columns.items():
+            for name, column in expected.items():
+                assert numpy.array_equal(attached.line_table.columns[wav][name], column)
+        assert attached.get_lines(2000, 3000, 306, 312)["y"] == pytest.approx(
+            spec_db.get_lines(2000, 3000, 306, 312)["y"]
+        )
+    assert shared.closed
+    assert pickle.loads(pickle.dumps(spec_db)).line_table is None
+
+
+def test_shared_line_table_closed_after_pickling():
+    spec_db = SpecDB("OHAX.db", in_memory=True)
+    with spec_db.share_line_table():
+        pickled = pickle.dumps(spec_db)
+    # the shared file is gone, the lines are loaded from the database again
+    loaded = pickle.loads(pickled)
+    assert loaded.in_memory
+    assert not isinstance(
+        loaded.line_table.columns["air_wavelength"]["A"].base, numpy.memmap
+    )
+    assert loaded.get_lines(2000, 3000, 306, 312)["y"] == pytest.approx(
+        spec_db.get_lines(2000, 3000, 306, 312)["y"]
+    )
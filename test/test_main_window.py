@@ -0,0 +1,112 @@
+import os
+import pathlib
+import time
+
+import numpy
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+pytest.importorskip("PySide6.QtWidgets")
+
+from PySide6.QtWidgets import QApplication  # noqa: E402
+
+from main_window import SpecWindow  # noqa: E402
+from spectrum_view import SpectrumView, decimate  # noqa: E402
+
+CSV = pathlib.Path(__file__).parent / "OH_310nm_surfatron_80Hz_mod.csv"
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def window(app):
+    window = SpecWindow()
+    window.load_file(CSV)
+    yield window
+    window.close()
+
+
+def wait_for(condition, timeout=120):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        QApplication.processEvents()
+        time.sleep(0.005)
+
+
+def statuses(window):
+    table = window.results_table
+    return [table.item(row, 1).text() for row in range(table.rowCount())]
+
+
+def test_background_fit(window):
+    specnames = list(window.measured_data.spectra)[:2]
+    window.fit_spectra(specnames, maxiter=50)
+    assert window.fit_running()
+    assert not window.actionFitAll.isEnabled()
+
+    wait_for(lambda: not window.fit_running())
+    assert statuses(window)[:3] == ["fitted", "fitted", "not fitted"]
+    assert float(window.results_table.item(0, 2).text()) > 0  # OHAX_Trot
+    assert window.progress_bar.value() == 2
+    assert window.actionFitAll.isEnabled()
+
+
+def test_cancel_fit(window):
+    window.fit_spectra()
+    wait_for(lambda: "fitting" in statuses(window))
+    window.cancel_fit()
+    wait_for(lambda: not window.fit_running())
+    window.background_fit.wait()
+
+    assert "cancelled" in statuses(window)
+    assert not any(map(window.background_fit.is_fitting, window.rows))
+    assert set(statuses(window)) <= {"fitted", "not converged", "cancelled"}
+    assert window.progress_bar.value() == len(window.measured_data.spectra)
+
+
+def test_model_of_spectrum_being_fitted(window):
+    specname = list(window.measured_data.spectra)[0]
+    window.fit_spectra([specname], maxiter=50)
+    wait_for(lambda: window.background_fit.is_fitting(specname))
+    # the fit is reported done only by the event loop, it is still running here
+    window.show_spectrum(specname)
+    assert window.spectrum_view.series["model"].count() == 0
+
+    wait_for(lambda: not window.fit_running())
+    assert window.spectrum_view.series["model"].count() > 0
+
+
+def test_decimate():
+    x = numpy.linspace(300, 320, 100_001)
+    y = numpy.sin(x * 7)
+    y[54_321] = 5.0
+    plot_x, plot_y = decimate(x, y, 305, 315, 400)
+    assert len(plot_x) <= 2 * 400 + 400
+    assert numpy.all(numpy.diff(plot_x) > 0)
+    assert plot_x[0] <= 305 and plot_x[-1] >= 315
+    assert plot_y.max() == 5.0
+    assert plot_y.min() == pytest.approx(-1, abs=1e-6)
+    short = decimate(x[:500], y[:500], 0, 1000, 400)
+    assert short[0] is not x and len(short[0]) == 500
+
+
+def test_spectrum_view_follows_selection(window):
+    series = window.spectrum_view.series
+    measured = window.measured_data.get_measured_spectrum(window.shown_specname)
+    assert 0 < series["measured"].count() <= len(measured.x)
+    assert series["model"].count() == series["measured"].count()
+
+    window.results_table.setCurrentCell(1, 0)
+    assert window.shown_specname == list(window.measured_data.spectra)[1]
+
+    view = SpectrumView()
+    x = numpy.linspace(300, 320, 1_000_000)
+    view.set_spectrum(x, numpy.sin(x * 50), numpy.cos(x * 50))
+    assert 0 < view.series["measured"].count() <= 2 * len(x) // 1000
+    view.axis_x.setRange(310, 311)
+    visible = view.series["measured"].points()
+    assert visible[0].x() <= 310 and visible[-1].x() >= 311
@@ -1,3 +1,5 @@
+import numpy
+import pandas
 import pytest
 from oes.specdata import SpecDB
 from oes.measured_spectra import MeasuredSpectra
@@ -39,3 +41,254 @@ def test_fit(measured_spectra):
         ).sum() > 1.1  # residuals are smaller than the original data
 
         break  # it takes time and testing one fit is enough
+
+
+@pytest.mark.parametrize("threads", [False, True])
+def test_fit_many(measured_spectra, threads):
+    specnames = list(measured_spectra.spectra)[:2]
+    start = measured_spectra.spectra[specnames[1]]["params"].prms.copy()
+    reported = []
+    results = measured_spectra.fit_many(
+        specnames,
+        workers=2,
+        progress=lambda *args: reported.append(args),
+        threads=threads,
+    )
+    assert set(results) == set(specnames)
+    assert sorted(r[0] for r in reported) == [1, 2]
+
+    parallel = float(results[specnames[1]].params["OHAX_Trot"].value)
+    measured_spectra.spectra[specnames[1]]["params"].prms = start.copy()
+    measured_spectra.fit(specnames[1])
+    serial = measured_spectra.spectra[specnames[1]]["params"]["OHAX_Trot"].value
+    assert parallel == pytest.approx(serial)
+    assert results[specnames[1]].success
+
+
+def test_jacobian(measured_spectra):
+    specname = list(measured_spectra.spectra)[0]
+    prms = measured_spectra.spectra[specname]["params"].prms
+    prms["baseline"].value = 1
+    prms["baseline_slope"].value = 0.01
+    var_names = [name for name in prms if prms[name].vary]
+    jac = measured_spectra.get_jacobian(prms.copy(), specname)
+    assert jac.shape == (len(measured_spectra.get_measured_spectrum(specname)), 9)
+
+    tolerance = {"wav_shift": 2e-3}
+    for name in [
+        "OHAX_Trot",
+        "OHAX_Tvib",
+        "OHAX_intensity",
+        "baseline",
+        "baseline_slope",
+        "wav_shift",
+        "slitf_gauss",
+        "slitf_lorentz",
+    ]:
+        h = 1e-5 * abs(prms[name].value)
+        plus, minus = prms.copy(), prms.copy()
+        plus[name].value += h
+        minus[name].value -= h
+        numeric = (
+            measured_spectra.get_residuals(plus, specname)
+            - measured_spectra.get_residuals(minus, specname)
+        ) / (2 * h)
+        analytic = jac[:, var_names.index(name)]
+        assert analytic == pytest.approx(
+            numeric, abs=tolerance.get(name, 1e-4) * abs(numeric).max()
+        )
+
+
+def test_fit_with_expression(measured_spectra):
+    specname = list(measured_spectra.spectra)[0]
+    prms = measured_spectra.spectra[specname]["params"].prms
+    prms["OHAX_Tvib"].expr = "OHAX_Trot*1.5"
+    start = prms.copy()
+    default = measured_spectra.fit(specname)
+    measured_spectra.spectra[specname]["params"].prms = start
+    numeric = measured_spectra.fit(specname, analytic_jacobian=False)
+    assert default.call_kws["Dfun"] is None
+    assert default.chisqr == pytest.approx(numeric.chisqr, rel=1e-3)
+
+
+def test_residuals_batch(measured_spectra):
+    specname = list(measured_spectra.spectra)[0]
+    prms = measured_spectra.spectra[specname]["params"].prms.copy()
+    names = ["OHAX_Trot", "OHAX_Tvib", "slitf_gauss", "baseline"]
+    values = [[1000, 2000, 0.025, 0], [3000, 2000, 0.025, 1], [3000, 2000, 0.03, 1]]
+    batch = measured_spectra.get_residuals_batch(values, specname, names=names)
+
+    assert batch.shape == (3, len(measured_spectra.get_measured_spectrum(specname)))
+    for row, candidate in zip(batch, values):
+        for name, value in zip(names, candidate):
+            prms[name].value = value
+        single = measured_spectra.get_residuals(prms.copy(), specname)
+        assert row == pytest.approx(single)
+
+
+def test_fit_series(measured_spectra):
+    specnames = list(measured_spectra.spectra)[:2]
+    independent = measured_spectra.fit(specnames[1])
+    Trot = measured_spectra.spectra[specnames[1]]["params"]["OHAX_Trot"].value
+
+    results = measured_spectra.fit_series(
+        specnames, narrow=0.2, progress=lambda *args: None
+    )
+    seeded = measured_spectra.spectra[specnames[1]]["params"]
+    assert list(results) == specnames
+    assert results[specnames[1]].nfev < independent.nfev
+    assert seeded["OHAX_Trot"].value == pytest.approx(Trot, rel=1e-3)
+    assert (seeded["OHAX_Trot"].min, seeded["OHAX_Trot"].max) == (300, 10000)
+
+
+def test_npz_roundtrip_matches_json(measured_spectra, tmp_path):
+    measured_spectra.spectra[2]["params"]["OHAX_Trot"].value = 2500
+    measured_spectra.spectra[2]["params"]["OHAX_Tvib"].expr = "OHAX_Trot * 2"
+    measured_spectra.to_json(tmp_path / "spectra.json")
+    measured_spectra.to_npz(tmp_path / "spectra.npz")
+    from_json = MeasuredSpectra.from_json(tmp_path / "spectra.json")
+    from_npz = MeasuredSpectra.from_npz(tmp_path / "spectra.npz")
+
+    assert list(from_npz.spectra) == list(measured_spectra.spectra)
+    assert from_npz.simulations.keys() == from_json.simulations.keys()
+    assert from_npz.filename == str(measured_spectra.filename)
+    for name_json, name_npz in zip(from_json.spectra, from_npz.spectra):
+        json_entry, npz_entry = from_json.spectra[name_json], from_npz.spectra[name_npz]
+        assert numpy.array_equal(json_entry["spectrum"].x, npz_entry["spectrum"].x)
+        assert numpy.array_equal(json_entry["spectrum"].y, npz_entry["spectrum"].y)
+        assert json_entry["params"].info == npz_entry["params"].info
+        for name, param in json_entry["params"].prms.items():
+            loaded = npz_entry["params"][name]
+            assert (param.value, param.vary, param.min, param.max, param.expr) == (
+                loaded.value,
+                loaded.vary,
+                loaded.min,
+                loaded.max,
+                loaded.expr,
+            )
+    assert from_npz.spectra[2]["params"]["OHAX_Trot"].value == 2500
+    assert from_npz.spectra[2]["params"]["OHAX_Tvib"].value == 5000
+
+
+def test_npz_partial_load(measured_spectra, tmp_path):
+    measured_spectra.to_npz(tmp_path / "spectra.npz")
+    loaded = MeasuredSpectra.from_npz(tmp_path / "spectra.npz", specnames=[3, 7])
+    assert list(loaded.spectra) == [3, 7]
+    assert loaded.spectra[3]["spectrum"].x is loaded.spectra[7]["spectrum"].x
+    with pytest.raises(KeyError):
+        MeasuredSpectra.from_npz(tmp_path / "spectra.npz", specnames=[1000])
+
+
+def test_synthesis_cache(measured_spectra):
+    specname = list(measured_spectra.spectra)[0]
+    prms = measured_spectra.spectra[specname]["params"].prms
+    cache = measured_spectra.synthesis_cache
+    expected = measured_spectra.get_residuals(prms, specname, use_cache=False)
+    residuals = measured_spectra.get_residuals(prms, specname)
+    assert residuals == pytest.approx(expected, rel=1e-12)
+
+    prms["baseline"].value = 1
+    prms["OHAX_intensity"].value = 2
+    prms["wav_shift"].value += 1e-3
+    measured_spectra.get_residuals(prms, specname)
+    assert len(cache.stages["lines"]) == 1
+    assert len(cache.stages["shape"]) == 2
+
+    prms["wav_shift"].value -= 1e-3
+    residuals = measured_spectra.get_residuals(prms, specname)
+    expected = measured_spectra.get_residuals(prms, specname, use_cache=False)
+    assert residuals == pytest.approx(expected, rel=1e-12)
+    assert len(cache.stages["shape"]) == 2
+
+
+def test_uncached_residuals_query_the_window(measured_spectra, oh_ax, monkeypatch):
+    specname = list(measured_spectra.spectra)[0]
+    prms = measured_spectra.spectra[specname]["params"].prms
+    cached = [
+        measured_spectra.get_residuals(prms, specname, render_on_pixels=pixels)
+        for pixels in (True, False)
+    ]
+    # the lines of the window are queried, the LineTable is not loaded
+    monkeypatch.setattr(oh_ax, "load_line_table", pytest.fail)
+    for pixels, expected in zip((True, False), cached):
+        residuals = measured_spectra.get_residuals(
+            prms, specname, use_cache=False, render_on_pixels=pixels
+        )
+        assert residuals == pytest.approx(expected, rel=1e-9)
+
+
+def test_export_results_reuses_fit_summary(measured_spectra, tmp_path, monkeypatch):
+    specnames = list(measured_spectra.spectra)[:3]
+    measured_spectra.fit(specnames[0], maxiter=50)
+    summary = measured_spectra.fit_summary(specnames[0])
+    assert summary["nfev"] > 0 and summary["fit_time"] > 0
+
+    fitted = measured_spectra.spectra[specnames[0]]["params"]
+    expected = summary["reduced_sumsq"]
+    fitted.info.pop("summary")
+    measured_spectra.summarize(specnames[:1])
+    assert measured_spectra.fit_summary(specnames[0])["reduced_sumsq"] == (
+        pytest.approx(expected, rel=1e-6)
+    )
+    fitted.info["summary"] = summary
+    fitted["OHAX_Trot"].value += 1
+    assert measured_spectra.fit_summary(specnames[0]) is None
+    fitted["OHAX_Trot"].value -= 1
+
+    # the other spectra are summarized by threads, the fitted one is not touched
+    serial = measured_spectra.result_row(specnames[1])["reduced_sumsq"]
+    measured_spectra.spectra[specnames[1]]["params"].info.pop("summary")
+    measured_spectra.summarize(specnames, workers=2)
+    parallel = measured_spectra.fit_summary(specnames[1])["reduced_sumsq"]
+    assert parallel == pytest.approx(serial)
+
+    def no_synthesis(*args, **kwargs):
+        raise AssertionError("resynthesized")
+
+    monkeypatch.setattr(measured_spectra, "get_residuals", no_synthesis)
+    filename = tmp_path / "results.csv"
+    first = measured_spectra.export_results(filename, specnames=specnames[:2])
+    appended = measured_spectra.export_results(
+        filename, specnames=specnames, append=True
+    )
+    assert list(appended["spectrum"]) == specnames[2:]
+    exported = pandas.read_csv(filename, index_col=0)
+    assert list(exported["spectrum"]) == specnames
+    assert list(exported.index) == [0, 1, 2]
+    assert exported["reduced_sumsq"][0] == pytest.approx(expected)
+    assert exported["nfev"][0] == first["nfev"][0] > 0
+    assert numpy.isnan(exported["nfev"][1])
+
+
+def test_coarse_to_fine(measured_spectra):
+    specname = list(measured_spectra.spectra)[2]
+    measured_spectra.fit(specname, maxiter=50)
+    prms = measured_spectra.spectra[specname]["params"].prms
+    fine = measured_spectra.get_residuals(prms, specname)
+    coarse = measured_spectra.get_residuals(prms, specname, binning=2)
+    # the binned pixels sum the residuals of the pixels
+    summed = fine[: len(fine) // 2 * 2].reshape(-1, 2).sum(axis=1)
+    assert coarse == pytest.approx(summed, abs=0.02 * numpy.abs(summed).max())
+
+    jac = measured_spectra.get_jacobian(prms, specname, binning=2)
+    assert jac.shape[0] == len(coarse)
+
+    other = list(measured_spectra.spectra)[3]
+    result = measured_spectra.fit(other, coarse={"binning": 2, "maxiter": 50})
+    assert result.success
+    assert len(result.residual) == len(fine)
+    assert measured_spectra.fit_summary(other)["nfev"] == result.nfev
+
+
+def test_coarse_stage_out_of_iterations(measured_spectra):
+    specname = list(measured_spectra.spectra)[0]
+    pixels = len(measured_spectra.get_measured_spectrum(specname))
+    result = measured_spectra.fit(specname, coarse={"binning": 2, "maxiter": 3})
+    assert result.ndata == pixels
+    assert measured_spectra.fit_summary(specname) is not None
+
+    # cancelled by iter_cb already in the coarse stage, the full data is skipped
+    result = measured_spectra.fit(
+        specname, coarse={"binning": 2}, iter_cb=lambda *args, **kwargs: True
+    )
+    assert result.aborted and len(result.residual) == pixels // 2
@@ -0,0 +1,33 @@
+import pandas
+import pytest
+from oes import profiling
+from oes.specdata import SpecDB
+
+
+def test_profile_stages():
+    spec_db = SpecDB("OHAX.db")
+    with profiling.profile() as prof:
+        spec_db.get_spectrum(Trot=3000, Tvib=3000, wmin=310, wmax=320)
+        spec_db.get_spectrum(Trot=3000, Tvib=3000, wmin=311, wmax=319)
+    spec_db.get_spectrum(Trot=2000, Tvib=3000, wmin=311, wmax=319)
+
+    assert not profiling.PROFILER.enabled
+    stats = prof.snapshot()
+    assert stats["SpecDB.get_spectrum"]["calls"] == 2
+    assert stats["SpecDB.fetch"]["calls"] == 1
+    assert stats["SpecDB.fetch"]["cache_hits"] == 1
+    assert stats["SpecDB.populations"]["cache_hits"] == 1
+    assert stats["SpecDB.get_spectrum"]["time"] > 0
+
+    report = profiling.report()
+    assert report.loc["SpecDB.get_spectrum", "time_per_call"] == pytest.approx(
+        stats["SpecDB.get_spectrum"]["time"] / 2
+    )
+
+
+def test_profile_merge():
+    profiler = profiling.Profiler()
+    profiler.record("stage", 1.0)
+    profiler.merge({"stage": {"calls": 2, "time": 0.5, "cache_hits": 3}})
+    assert profiler.snapshot() == {"stage": {"calls": 3, "time": 1.5, "cache_hits": 3}}
+    assert isinstance(profiler.report(), pandas.DataFrame)
@@ -0,0 +1,122 @@
+import numpy
+import pytest
+from oes import spectrum
+
+
+@pytest.fixture
+def lines():
+    x = numpy.array([310.0, 310.013, 310.5, 311.2477])
+    y = numpy.array([1.0, 0.5, 2.0, 0.7])
+    return x, y
+
+
+def test_render_lines_matches_fine_mesh(lines):
+    pixels = numpy.linspace(309, 312.5, 350)
+    step = pixels[1] - pixels[0]
+
+    fine = spectrum.Spectrum(x=lines[0], y=lines[1])
+    fine.refine_mesh(points_per_nm=1000)
+    fine.convolve_with_slit_function(gauss=0.03, lorentz=0.01, instrumental_step=step)
+    expected = spectrum.match_spectra(
+        fine, spectrum.Spectrum(x=pixels, y=numpy.zeros_like(pixels))
+    )[0].y
+
+    rendered = spectrum.render_lines(
+        lines[0], lines[1], pixels, gauss=0.03, lorentz=0.01, instrumental_step=step
+    )
+    assert rendered == pytest.approx(expected, abs=0.02 * expected.max())
+    assert rendered.sum() == pytest.approx(expected.sum(), rel=1e-3)
+
+
+def test_convolution_independent_of_mesh_width():
+    # the voigt profile is normalised over the window of the kernel, not over
+    # the mesh as before, a line keeps its area whatever the simulated range
+    sums = []
+    for width in (5, 10, 50):
+        x = 310 + numpy.arange(-500 * width, 500 * width + 1) * 1e-3
+        spec = spectrum.Spectrum(x=x, y=numpy.zeros(len(x)))
+        spec.y[len(x) // 2] = 1.0
+        spec.convolve_with_slit_function(gauss=0.025, lorentz=0.025)
+        sums.append(spec.y.sum())
+    assert sums == pytest.approx([sums[0]] * 3, rel=1e-12)
+    _, kernel = spectrum.slit_kernel(0.025, 0.025, 1e-3)
+    assert sums[0] == pytest.approx(kernel.sum(), rel=1e-12)
+    assert sums[0] == pytest.approx(0.9929, abs=1e-4)
+
+
+def test_slit_kernel_cache():
+    spectrum.clear_slit_kernel_cache()
+    first = spectrum.slit_kernel(0.02, 0.01, 1e-3, instrumental_step=0.02)
+    second = spectrum.slit_kernel(0.02, 0.01, 1e-3, instrumental_step=0.02)
+    assert first[1] is second[1]
+    assert not first[1].flags.writeable
+    spectrum.slit_kernel(0.03, 0.01, 1e-3, instrumental_step=0.02)
+
+    info = spectrum.slit_kernel_cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 2, 2)
+
+
+@pytest.mark.parametrize("ratio", [1e-6, 0.1, 1.0, 10.0, 1e3])
+def test_pseudo_voigt_within_documented_error(ratio):
+    nu = numpy.linspace(-3, 3, 6001)
+    exact = spectrum.voigt(nu, 0.05, 0.05 * ratio, 0.0, 1.0)
+    approx = spectrum.voigt(nu, 0.05, 0.05 * ratio, 0.0, 1.0, profile="pseudo_voigt")
+    assert numpy.abs(approx - exact).max() < 0.013 * exact.max()
+
+
+def test_slit_kernel_profiles():
+    exact_kernel = spectrum.slit_kernel(0.05, 0.02, 1e-3)
+    kernel = spectrum.slit_kernel(0.05, 0.02, 1e-3, profile="pseudo_voigt")
+    assert kernel[1] is not exact_kernel[1]
+    assert kernel[1][::-1] == pytest.approx(kernel[1], abs=1e-15)
+    with pytest.raises(ValueError):
+        spectrum.slit_kernel(0.05, 0.05, 1e-3, profile="humlicek")
+
+
+@pytest.mark.parametrize("equidistant", [True, False])
+def test_resampler_matches_padded_interpolation(equidistant):
+    rng = numpy.random.default_rng(0)
+    if equidistant:
+        source = numpy.linspace(305, 316, 1101)
+    else:
+        source = numpy.sort(rng.uniform(305, 316, 500))
+    values = rng.random(len(source))
+    pixels = numpy.linspace(304.9995, 316.5, 700)
+
+    # the padding of the simulated spectrum by zeros 1e-3 beyond its ends
+    padded_x = numpy.concatenate([[304.9], [source[0] - 1e-3], source])
+    padded_x = numpy.concatenate([padded_x, [source[-1] + 1e-3], [316.5]])
+    padded_y = numpy.concatenate([[0, 0], values, [0, 0]])
+    expected = numpy.interp(pixels, padded_x, padded_y)
+
+    simulated = spectrum.Spectrum(x=source, y=values)
+    resampler = spectrum.Resampler()
+    matched = spectrum.match_spectra(
+        simulated, spectrum.Spectrum(x=pixels, y=pixels), resampler=resampler
+    )[0]
+    assert matched.y == pytest.approx(expected, abs=1e-10)
+    assert simulated.x is source and len(simulated.y) == len(source)
+
+    out = numpy.empty(len(pixels))
+    resampler.update(source, pixels + 0.01)
+    assert resampler(values, out=out) is out
+    assert out == pytest.approx(numpy.interp(pixels + 0.01, padded_x, padded_y))
+
+
+@pytest.mark.parametrize("derivative", [False, True])
+def test_render_lines_invalid_widths(lines, derivative):
+    pixels = numpy.linspace(309, 312.5, 350)
+    rendered = spectrum.render_lines(
+        *lines, pixels, gauss=-0.5, lorentz=-0.5, derivative=derivative
+    )
+    assert numpy.isnan(rendered).all()
+
+
+def test_bin_pixels():
+    spec = spectrum.Spectrum(x=numpy.arange(7.0), y=numpy.arange(7.0) ** 2)
+    binned = spectrum.bin_pixels(spec, 3)
+    assert binned.x == pytest.approx([1, 4])
+    assert binned.y == pytest.approx([0 + 1 + 4, 9 + 16 + 25])
+    assert spectrum.bin_pixels(spec, 1) is spec
+    with pytest.raises(ValueError):
+        spectrum.bin_pixels(spec, 0)
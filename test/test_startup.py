@@ -0,0 +1,49 @@
+import pathlib
+import subprocess
+import sys
+
+SRC = pathlib.Path(__file__).resolve().parent.parent / "src"
+
+# the heavy dependencies are imported by the functions needing them
+LAZY = ("lmfit", "asteval", "pandas", "scipy")
+
+# cumulative import time of oes.cli without numpy, about 0.1 s today and
+# 0.8 s with the eager imports of the dependencies
+IMPORT_BUDGET = 0.4
+
+
+def run_python(code):
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=SRC,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def cumulative_time(importtime, module):
+    """seconds, from the output of python -X importtime"""
+    for line in importtime.splitlines():
+        _, cumulative, name = line.split("|")
+        if name.strip() == module:
+            return int(cumulative) / 1e6
+    raise KeyError(module)
+
+
+def test_no_heavy_imports():
+    loaded = run_python(
+        "import sys\n"
+        "from oes import cli\n"
+        "from oes.specdata import SpecDB\n"
+        "SpecDB('OHAX.db')\n"
+        "print(' '.join(sys.modules))"
+    ).stdout.split()
+    assert [m for m in loaded if m.split(".")[0] in LAZY] == []
+
+
+def test_import_time():
+    importtime = run_python("import oes.cli").stderr
+    elapsed = cumulative_time(importtime, "oes.cli")
+    elapsed -= cumulative_time(importtime, "numpy")
+    assert elapsed < IMPORT_BUDGET
@@ -0,0 +1,76 @@
+import numpy
+import pytest
+from oes.measured_spectra import MeasuredSpectra
+from oes.specdata import SpecDB
+from oes.surrogate import PopulationSurrogate
+import pathlib
+
+DATA_DIR = pathlib.Path(__file__).parent
+
+
+@pytest.fixture
+def oh_ax():
+    return SpecDB("OHAX.db", in_memory=True)
+
+
+@pytest.fixture
+def surrogate(oh_ax):
+    return PopulationSurrogate.from_specdb(oh_ax, 306, 320)
+
+
+@pytest.mark.parametrize("Trot, Tvib", [(300, 300), (1234.5, 4321), (10000, 8000)])
+def test_surrogate_spectrum(oh_ax, surrogate, Trot, Tvib):
+    expected = oh_ax.get_spectrum(Trot, Tvib, 305.5, 320.5, as_spectrum=False)
+    spec = surrogate.get_spectrum(Trot, Tvib, 305.5, 320.5, as_spectrum=False)
+    assert spec[:, 0] == pytest.approx(expected[:, 0])
+    assert spec[:, 1] == pytest.approx(expected[:, 1], rel=1e-4)
+
+    lines = surrogate.get_lines(Trot, Tvib, 305.5, 320.5)
+    expected_lines = oh_ax.get_lines(Trot, Tvib, 305.5, 320.5)
+    scale = numpy.abs(expected_lines["dy_dTrot"]).max()
+    assert lines["dy_dTrot"] == pytest.approx(
+        expected_lines["dy_dTrot"], abs=1e-2 * scale
+    )
+
+
+def test_surrogate_range(surrogate):
+    with pytest.raises(ValueError):
+        surrogate.get_spectrum(200, 1000, 306, 320)
+    with pytest.raises(ValueError):
+        surrogate.get_spectrum(1000, 1000, 290, 320)
+
+
+def test_surrogate_save_load(surrogate, tmp_path):
+    path = surrogate.save(tmp_path / "OHAX_surrogate.npz")
+    loaded = PopulationSurrogate.load(path)
+    assert loaded.specie_name == "OHAX"
+    spec = loaded.get_spectrum(2000, 3000, 306, 320)
+    assert spec.y == pytest.approx(surrogate.get_spectrum(2000, 3000, 306, 320).y)
+
+
+def test_fit_through_surrogate(oh_ax):
+    def load(sim):
+        measured = MeasuredSpectra.from_csv(
+            DATA_DIR / "OH_310nm_surfatron_80Hz_mod.csv"
+        )
+        specname = list(measured.spectra)[0]
+        measured.add_specie(sim, specname)
+        measured.spectra[specname]["params"]["wav_shift"].value = -0.02
+        measured.spectra[specname]["params"]["slitf_gauss"].value = 2.5e-2
+        return measured, specname
+
+    expected, specname = load(oh_ax)
+    spec = expected.get_measured_spectrum(specname)
+    surrogate = PopulationSurrogate.from_specdb(oh_ax, spec.x.min(), spec.x.max())
+    measured, _ = load(surrogate)
+    prms = measured.spectra[specname]["params"].prms
+
+    for kwargs in [{}, {"use_cache": False}, {"render_on_pixels": False}]:
+        reference = expected.get_residuals(prms.copy(), specname, **kwargs)
+        residuals = measured.get_residuals(prms.copy(), specname, **kwargs)
+        scale = numpy.abs(reference).max()
+        assert residuals == pytest.approx(reference, abs=1e-4 * scale)
+
+    start = numpy.sum(reference**2)
+    result = measured.fit(specname, render_on_pixels=False, maxiter=200)
+    assert result.chisqr < start